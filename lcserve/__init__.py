@@ -1,3 +1,7 @@
+from importlib import import_module
+from typing import TYPE_CHECKING
+
+
 def _ignore_warnings():
     import logging
     import warnings
@@ -12,8 +16,46 @@ def _ignore_warnings():
 
 _ignore_warnings()
 
-from .backend import download_df, job, serving, slackbot, upload_df
-from .backend.slackbot import SlackBot
-from .backend.slackbot.memory import MemoryMode, get_memory
-
 __version__ = '0.0.62'
+
+# Public names are imported on first access, so that `from lcserve import serving`
+# doesn't import slack, langchain & hubble for apps that don't use them.
+_LAZY_IMPORTS = {
+    'InvalidTokenError': '.backend',
+    'download_df': '.backend',
+    'job': '.backend',
+    'request_env': '.backend',
+    'serving': '.backend',
+    'slackbot': '.backend',
+    'upload_df': '.backend',
+    'SlackBot': '.backend.slackbot',
+    'MemoryMode': '.backend.slackbot.memory',
+    'get_memory': '.backend.slackbot.memory',
+}
+
+if TYPE_CHECKING:
+    from .backend import (
+        InvalidTokenError,
+        download_df,
+        job,
+        request_env,
+        serving,
+        slackbot,
+        upload_df,
+    )
+    from .backend.slackbot import SlackBot
+    from .backend.slackbot.memory import MemoryMode, get_memory
+
+
+def __getattr__(name: str):
+    if name not in _LAZY_IMPORTS:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+    value = getattr(import_module(_LAZY_IMPORTS[name], __name__), name)
+    # cached, `__getattr__` is only called for missing attributes
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_LAZY_IMPORTS))
@@ -962,6 +962,53 @@ def upload_df(module, name):
     upload_df_to_jcloud(module, name)
 
 
+@util.command(
+    name='profile-startup',
+    help='Profile the startup of an app: import times, model building per route & peak RSS.',
+)
+@click.argument(
+    'module_str',
+    type=str,
+    required=True,
+)
+@click.option(
+    '--output',
+    type=click.Path(),
+    default='startup-profile.json',
+    help='Path of the JSON report.',
+    show_default=True,
+)
+@click.option(
+    '--min-ms',
+    type=float,
+    default=10,
+    help='Hide imports that take less than this (in milliseconds).',
+    show_default=True,
+)
+@click.option(
+    '--max-import-time',
+    type=float,
+    default=None,
+    help='Fail if importing the app takes longer than this (in seconds), e.g. to catch regressions in CI.',
+)
+@click.help_option('-h', '--help')
+def profile_startup(module_str, output, min_ms, max_import_time):
+    from .profiling import print_report
+    from .profiling import profile_startup as _profile_startup
+
+    sys.path.append(os.getcwd())
+    report = _profile_startup(module_str)
+    print_report(report, min_ms=min_ms)
+    report.save(output)
+    print(f'Report saved to {output}')
+
+    if max_import_time is not None and report.import_time_s > max_import_time:
+        print(
+            f'Importing {module_str} took {report.import_time_s:.2f}s, more than {max_import_time}s'
+        )
+        sys.exit(1)
+
+
 @util.command(help='Create slack app manifest.')
 @click.option(
     '--name',
@@ -1,4 +1,43 @@
-from .agentexecutor import ChainExecutor, LangchainAgentExecutor
-from .decorators import job, serving, slackbot
-from .gateway import LangchainFastAPIGateway, PlaygroundGateway, ServingGateway
-from .utils import download_df, upload_df
+from importlib import import_module
+from typing import TYPE_CHECKING
+
+# Public names are imported on first access, so that the decorators don't pull in
+# the gateway (jina, langchain, ...) when an app is imported, e.g. by the CLI.
+_LAZY_IMPORTS = {
+    'ChainExecutor': '.agentexecutor',
+    'InvalidTokenError': '.cache',
+    'LangchainAgentExecutor': '.agentexecutor',
+    'job': '.decorators',
+    'serving': '.decorators',
+    'slackbot': '.decorators',
+    'LangchainFastAPIGateway': '.gateway',
+    'PlaygroundGateway': '.gateway',
+    'ServingGateway': '.gateway',
+    'request_env': '.playground.utils.helper',
+    'download_df': '.utils',
+    'upload_df': '.utils',
+}
+
+if TYPE_CHECKING or __name__ != 'lcserve.backend':
+    # jina loads this file from `py_modules` of the gateway config under another name,
+    # and finds the gateways & executors by `jtype`, so they're registered right away.
+    from .agentexecutor import ChainExecutor, LangchainAgentExecutor
+    from .cache import InvalidTokenError
+    from .decorators import job, serving, slackbot
+    from .gateway import LangchainFastAPIGateway, PlaygroundGateway, ServingGateway
+    from .playground.utils.helper import request_env
+    from .utils import download_df, upload_df
+
+
+def __getattr__(name: str):
+    if name not in _LAZY_IMPORTS:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+    value = getattr(import_module(_LAZY_IMPORTS[name], __name__), name)
+    # cached, `__getattr__` is only called for missing attributes
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_LAZY_IMPORTS))
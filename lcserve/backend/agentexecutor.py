@@ -1,4 +1,3 @@
-import threading
 from contextlib import nullcontext
 from typing import Any, Dict, Optional, Union, TYPE_CHECKING
 
@@ -177,20 +176,13 @@ class ChainExecutor(Executor):
 
 
 class LangchainAgentExecutor(Executor):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self._capture_lock = threading.Lock()
-
     @staticmethod
     def run_input(doc: 'Document') -> Dict:
         return doc.tags if DEFAULT_KEY not in doc.tags else doc.tags[DEFAULT_KEY]
 
     def get_capture_ctx(self) -> Capturing:
-        return (
-            nullcontext()
-            if self._capture_lock.locked()
-            else Capturing(lock=self._capture_lock)
-        )
+        # Capturing is per context, concurrent runs don't need to be serialized
+        return Capturing()
 
     def update_agent_output(
         self,
@@ -0,0 +1,198 @@
+"""Micro-batching of HTTP requests, set with `@serving(batch=True)`.
+
+The function takes lists and returns a list, one result per input:
+
+    @serving(batch=True, max_batch_size=64, max_wait_ms=5)
+    def embed(texts: List[str]) -> List[List[float]]:
+        return embeddings.embed_documents(texts)
+
+Each request sends a single item (`{"texts": "hello"}`) and gets a single result.
+Concurrent requests are collected into a batch until it has `max_batch_size` items,
+or until `max_wait_ms` after its first item, then the function is called once. An
+item of the returned list can be an exception, which is then the error of its
+request only.
+"""
+
+import asyncio
+import contextvars
+import inspect
+from dataclasses import dataclass, field
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Hashable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+
+if TYPE_CHECKING:
+    from opentelemetry.metrics import Histogram
+
+DEFAULT_MAX_BATCH_SIZE = 32
+DEFAULT_MAX_WAIT_MS = 10
+
+
+@dataclass
+class BatchConfig:
+    """Batching of a `@serving` route, set with `batch`, `max_batch_size` & `max_wait_ms`."""
+
+    max_batch_size: int = DEFAULT_MAX_BATCH_SIZE
+    # how long the first item of a batch waits for others
+    max_wait_ms: float = DEFAULT_MAX_WAIT_MS
+
+    @classmethod
+    def from_options(
+        cls,
+        batch: bool = False,
+        max_batch_size: Optional[int] = None,
+        max_wait_ms: Optional[float] = None,
+    ) -> Optional['BatchConfig']:
+        """None if the route isn't batched"""
+        if not batch:
+            return None
+
+        return cls(
+            max_batch_size=max_batch_size or DEFAULT_MAX_BATCH_SIZE,
+            max_wait_ms=DEFAULT_MAX_WAIT_MS if max_wait_ms is None else max_wait_ms,
+        )
+
+
+class BatchError(Exception):
+    pass
+
+
+def get_item_type(annotation: Any) -> Optional[Any]:
+    """`T` for a `List[T]` annotation, None for other annotations"""
+    if getattr(annotation, '__origin__', None) not in (list, List):
+        return None
+    _args = getattr(annotation, '__args__', None)
+    return _args[0] if _args else Any
+
+
+def get_batched_fields(func: Callable) -> Tuple[str, ...]:
+    """Parameters of a batch function that take one item per request, i.e. the lists"""
+    return tuple(
+        _name
+        for _name, _param in inspect.signature(func).parameters.items()
+        if get_item_type(_param.annotation) is not None
+    )
+
+
+@dataclass
+class _PendingBatch:
+    items: List[Any] = field(default_factory=list)
+    futures: List[asyncio.Future] = field(default_factory=list)
+    timer: Optional[asyncio.TimerHandle] = None
+
+
+class Batcher:
+    """Collects concurrent calls of a route into batches.
+
+    Items are only batched with items of the same key, e.g. the same envs. Batch
+    sizes are reported to the given histogram.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        config: BatchConfig,
+        batch_size_histogram: Optional['Histogram'] = None,
+    ):
+        """
+        :param name: name of the route, used in metrics and error messages
+        :param config: max size & wait of a batch
+        :param batch_size_histogram: histogram of the number of items per batch
+        """
+        self.name = name
+        self.config = config
+        self.batch_size_histogram = batch_size_histogram
+        self._attributes = {'route': name}
+        self._pending: Dict[Hashable, _PendingBatch] = {}
+        # running batches, referenced until they're done
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def submit(
+        self,
+        key: Hashable,
+        item: Any,
+        run_batch: Callable[[List[Any]], Awaitable[List[Any]]],
+    ) -> Any:
+        """Add an item to the batch of `key`, and wait for its result.
+
+        :param run_batch: called with the items of a batch, returns one result per item
+        """
+        loop = asyncio.get_running_loop()
+        batch = self._pending.get(key)
+        if batch is None:
+            batch = self._pending[key] = _PendingBatch()
+            batch.timer = loop.call_later(
+                self.config.max_wait_ms / 1000, self._flush, key, run_batch
+            )
+
+        future = loop.create_future()
+        batch.items.append(item)
+        batch.futures.append(future)
+        if len(batch.items) >= self.config.max_batch_size:
+            self._flush(key, run_batch)
+        return await future
+
+    def _flush(
+        self, key: Hashable, run_batch: Callable[[List[Any]], Awaitable[List[Any]]]
+    ):
+        batch = self._pending.pop(key, None)
+        if batch is None:
+            return
+        batch.timer.cancel()
+
+        # the batch belongs to no request in particular, it doesn't inherit the
+        # envs or the captured stdout of the one that filled it
+        task = contextvars.Context().run(
+            asyncio.ensure_future, self._run(batch, run_batch)
+        )
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(
+        self,
+        batch: _PendingBatch,
+        run_batch: Callable[[List[Any]], Awaitable[List[Any]]],
+    ):
+        # requests that are gone (e.g. their client disconnected) are left out
+        _waiting = [
+            (item, future)
+            for item, future in zip(batch.items, batch.futures)
+            if not future.done()
+        ]
+        if not _waiting:
+            return
+
+        if self.batch_size_histogram:
+            self.batch_size_histogram.record(len(_waiting), self._attributes)
+
+        _items = [item for item, _ in _waiting]
+        try:
+            results = await run_batch(_items)
+            if not isinstance(results, (list, tuple)) or len(results) != len(_items):
+                raise BatchError(
+                    f'Batch function `{self.name}` must return a list of '
+                    f'{len(_items)} results, one per input'
+                )
+        except asyncio.CancelledError:
+            for _, future in _waiting:
+                future.cancel()
+            raise
+        except Exception as e:
+            results = [e] * len(_items)
+
+        for (_, future), result in zip(_waiting, results):
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
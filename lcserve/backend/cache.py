@@ -0,0 +1,384 @@
+import hashlib
+import json
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from enum import Enum
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    Optional,
+    Tuple,
+    Union,
+)
+
+from starlette.exceptions import HTTPException
+
+from .concurrency import SingleFlight
+from .encoders import dumps, hash_key
+from .playground.utils.helper import run_function
+
+if TYPE_CHECKING:
+    from opentelemetry.metrics import Counter
+
+CACHE_DIR = '.lcserve-cache'
+# Header telling the client if the response was served from the cache
+CACHE_HEADER = 'X-Cache'
+
+
+class CacheBackend(str, Enum):
+    """CacheBackend is where cached responses are stored"""
+
+    MEMORY = 'memory'
+    DISK = 'disk'
+
+
+@dataclass(frozen=True)
+class CacheConfig:
+    """Result cache of a `@serving` route, set with `@serving(cache=...)`.
+
+    `cache=True` caches in memory, `cache='disk'` under the workspace, and a dict
+    sets any of the fields below, e.g. `cache={'backend': 'disk', 'ttl': 3600}`.
+    """
+
+    backend: CacheBackend = CacheBackend.MEMORY
+    # seconds after which an entry expires, never if None
+    ttl: Optional[float] = None
+    # total size of the cached responses, least recently used entries are evicted first
+    max_bytes: int = 64 * 1024 * 1024
+    # `envs` are left out of the key by default, as they usually hold secrets
+    include_envs: bool = False
+    # responses are shared between users by default
+    include_auth: bool = False
+
+    @classmethod
+    def parse(cls, cache: Union[bool, str, Dict, 'CacheConfig']) -> 'CacheConfig':
+        if isinstance(cache, CacheConfig):
+            return cache
+        elif cache is True:
+            return cls()
+        elif isinstance(cache, str):
+            return cls(backend=CacheBackend(cache))
+        elif isinstance(cache, dict):
+            _cache = dict(cache)
+            if 'backend' in _cache:
+                _cache['backend'] = CacheBackend(_cache['backend'])
+            return cls(**_cache)
+
+        raise ValueError(
+            f'Invalid cache {cache!r}, expected True, a backend name or a dict'
+        )
+
+
+class MemoryCache:
+    """In-memory LRU cache with a byte budget"""
+
+    blocking = False
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: 'OrderedDict[str, Tuple[Optional[float], bytes]]' = OrderedDict()
+        self._size = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        expires_at, value = entry
+        if expires_at is not None and expires_at < time.time():
+            self._pop(key)
+            return None
+
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: bytes, ttl: Optional[float] = None):
+        if len(value) > self.max_bytes:
+            return
+
+        self._pop(key)
+        self._entries[key] = (time.time() + ttl if ttl else None, value)
+        self._size += len(value)
+        while self._size > self.max_bytes:
+            self._pop(next(iter(self._entries)))
+
+    def _pop(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= len(entry[1])
+
+
+class DiskCache:
+    """On-disk cache, one file per entry, so that entries survive restarts.
+
+    Each file starts with the entry's expiry, the least recently used entries
+    (by atime) are evicted first once `max_bytes` is exceeded.
+    """
+
+    blocking = True
+    # expiry of the entry as a big-endian double, zero if it never expires
+    _header = struct.Struct('>d')
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(path, exist_ok=True)
+        # gets & puts run in worker threads
+        self._lock = threading.Lock()
+        self._size = sum(self._value_size(e.path) for e in self._entries())
+
+    def _entries(self) -> Iterator[os.DirEntry]:
+        # files being written by `put` end with `.tmp`
+        return (
+            e for e in os.scandir(self.path) if e.is_file() and e.name.endswith('.json')
+        )
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, f'{key}.json')
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._file(key)
+        try:
+            with open(path, 'rb') as f:
+                (expires_at,) = self._header.unpack(f.read(self._header.size))
+                if expires_at and expires_at < time.time():
+                    value = None
+                else:
+                    value = f.read()
+        except FileNotFoundError:
+            return None
+        except struct.error:
+            # truncated file, e.g. by a full disk
+            value = None
+
+        if value is None:
+            self._remove(path)
+            return None
+
+        try:
+            # the atime orders entries for eviction
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return value
+
+    def put(self, key: str, value: bytes, ttl: Optional[float] = None):
+        if len(value) > self.max_bytes:
+            return
+
+        path = self._file(key)
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(self._header.pack(time.time() + ttl if ttl else 0))
+            f.write(value)
+
+        with self._lock:
+            # the size of the replaced entry, if any, is only counted once
+            self._size += len(value) - self._value_size(path)
+            os.replace(tmp_path, path)
+            full = self._size > self.max_bytes
+        if full:
+            self._evict()
+
+    def _value_size(self, path: str) -> int:
+        try:
+            return max(0, os.stat(path).st_size - self._header.size)
+        except FileNotFoundError:
+            return 0
+
+    def _remove(self, path: str):
+        with self._lock:
+            size = self._value_size(path)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                return
+            self._size -= size
+
+    def _evict(self):
+        entries = sorted(self._entries(), key=lambda e: e.stat().st_atime)
+        for entry in entries:
+            if self._size <= self.max_bytes:
+                break
+            self._remove(entry.path)
+
+
+class RouteCache:
+    """Caches the successful results of a route, keyed on its validated input"""
+
+    def __init__(
+        self,
+        name: str,
+        config: CacheConfig,
+        workspace: str,
+        hit_counter: Optional['Counter'] = None,
+        miss_counter: Optional['Counter'] = None,
+    ):
+        self.name = name
+        self.config = config
+        if config.backend == CacheBackend.DISK:
+            self.backend = DiskCache(
+                os.path.join(workspace, CACHE_DIR, name), config.max_bytes
+            )
+        else:
+            self.backend = MemoryCache(config.max_bytes)
+        self.hit_counter = hit_counter
+        self.miss_counter = miss_counter
+
+    def key(self, input_data: Dict[str, Any], envs: Dict, auth_response: Any) -> str:
+        """Key from the validated input, the envs & auth response only if opted in.
+
+        The input is validated by the input model first, so equal inputs (e.g. with or
+        without default values) give the same key.
+        """
+        _key = {'input': input_data}
+        if self.config.include_envs:
+            _key['envs'] = envs
+        if self.config.include_auth:
+            _key['auth'] = auth_response
+        return hash_key(_key)
+
+    async def get(self, key: str) -> Optional[Tuple[Any, str]]:
+        """Return `(result, stdout)` of a cached call, None on a miss"""
+        if self.backend.blocking:
+            value = await run_function(self.backend.get, key=key)
+        else:
+            value = self.backend.get(key)
+
+        _counter = self.miss_counter if value is None else self.hit_counter
+        if _counter:
+            _counter.add(1, {'route': self.name})
+
+        if value is None:
+            return None
+
+        _entry = json.loads(value)
+        return _entry['result'], _entry['stdout']
+
+    async def put(self, key: str, result: Any, stdout: str):
+        value = dumps({'result': result, 'stdout': stdout})
+        if self.backend.blocking:
+            await run_function(
+                self.backend.put, key=key, value=value, ttl=self.config.ttl
+            )
+        else:
+            self.backend.put(key, value, ttl=self.config.ttl)
+
+
+class InvalidTokenError(Exception):
+    """Raised by an `auth` function to reject a token.
+
+    Only these rejections, and `HTTPException`s with a 401 or 403 status, are cached by
+    `AuthCache`, other errors (e.g. the identity provider being unreachable) call the
+    `auth` function again on the next request.
+    """
+
+
+def _get_rejection(e: Exception) -> Optional[Callable[[], Exception]]:
+    """Factory of the error rejecting a token again, if `e` is a rejection"""
+    if isinstance(e, InvalidTokenError):
+        message = str(e)
+        return lambda: InvalidTokenError(message)
+
+    if isinstance(e, HTTPException) and e.status_code in (401, 403):
+        cls, status_code, detail, headers = type(e), e.status_code, e.detail, e.headers
+        return lambda: cls(status_code=status_code, detail=detail, headers=headers)
+
+    return None
+
+
+# Seconds a rejected token is rejected again without calling the `auth` function
+DEFAULT_AUTH_NEGATIVE_TTL = 5
+
+
+class AuthCache:
+    """Caches the responses of an `auth` function per token, set with `@serving(auth_cache_ttl=...)`.
+
+    Tokens are kept hashed. Tokens rejected with `InvalidTokenError` (or an `HTTPException`
+    with a 401 or 403 status) are cached for
+    `negative_ttl`, so that they don't hit the `auth` function again right away. Concurrent
+    lookups of the same token share a single call.
+    """
+
+    def __init__(
+        self,
+        auth_func: Callable,
+        ttl: float,
+        negative_ttl: Optional[float] = None,
+        max_entries: int = 10000,
+    ):
+        """
+        :param auth_func: the `auth` function, called with `token=...`
+        :param ttl: seconds a valid token's response is reused
+        :param negative_ttl: seconds a rejected token is rejected without a call,
+            defaults to `DEFAULT_AUTH_NEGATIVE_TTL`, 0 to disable
+        :param max_entries: max tokens cached, least recently used ones are evicted first
+        """
+        self.auth_func = auth_func
+        self.ttl = ttl
+        self.negative_ttl = (
+            DEFAULT_AUTH_NEGATIVE_TTL if negative_ttl is None else negative_ttl
+        )
+        self.max_entries = max_entries
+        # token hash -> (expires at, valid, response or rejection factory)
+        self._entries: 'OrderedDict[str, Tuple[float, bool, Any]]' = OrderedDict()
+        self._single_flight = SingleFlight()
+
+    def _get(self, key: str) -> Optional[Tuple[bool, Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        expires_at, valid, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+
+        self._entries.move_to_end(key)
+        return valid, value
+
+    def _put(self, key: str, valid: bool, value: Any):
+        _ttl = self.ttl if valid else self.negative_ttl
+        if not _ttl:
+            return
+
+        self._entries[key] = (time.monotonic() + _ttl, valid, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def _call(self, key: str, token: str) -> Any:
+        try:
+            auth_response = await run_function(self.auth_func, token=token)
+        except Exception as e:
+            _rejection = _get_rejection(e)
+            # other errors may be transient, they aren't cached
+            if _rejection is not None:
+                self._put(key, False, _rejection)
+            raise
+
+        self._put(key, True, auth_response)
+        return auth_response
+
+    async def verify(self, token: str) -> Any:
+        """Return the `auth` function's response for the token, raise its error if invalid"""
+        key = hashlib.sha256(token.encode('utf-8')).hexdigest()
+        _cached = self._get(key)
+        if _cached is not None:
+            valid, value = _cached
+            if not valid:
+                # a new error per request, requests don't share tracebacks
+                raise value()
+            return value
+
+        auth_response, _ = await self._single_flight.do(
+            key, lambda: self._call(key, token)
+        )
+        return auth_response
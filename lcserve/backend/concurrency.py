@@ -0,0 +1,344 @@
+import asyncio
+import threading
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from enum import Enum
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Optional,
+    Tuple,
+    Union,
+)
+
+from .timing import Phase, record_phase
+
+if TYPE_CHECKING:
+    from opentelemetry.metrics import Counter, Histogram, UpDownCounter
+    from starlette.requests import Request
+
+
+class ErrorPolicy(str, Enum):
+    """ErrorPolicy is what requests waiting on a failed call get"""
+
+    # the error of the call is shared with all waiting requests
+    SHARE = 'share'
+    # waiting requests run the call again on their own
+    RETRY = 'retry'
+
+
+@dataclass(frozen=True)
+class SingleFlightConfig:
+    """Request coalescing of a `@serving` route, set with `@serving(single_flight=...)`.
+
+    `single_flight=True` uses the defaults, a dict sets any of the fields below,
+    e.g. `single_flight={'max_waiters': 50, 'error_policy': 'retry'}`.
+    """
+
+    # requests sharing a call, others run on their own; unbounded if None
+    max_waiters: Optional[int] = None
+    error_policy: ErrorPolicy = ErrorPolicy.SHARE
+
+    @classmethod
+    def parse(
+        cls, single_flight: Union[bool, Dict, 'SingleFlightConfig']
+    ) -> 'SingleFlightConfig':
+        if isinstance(single_flight, SingleFlightConfig):
+            return single_flight
+        elif single_flight is True:
+            return cls()
+        elif isinstance(single_flight, dict):
+            _single_flight = dict(single_flight)
+            if 'error_policy' in _single_flight:
+                _single_flight['error_policy'] = ErrorPolicy(
+                    _single_flight['error_policy']
+                )
+            return cls(**_single_flight)
+
+        raise ValueError(
+            f'Invalid single_flight {single_flight!r}, expected True or a dict'
+        )
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into a single in-flight call.
+
+    The first request for a key runs the call, requests arriving while it's in flight
+    wait for it and share its result. The call runs in its own task, so that it isn't
+    cancelled if the first request goes away while others are still waiting.
+    """
+
+    def __init__(self, config: SingleFlightConfig = SingleFlightConfig()):
+        self.config = config
+        self._calls: Dict[str, asyncio.Task] = {}
+        self._waiters: Dict[str, int] = {}
+
+    def _forget(self, key: str, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+            del self._waiters[key]
+
+    async def do(self, key: str, fn: Callable[[], Awaitable]) -> Tuple[Any, bool]:
+        """Run `fn` or wait for the in-flight call with the same key.
+
+        :return: the result and whether it was shared from another request's call
+        """
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            self._waiters[key] = 0
+            task.add_done_callback(lambda t: self._forget(key, t))
+            return await asyncio.shield(task), False
+
+        if (
+            self.config.max_waiters is not None
+            and self._waiters[key] >= self.config.max_waiters
+        ):
+            return await fn(), False
+
+        self._waiters[key] += 1
+        try:
+            return await asyncio.shield(task), True
+        except asyncio.CancelledError:
+            if task.cancelled():
+                # the call was cancelled, not this request
+                return await fn(), False
+            raise
+        except Exception:
+            if self.config.error_policy == ErrorPolicy.RETRY:
+                return await fn(), False
+            raise
+
+
+class AdmissionRejectedError(Exception):
+    """Raised when a route has reached its concurrency and queue limits."""
+
+    def __init__(self, name: str, max_queue: int, retry_after: int = 1):
+        super().__init__(
+            f'Route `{name}` is busy: {max_queue} requests are already waiting'
+        )
+        self.name = name
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Limits the requests a route runs at once, and the requests waiting for a slot.
+
+    Requests beyond `max_concurrency` wait in a queue, requests beyond `max_queue`
+    are rejected right away, so that bursts don't grow latency and memory for
+    everyone. The number of running and waiting requests, and the time spent waiting
+    are reported to the given instruments.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_concurrency: Optional[int] = None,
+        max_queue: Optional[int] = None,
+        retry_after: int = 1,
+        in_flight_counter: Optional['UpDownCounter'] = None,
+        queue_counter: Optional['UpDownCounter'] = None,
+        queue_wait_histogram: Optional['Histogram'] = None,
+    ):
+        """
+        :param name: name of the route, used in metrics and error messages
+        :param max_concurrency: max requests running at once, unlimited if None
+        :param max_queue: max requests waiting for a slot, unbounded if None
+        :param retry_after: seconds suggested to rejected clients
+        :param in_flight_counter: up-down counter of running requests
+        :param queue_counter: up-down counter of waiting requests
+        :param queue_wait_histogram: histogram of the time waited for a slot in seconds
+        """
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self.in_flight_counter = in_flight_counter
+        self.queue_counter = queue_counter
+        self.queue_wait_histogram = queue_wait_histogram
+        self._attributes = {'route': name}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._queued = 0
+
+    @property
+    def queued(self) -> int:
+        """Number of requests waiting for a slot"""
+        return self._queued
+
+    def _add(self, counter: Optional['UpDownCounter'], value: int):
+        if counter:
+            counter.add(value, self._attributes)
+
+    async def acquire(self):
+        if self.max_concurrency is None:
+            self._add(self.in_flight_counter, 1)
+            return
+
+        if self._semaphore is None:
+            # created on first use, so that it's bound to the serving loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        if self._semaphore.locked():
+            if self.max_queue is not None and self._queued >= self.max_queue:
+                raise AdmissionRejectedError(
+                    self.name, self.max_queue, retry_after=self.retry_after
+                )
+
+            self._queued += 1
+            self._add(self.queue_counter, 1)
+            started_at = time.perf_counter()
+            try:
+                await self._semaphore.acquire()
+            finally:
+                self._queued -= 1
+                self._add(self.queue_counter, -1)
+            _waited = time.perf_counter() - started_at
+            if self.queue_wait_histogram:
+                self.queue_wait_histogram.record(_waited, self._attributes)
+            record_phase(Phase.QUEUE, _waited)
+        else:
+            await self._semaphore.acquire()
+
+        self._add(self.in_flight_counter, 1)
+
+    def release(self):
+        self._add(self.in_flight_counter, -1)
+        if self._semaphore is not None:
+            self._semaphore.release()
+
+    @asynccontextmanager
+    async def admit(self):
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+
+# Seconds between checks of whether an HTTP client is still connected
+DISCONNECT_POLL_INTERVAL = 0.5
+
+
+class ClientDisconnectedError(Exception):
+    """Raised when a call was cancelled because its client disconnected."""
+
+
+class RequestCancelledError(Exception):
+    """Raised in a function once its request is cancelled, by the callback handlers.
+
+    Sync functions can also check `kwargs['cancel_event']` between steps.
+    """
+
+
+async def wait_for_http_disconnect(
+    request: 'Request', interval: float = DISCONNECT_POLL_INTERVAL
+):
+    """Return once the client of an HTTP request is gone"""
+    while not await request.is_disconnected():
+        await asyncio.sleep(interval)
+
+
+async def cancel_on_disconnect(
+    call: Awaitable, disconnected: Awaitable, cancel_event: threading.Event
+) -> Any:
+    """Await `call`, or cancel it as soon as `disconnected` is done.
+
+    Async functions are cancelled right away. Sync functions can't be interrupted in
+    their thread, `cancel_event` is set for them (and the callback handlers) to stop.
+    """
+    task = asyncio.ensure_future(call)
+    watcher = asyncio.ensure_future(disconnected)
+    try:
+        await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        cancel_event.set()
+        task.cancel()
+        raise
+    finally:
+        watcher.cancel()
+
+    if not task.done():
+        cancel_event.set()
+        task.cancel()
+        # let the call clean up, e.g. release its admission slot
+        await asyncio.gather(task, return_exceptions=True)
+        raise ClientDisconnectedError('Client disconnected, the call was cancelled')
+
+    return task.result()
+
+
+class CallTimeoutError(Exception):
+    """Raised when a call runs longer than the `timeout` of its route."""
+
+    def __init__(self, name: str, timeout: float):
+        super().__init__(f'Route `{name}` timed out after {timeout}s')
+        self.name = name
+        self.timeout = timeout
+        # what the function printed so far, set by HTTP routes
+        self.stdout = ''
+
+
+class CallTimeout:
+    """Stops the calls of a route that run longer than `timeout` seconds.
+
+    Async functions are cancelled. Sync functions can't be interrupted in their
+    thread, `cancel_event` is set for them (and the callback handlers) to stop.
+    Timeouts are counted in the given counter.
+    """
+
+    def __init__(
+        self, name: str, timeout: float, timeout_counter: Optional['Counter'] = None
+    ):
+        """
+        :param name: name of the route, used in metrics and error messages
+        :param timeout: max seconds a call runs, including the wait for a worker
+        :param timeout_counter: counter of the calls that timed out
+        """
+        self.name = name
+        self.timeout = timeout
+        self.timeout_counter = timeout_counter
+        self._attributes = {'route': name}
+
+    def _expired(self, cancel_event: Optional[threading.Event]) -> CallTimeoutError:
+        if cancel_event is not None:
+            cancel_event.set()
+        if self.timeout_counter:
+            self.timeout_counter.add(1, self._attributes)
+        return CallTimeoutError(self.name, self.timeout)
+
+    async def run(
+        self, call: Awaitable, cancel_event: Optional[threading.Event] = None
+    ) -> Any:
+        try:
+            return await asyncio.wait_for(call, self.timeout)
+        except asyncio.TimeoutError:
+            raise self._expired(cancel_event) from None
+
+    async def iterate(
+        self, iterator: AsyncIterator, cancel_event: Optional[threading.Event] = None
+    ) -> AsyncIterator:
+        """Yield the items of `iterator`, until `timeout` seconds after the first `__anext__`"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        _iterator = iterator.__aiter__()
+        try:
+            while True:
+                try:
+                    item = await asyncio.wait_for(
+                        _iterator.__anext__(), max(0.0, deadline - loop.time())
+                    )
+                except StopAsyncIteration:
+                    return
+                except asyncio.TimeoutError:
+                    raise self._expired(cancel_event) from None
+                yield item
+        finally:
+            if hasattr(_iterator, 'aclose'):
+                await _iterator.aclose()
@@ -1,6 +1,6 @@
 import inspect
 from functools import wraps
-from typing import Callable, Dict
+from typing import Callable, Dict, Union
 
 
 def serving(
@@ -9,7 +9,37 @@ def serving(
     websocket: bool = False,
     openai_tracing: bool = False,
     auth: Callable = None,
+    auth_cache_ttl: float = None,
+    auth_negative_ttl: float = None,
+    streaming: bool = False,
+    send_buffer_size: int = None,
+    flush_interval: float = None,
+    flush_max_bytes: int = None,
+    fast_response: bool = False,
+    cache: Union[bool, str, Dict] = None,
+    single_flight: Union[bool, Dict] = None,
+    max_concurrency: int = None,
+    max_queue: int = None,
+    upload_mode: str = None,
+    max_upload_size: int = None,
+    upload_spill_size: int = None,
+    multiplex: Union[bool, int] = False,
+    timeout: float = None,
+    batch: bool = False,
+    max_batch_size: int = None,
+    max_wait_ms: float = None,
+    executor: str = 'thread',
+    workers: int = None,
+    queue_size: int = None,
 ):
+    """Serve the function as an HTTP (or websocket) route.
+
+    The `envs` of a request are only visible to that request through `os.environ`, use
+    `request_env()` for subprocesses. The working directory (the directory of the app module)
+    is shared by the whole process: functions of apps in different directories running at
+    the same time see the directory of the last one to start, prefer absolute paths there.
+    """
+
     def decorator(func):
         @wraps(func)
         async def async_wrapper(*args, **kwargs):
@@ -32,6 +62,53 @@ def serving(
                 'openai_tracing': openai_tracing,
                 # If websocket is True, pass the callback handlers to the client.
                 'auth': auth,
+                # If auth_cache_ttl is set (in seconds), auth responses are reused per token.
+                'auth_cache_ttl': auth_cache_ttl,
+                # Seconds tokens rejected with InvalidTokenError (or a 401/403 HTTPException) are rejected without calling auth (5 by default).
+                'auth_negative_ttl': auth_negative_ttl,
+                # If streaming is True, HTTP routes stream the tokens sent to the streaming handlers.
+                # Generator functions are always streamed.
+                'streaming': streaming,
+                # Max frames buffered per websocket connection before the function has to wait for the client.
+                'send_buffer_size': send_buffer_size,
+                # If flush_interval is set (in seconds), streamed tokens are merged into one frame per interval,
+                # or per flush_max_bytes bytes.
+                'flush_interval': flush_interval,
+                'flush_max_bytes': flush_max_bytes,
+                # If fast_response is True, responses skip the output model validation and are encoded with orjson.
+                'fast_response': fast_response,
+                # If cache is set, successful results are cached, keyed on the validated input.
+                # True for an in-memory cache, 'disk' to cache under the workspace, or a dict (see CacheConfig).
+                'cache': cache,
+                # If single_flight is set, concurrent identical requests share a single call (see SingleFlightConfig).
+                'single_flight': single_flight,
+                # If max_concurrency is set, requests beyond it wait for a free slot. Beyond max_queue waiting requests,
+                # HTTP requests are rejected with 429 and websockets closed with 1013.
+                'max_concurrency': max_concurrency,
+                'max_queue': max_queue,
+                # If any upload option is set, the body is parsed as it's received, and files bigger than
+                # upload_spill_size bytes are written under the workspace. Bodies bigger than max_upload_size
+                # are rejected with 413. upload_mode is 'file' (UploadFile), 'stream' or 'mmap' (see UploadMode).
+                'upload_mode': upload_mode,
+                'max_upload_size': max_upload_size,
+                'upload_spill_size': upload_spill_size,
+                # If multiplex is set, websocket connections stay open and carry concurrent calls tagged with
+                # a client-chosen `__id__`, up to 16 (or multiplex, if an int) at once (see lcserve.backend.multiplex).
+                'multiplex': multiplex,
+                # If timeout is set (in seconds), calls running longer are stopped. HTTP routes respond with 504,
+                # and the output model's error, with the stdout (or the tokens) of the call so far.
+                'timeout': timeout,
+                # If batch is True, the function takes lists and returns a list, and concurrent HTTP requests
+                # (one item each) are collected into a call of up to max_batch_size items, waiting at most
+                # max_wait_ms for them (see lcserve.backend.batching).
+                'batch': batch,
+                'max_batch_size': max_batch_size,
+                'max_wait_ms': max_wait_ms,
+                # If workers or queue_size is set, sync functions get a dedicated thread pool.
+                # If executor is 'process', the function runs in a dedicated process pool.
+                'executor': executor,
+                'workers': workers,
+                'queue_size': queue_size,
             },
         }
         if websocket:
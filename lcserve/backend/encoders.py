@@ -0,0 +1,49 @@
+import hashlib
+import json
+from typing import Any, Dict
+
+from starlette.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(obj: Any) -> Any:
+    # types that aren't natively serializable (pydantic models, dataclasses, sets, ...)
+    from fastapi.encoders import jsonable_encoder
+
+    return jsonable_encoder(obj)
+
+
+def dumps(obj: Any) -> bytes:
+    """Encode to JSON with orjson if it's installed, with the stdlib json otherwise"""
+    if orjson is not None:
+        return orjson.dumps(
+            obj,
+            default=_default,
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY,
+        )
+
+    return json.dumps(
+        obj, default=_default, ensure_ascii=False, separators=(',', ':')
+    ).encode('utf-8')
+
+
+def fast_output(result: Any, error: str = '', stdout: str = '') -> Dict[str, Any]:
+    """The output of a route, built without validating it against the output model"""
+    return {'result': result, 'error': error, 'stdout': stdout}
+
+
+class ORJSONResponse(JSONResponse):
+    """JSONResponse encoded with `dumps`, skipping FastAPI's `jsonable_encoder` pass"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def hash_key(obj: Any) -> str:
+    """Stable hash of a JSON-like object, e.g. the input of a request"""
+    _raw = json.dumps(obj, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.sha256(_raw).hexdigest()
@@ -1,20 +1,29 @@
 import asyncio
 import inspect
+import itertools
 import json
 import os
 import shutil
+import threading
 import time
 import traceback
 import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from enum import Enum
-from functools import cached_property
+from functools import cached_property, partial
 from importlib import import_module
 from importlib.util import module_from_spec, spec_from_file_location
 from pathlib import Path
+from types import ModuleType
 from typing import (
     TYPE_CHECKING,
     Any,
+    AsyncIterator,
+    Awaitable,
     Callable,
+    Deque,
     Dict,
     List,
     Optional,
@@ -30,15 +39,42 @@ from jina.serve.runtimes.gateway.composite import CompositeGateway
 from jina.serve.runtimes.gateway.http.fastapi import FastAPIBaseGateway
 from opentelemetry.trace import get_current_span
 from pydantic import BaseModel, Field, ValidationError, create_model
-from starlette.types import ASGIApp, Receive, Scope, Send
+from starlette.responses import StreamingResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 from websockets.exceptions import ConnectionClosed
 
+from .batching import BatchConfig, Batcher, get_batched_fields, get_item_type
+from .cache import CACHE_HEADER, AuthCache, CacheConfig, RouteCache
+from .concurrency import (
+    AdmissionController,
+    AdmissionRejectedError,
+    CallTimeout,
+    CallTimeoutError,
+    ClientDisconnectedError,
+    ErrorPolicy,
+    SingleFlight,
+    SingleFlightConfig,
+    cancel_on_disconnect,
+    wait_for_http_disconnect,
+)
+from .encoders import ORJSONResponse, dumps, fast_output, hash_key
 from .langchain_helper import (
     AsyncStreamingWebsocketCallbackHandler,
     BuiltinsWrapper,
+    CancellationCallbackHandler,
     OpenAITracingCallbackHandler,
     StreamingWebsocketCallbackHandler,
     TracingCallbackHandler,
+    WebsocketSender,
+)
+from .multiplex import (
+    CANCEL_KEY,
+    ID_KEY,
+    CallEvent,
+    MultiplexedCalls,
+    MultiplexError,
+    TaggedSender,
+    get_max_calls,
 )
 from .playground.utils.helper import (
     AGENT_OUTPUT,
@@ -50,20 +86,56 @@ from .playground.utils.helper import (
     Capturing,
     ChangeDirCtxtManager,
     EnvironmentVarCtxtManager,
+    RequestDirCtxtManager,
+    RequestEnvCtxtManager,
     import_from_string,
+    install_environ_proxy,
     parse_uses_with,
     run_cmd,
     run_function,
+    uninstall_environ_proxy,
+)
+from .timing import (
+    DEFAULT_LATENCY_BUCKETS,
+    Phase,
+    create_histogram,
+    current_timer,
+    request_timer,
+    timed,
+)
+from .uploads import (
+    MalformedUploadError,
+    UploadConfig,
+    Uploads,
+    UploadTooLargeError,
+    get_upload_dir,
+    get_upload_openapi_extra,
+    is_ws_file_header,
+    parse_multipart,
+    receive_ws_file,
 )
 from .utils import fix_sys_path
+from .workers import (
+    DEFAULT_BUFFER_SIZE,
+    DEFAULT_POOL,
+    ExecutorType,
+    ProcessWorkerPool,
+    ThreadWorkerPool,
+    WorkerPoolFullError,
+)
 
 if TYPE_CHECKING:
     from fastapi import FastAPI
-    from opentelemetry.sdk.metrics import Counter
+    from opentelemetry.sdk.metrics import Counter, Histogram
     from opentelemetry.trace import Tracer
 
 cur_dir = os.path.dirname(__file__)
 
+SSE_MEDIA_TYPE = 'text/event-stream'
+NDJSON_MEDIA_TYPE = 'application/x-ndjson'
+# Seconds a websocket is read at a time while a call runs, `input` waits at most that long
+WS_DISCONNECT_POLL_INTERVAL = 0.1
+
 
 class RouteType(str, Enum):
     """RouteType is the type of route"""
@@ -72,6 +144,17 @@ class RouteType(str, Enum):
     WEBSOCKET = 'websocket'
 
 
+class StartupMode(str, Enum):
+    """StartupMode is when the routes of `@serving` functions are created"""
+
+    # before the server starts
+    EAGER = 'eager'
+    # on the first request to each route
+    LAZY = 'lazy'
+    # in the background once the server started, or on the first request if sooner
+    WARMUP = 'warmup'
+
+
 class PlaygroundGateway(Gateway):
     def __init__(self, **kwargs):
         from streamlit.file_util import get_streamlit_file_path
@@ -284,28 +367,57 @@ class ServingGateway(FastAPIBaseGateway):
         modules: Tuple[str] = None,
         fastapi_app_str: str = None,
         lcserve_app: bool = False,
+        workers: int = None,
+        queue_size: int = None,
+        single_flight: Union[bool, Dict] = None,
+        max_concurrency: int = None,
+        max_queue: int = None,
+        latency_buckets: List[float] = None,
+        startup_mode: str = StartupMode.EAGER,
+        parallel_imports: bool = False,
         *args,
         **kwargs,
     ):
         super().__init__(*args, **kwargs)
         self._modules = modules
+        self._single_flight = single_flight
+        # defaults for routes that don't set their own limits
+        self._max_concurrency = max_concurrency
+        self._max_queue = max_queue
+        self._latency_buckets = latency_buckets or DEFAULT_LATENCY_BUCKETS
         self._fastapi_app_str = fastapi_app_str
         self._lcserve_app = lcserve_app
+        self._worker_pools: Dict[str, Union[ThreadWorkerPool, ProcessWorkerPool]] = {}
+        # routes with the same auth function & ttl share the cached tokens
+        self._auth_caches: Dict[Tuple[Callable, float, Optional[float]], AuthCache] = {}
+        self._startup_mode = StartupMode(startup_mode)
+        # module imports aren't thread-safe in general (module-level state, import side effects)
+        self._parallel_imports = parallel_imports
+        self._lazy_routes: List[LazyRoute] = []
+        # request envs are overlaid on os.environ while the gateway is up
+        install_environ_proxy()
         fix_sys_path()
         self._init_fastapi_app()
         self._configure_cors()
         self._register_healthz()
         # _setup_metrics needs to be invoked before _register_modules since slack requires tracking metrics
         self._setup_metrics()
+        # default pool for sync functions that don't ask for a dedicated one
+        self._default_worker_pool = self._create_worker_pool(
+            DEFAULT_POOL, workers=workers, queue_size=queue_size
+        )
         self._register_modules()
+        if self._startup_mode == StartupMode.WARMUP and self._lazy_routes:
+            self.app.add_event_handler('startup', self._start_warmup)
         self._setup_logging()
 
     @property
     def app(self) -> 'FastAPI':
         return self._app
 
-    @property
+    @cached_property
     def workspace(self) -> str:
+        """Persistent storage on Jina AI Cloud, a temp dir for the lifetime of the gateway otherwise"""
         import tempfile
 
         if os.path.exists('/data/workspace'):
@@ -342,6 +454,18 @@ class ServingGateway(FastAPIBaseGateway):
         if not self.meter_provider:
             self.duration_counter = None
             self.request_counter = None
+            self.queue_wait_histogram = None
+            self.cache_hit_counter = None
+            self.cache_miss_counter = None
+            self.in_flight_counter = None
+            self.admission_queue_counter = None
+            self.admission_queue_wait_histogram = None
+            self.latency_histogram = None
+            self.phase_histogram = None
+            self.ws_first_frame_histogram = None
+            self.ws_frame_rate_histogram = None
+            self.timeout_counter = None
+            self.batch_size_histogram = None
             return
 
         FastAPIInstrumentor.instrument_app(
@@ -361,11 +485,250 @@ class ServingGateway(FastAPIBaseGateway):
             description="Lc-serve Request count",
         )
 
+        self.queue_wait_histogram = self.meter.create_histogram(
+            name="lcserve_executor_queue_wait_seconds",
+            description="Time sync functions wait for a free worker in seconds",
+            unit="s",
+        )
+
+        self.cache_hit_counter = self.meter.create_counter(
+            name="lcserve_cache_hit_count",
+            description="Lc-serve responses served from the result cache",
+        )
+
+        self.cache_miss_counter = self.meter.create_counter(
+            name="lcserve_cache_miss_count",
+            description="Lc-serve cacheable requests not found in the result cache",
+        )
+
+        self.in_flight_counter = self.meter.create_up_down_counter(
+            name="lcserve_in_flight_requests",
+            description="Lc-serve requests running per route",
+        )
+
+        self.admission_queue_counter = self.meter.create_up_down_counter(
+            name="lcserve_admission_queue_length",
+            description="Lc-serve requests waiting for a free slot per route",
+        )
+
+        self.admission_queue_wait_histogram = self.meter.create_histogram(
+            name="lcserve_admission_queue_wait_seconds",
+            description="Time requests wait for a free slot in seconds",
+            unit="s",
+        )
+
+        self.latency_histogram = create_histogram(
+            self.meter,
+            name="lcserve_request_latency_seconds",
+            description="Lc-serve request latency in seconds",
+            buckets=self._latency_buckets,
+        )
+
+        self.phase_histogram = create_histogram(
+            self.meter,
+            name="lcserve_request_phase_seconds",
+            description="Time spent in each phase of a request (parse, auth, queue, execute, serialize) in seconds",
+            buckets=self._latency_buckets,
+        )
+
+        self.ws_first_frame_histogram = create_histogram(
+            self.meter,
+            name="lcserve_ws_time_to_first_frame_seconds",
+            description="Time from a websocket request to its first frame in seconds",
+            buckets=self._latency_buckets,
+        )
+
+        self.ws_frame_rate_histogram = self.meter.create_histogram(
+            name="lcserve_ws_frames_per_second",
+            description="Frames sent per second over a websocket connection",
+        )
+
+        self.timeout_counter = self.meter.create_counter(
+            name="lcserve_timeout_count",
+            description="Lc-serve calls stopped by the route timeout",
+        )
+
+        self.batch_size_histogram = self.meter.create_histogram(
+            name="lcserve_batch_size",
+            description="Requests per call of batch functions",
+        )
+
         self.app.add_middleware(
             MetricsMiddleware,
             duration_counter=self.duration_counter,
             request_counter=self.request_counter,
+            latency_histogram=self.latency_histogram,
+            phase_histogram=self.phase_histogram,
+        )
+
+    def _create_worker_pool(
+        self, name: str, workers: int = None, queue_size: int = None
+    ) -> ThreadWorkerPool:
+        pool = ThreadWorkerPool(
+            name=name,
+            max_workers=workers,
+            queue_size=queue_size,
+            queue_wait_histogram=self.queue_wait_histogram,
+        )
+        self._worker_pools[name] = pool
+        return pool
+
+    def _get_worker_pool(
+        self,
+        func: Callable,
+        executor: str = ExecutorType.THREAD,
+        workers: int = None,
+        queue_size: int = None,
+    ) -> Union[ThreadWorkerPool, ProcessWorkerPool]:
+        name = func.__name__
+        if ExecutorType(executor) == ExecutorType.PROCESS:
+            self.logger.info(
+                f'Starting a process pool for `{name}` with workers={workers}, queue_size={queue_size}'
+            )
+            pool = ProcessWorkerPool(
+                name,
+                func,
+                max_workers=workers,
+                queue_size=queue_size,
+                queue_wait_histogram=self.queue_wait_histogram,
+            )
+            pool.start()
+            self._worker_pools[name] = pool
+            return pool
+
+        if workers is None and queue_size is None:
+            return self._default_worker_pool
+
+        self.logger.info(
+            f'Creating a dedicated worker pool for `{name}` with workers={workers}, queue_size={queue_size}'
         )
+        return self._create_worker_pool(name, workers=workers, queue_size=queue_size)
+
+    def _get_route_cache(
+        self,
+        func: Callable,
+        cache: Union[bool, str, Dict, None],
+        cacheable: bool = True,
+    ) -> Optional[RouteCache]:
+        if not cache:
+            return None
+
+        if not cacheable:
+            self.logger.warning(
+                f'Cache ignored for `{func.__name__}`: only non-streaming HTTP routes without file uploads are cached'
+            )
+            return None
+
+        config = CacheConfig.parse(cache)
+        self.logger.info(f'Caching results of `{func.__name__}` with {config}')
+        return RouteCache(
+            func.__name__,
+            config,
+            workspace=self.workspace,
+            hit_counter=self.cache_hit_counter,
+            miss_counter=self.cache_miss_counter,
+        )
+
+    def _get_auth_cache(
+        self, auth: Callable, ttl: float, negative_ttl: Optional[float]
+    ) -> AuthCache:
+        if (auth, ttl, negative_ttl) not in self._auth_caches:
+            self.logger.info(f'Caching responses of `{auth.__name__}` for {ttl}s')
+            self._auth_caches[(auth, ttl, negative_ttl)] = AuthCache(
+                auth, ttl=ttl, negative_ttl=negative_ttl
+            )
+        return self._auth_caches[(auth, ttl, negative_ttl)]
+
+    def _create_admission_controller(
+        self, func: Callable, max_concurrency: int = None, max_queue: int = None
+    ) -> AdmissionController:
+        max_concurrency = max_concurrency or self._max_concurrency
+        max_queue = max_queue if max_queue is not None else self._max_queue
+        if max_concurrency:
+            self.logger.info(
+                f'Limiting `{func.__name__}` to {max_concurrency} concurrent requests, max_queue={max_queue}'
+            )
+        return AdmissionController(
+            func.__name__,
+            max_concurrency=max_concurrency,
+            max_queue=max_queue,
+            in_flight_counter=self.in_flight_counter,
+            queue_counter=self.admission_queue_counter,
+            queue_wait_histogram=self.admission_queue_wait_histogram,
+        )
+
+    def _create_call_timeout(
+        self, func: Callable, timeout: float = None
+    ) -> Optional[CallTimeout]:
+        if not timeout:
+            return None
+
+        self.logger.info(f'Stopping calls of `{func.__name__}` after {timeout}s')
+        return CallTimeout(
+            func.__name__, timeout=timeout, timeout_counter=self.timeout_counter
+        )
+
+    def _create_batcher(
+        self,
+        call_plan: 'CallPlan',
+        batch_config: Optional[BatchConfig],
+        streaming: bool = False,
+    ) -> Optional[Batcher]:
+        if batch_config is None:
+            return None
+
+        _name = call_plan.func.__name__
+        if call_plan.is_generator or call_plan.file_fields:
+            raise ValueError(
+                f'Batch function `{_name}` can not be a generator or take files.'
+            )
+        if streaming:
+            # the tokens of a batch can't be told apart per request
+            raise ValueError(f'Batch function `{_name}` can not be streamed.')
+        if not call_plan.batched_fields:
+            raise ValueError(
+                f'Batch function `{_name}` must take at least one `List` parameter, '
+                'with one item per request.'
+            )
+
+        self.logger.info(
+            f'Batching calls of `{_name}` on {", ".join(call_plan.batched_fields)} '
+            f'with max_batch_size={batch_config.max_batch_size}, max_wait_ms={batch_config.max_wait_ms}'
+        )
+        return Batcher(
+            _name, batch_config, batch_size_histogram=self.batch_size_histogram
+        )
+
+    def _get_single_flight(
+        self,
+        func: Callable,
+        single_flight: Union[bool, Dict, None],
+        shareable: bool = True,
+    ) -> Optional[SingleFlight]:
+        # routes that don't set it follow the gateway's setting
+        if single_flight is None:
+            single_flight = self._single_flight
+
+        if not single_flight:
+            return None
+
+        if not shareable:
+            self.logger.debug(
+                f'Single-flight ignored for `{func.__name__}`: only non-streaming HTTP routes without file uploads are coalesced'
+            )
+            return None
+
+        config = SingleFlightConfig.parse(single_flight)
+        self.logger.info(
+            f'Coalescing identical requests to `{func.__name__}` with {config}'
+        )
+        return SingleFlight(config)
+
+    async def shutdown(self):
+        await super().shutdown()
+        for pool in self._worker_pools.values():
+            pool.shutdown(wait=False)
+        uninstall_environ_proxy()
 
     def _setup_logging(self):
         self.app.add_middleware(LoggingMiddleware, logger=self.logger)
@@ -400,35 +763,108 @@ class ServingGateway(FastAPIBaseGateway):
             return
 
         self.logger.debug(f'Loading modules/files: {",".join(self._modules)}')
-        for mod in self._modules:
-            # TODO: add support for registering a directory
-            if Path(mod).is_file() and mod.endswith('.py'):
-                self._register_file(Path(mod))
-            else:
-                self._register_mod(mod)
+        started_at = time.perf_counter()
+        if not self._parallel_imports or len(self._modules) < 2:
+            loaded = [self._load_module(mod) for mod in self._modules]
+        else:
+            # imports wait on disk & native extensions, overlapping them cuts the cold start
+            with ThreadPoolExecutor(
+                max_workers=len(self._modules), thread_name_prefix='lcserve-import'
+            ) as executor:
+                loaded = list(executor.map(self._load_module, self._modules))
+
+        for _loaded in loaded:
+            if _loaded is None:
+                continue
+            app_module, dirname = _loaded
+            for _, func in inspect.getmembers(app_module, inspect.isfunction):
+                self._register_func(func, dirname=dirname)
+
+        self.logger.info(
+            f'Loaded {len(self._modules)} modules/files in {time.perf_counter() - started_at:.2f}s '
+            f'(startup mode: {self._startup_mode.value}, parallel imports: {self._parallel_imports})'
+        )
+
+    def _load_module(self, mod: str) -> Optional[Tuple[ModuleType, str]]:
+        started_at = time.perf_counter()
+        # TODO: add support for registering a directory
+        if Path(mod).is_file() and mod.endswith('.py'):
+            loaded = self._load_file(Path(mod))
+        else:
+            loaded = self._load_mod(mod)
+        self.logger.info(f'Imported `{mod}` in {time.perf_counter() - started_at:.2f}s')
+        return loaded
 
-    def _register_mod(self, mod: str):
+    def _load_mod(self, mod: str) -> Optional[Tuple[ModuleType, str]]:
         try:
             app_module = import_module(mod)
-            for _, func in inspect.getmembers(app_module, inspect.isfunction):
-                self._register_func(func, dirname=os.path.dirname(app_module.__file__))
+            return app_module, os.path.dirname(app_module.__file__)
         except ModuleNotFoundError as e:
             import traceback
 
             traceback.print_exc()
             self.logger.error(f'Unable to import module: {mod} as {e}')
 
-    def _register_file(self, file: Path):
+    def _load_file(self, file: Path) -> Optional[Tuple[ModuleType, str]]:
         try:
             spec = spec_from_file_location(file.stem, file)
             mod = module_from_spec(spec)
             spec.loader.exec_module(mod)
-            for _, func in inspect.getmembers(mod, inspect.isfunction):
-                self._register_func(func, dirname=os.path.dirname(file))
+            return mod, os.path.dirname(file)
         except Exception as e:
             self.logger.error(f'Unable to import {file}: {e}')
 
-    def _register_func(self, func: Callable, dirname: str = None):
+    def _register_lazy_route(self, func: Callable, dirname: str, route_type: RouteType):
+        """Register a placeholder, replaced by the route on first use or on warmup"""
+        from starlette.routing import Route, WebSocketRoute
+
+        def _register():
+            # routes are matched in order, the placeholder serves until it's removed
+            self._register_func(func, dirname=dirname, lazy=False)
+            self.app.router.routes.remove(placeholder)
+            # the cached schema doesn't have the new route
+            self.app.openapi_schema = None
+
+        lazy_route = LazyRoute(func.__name__, _register, router=self.app.router)
+        path = f'/{func.__name__}'
+        if route_type == RouteType.WEBSOCKET:
+            # the dry run of apps with websockets is a websocket too
+            self._update_dry_run_with_ws()
+            placeholder = WebSocketRoute(path, lazy_route)
+        else:
+            placeholder = Route(
+                path, lazy_route, methods=['POST'], include_in_schema=False
+            )
+
+        self.logger.debug(f'Deferring {route_type.value} route: {func.__name__}')
+        self.app.router.routes.append(placeholder)
+        self._lazy_routes.append(lazy_route)
+
+    async def _start_warmup(self):
+        self._warmup_task = asyncio.create_task(self._warmup())
+
+    async def _warmup(self):
+        started_at = time.perf_counter()
+        for lazy_route in self._lazy_routes:
+            try:
+                lazy_route.register()
+            except Exception as e:
+                self.logger.error(f'Unable to register `{lazy_route.name}`: {e}')
+            # requests are served in between routes
+            await asyncio.sleep(0)
+        self.logger.info(
+            f'Warmed up {len(self._lazy_routes)} routes in {time.perf_counter() - started_at:.2f}s'
+        )
+
+    def _register_func(self, func: Callable, dirname: str = None, lazy: bool = None):
+        if lazy is None:
+            lazy = self._startup_mode != StartupMode.EAGER
+
+        if lazy and hasattr(func, '__serving__'):
+            return self._register_lazy_route(func, dirname, RouteType.HTTP)
+        elif lazy and hasattr(func, '__ws_serving__'):
+            return self._register_lazy_route(func, dirname, RouteType.WEBSOCKET)
+
         def _get_decorator_params(func):
             if hasattr(func, '__serving__'):
                 return getattr(func, '__serving__').get('params', {})
@@ -444,17 +880,53 @@ class ServingGateway(FastAPIBaseGateway):
                 func,
                 dirname=dirname,
                 auth=_decorator_params.get('auth', None),
+                auth_cache_ttl=_decorator_params.get('auth_cache_ttl', None),
+                auth_negative_ttl=_decorator_params.get('auth_negative_ttl', None),
                 openai_tracing=_decorator_params.get('openai_tracing', False),
+                streaming=_decorator_params.get('streaming', False),
+                flush_interval=_decorator_params.get('flush_interval', None),
+                flush_max_bytes=_decorator_params.get('flush_max_bytes', None),
+                fast_response=_decorator_params.get('fast_response', False),
+                cache=_decorator_params.get('cache', None),
+                single_flight=_decorator_params.get('single_flight', None),
+                max_concurrency=_decorator_params.get('max_concurrency', None),
+                max_queue=_decorator_params.get('max_queue', None),
+                upload_mode=_decorator_params.get('upload_mode', None),
+                max_upload_size=_decorator_params.get('max_upload_size', None),
+                upload_spill_size=_decorator_params.get('upload_spill_size', None),
+                timeout=_decorator_params.get('timeout', None),
+                batch=_decorator_params.get('batch', False),
+                max_batch_size=_decorator_params.get('max_batch_size', None),
+                max_wait_ms=_decorator_params.get('max_wait_ms', None),
+                executor=_decorator_params.get('executor', ExecutorType.THREAD),
+                workers=_decorator_params.get('workers', None),
+                queue_size=_decorator_params.get('queue_size', None),
             )
         elif hasattr(func, '__ws_serving__'):
             self._register_ws_route(
                 func,
                 dirname=dirname,
                 auth=_decorator_params.get('auth', None),
+                auth_cache_ttl=_decorator_params.get('auth_cache_ttl', None),
+                auth_negative_ttl=_decorator_params.get('auth_negative_ttl', None),
                 include_ws_callback_handlers=_decorator_params.get(
                     'include_ws_callback_handlers', False
                 ),
                 openai_tracing=_decorator_params.get('openai_tracing', False),
+                send_buffer_size=_decorator_params.get('send_buffer_size', None),
+                flush_interval=_decorator_params.get('flush_interval', None),
+                flush_max_bytes=_decorator_params.get('flush_max_bytes', None),
+                fast_response=_decorator_params.get('fast_response', False),
+                max_concurrency=_decorator_params.get('max_concurrency', None),
+                max_queue=_decorator_params.get('max_queue', None),
+                upload_mode=_decorator_params.get('upload_mode', None),
+                max_upload_size=_decorator_params.get('max_upload_size', None),
+                upload_spill_size=_decorator_params.get('upload_spill_size', None),
+                multiplex=_decorator_params.get('multiplex', False),
+                timeout=_decorator_params.get('timeout', None),
+                executor=_decorator_params.get('executor', ExecutorType.THREAD),
+                workers=_decorator_params.get('workers', None),
+                queue_size=_decorator_params.get('queue_size', None),
             )
         elif hasattr(func, '__slackbot__'):
             self._register_slackbot(
@@ -477,6 +949,7 @@ class ServingGateway(FastAPIBaseGateway):
         dirname: str = None,
         auth: Callable = None,
         openai_tracing: bool = False,
+        streaming: bool = False,
         **kwargs,
     ):
         return self._register_route(
@@ -485,6 +958,7 @@ class ServingGateway(FastAPIBaseGateway):
             auth=auth,
             route_type=RouteType.HTTP,
             openai_tracing=openai_tracing,
+            streaming=streaming,
             **kwargs,
         )
 
@@ -495,6 +969,7 @@ class ServingGateway(FastAPIBaseGateway):
         auth: Callable = None,
         include_ws_callback_handlers: bool = False,
         openai_tracing: bool = False,
+        send_buffer_size: int = None,
         **kwargs,
     ):
         return self._register_route(
@@ -504,6 +979,7 @@ class ServingGateway(FastAPIBaseGateway):
             route_type=RouteType.WEBSOCKET,
             include_ws_callback_handlers=include_ws_callback_handlers,
             openai_tracing=openai_tracing,
+            send_buffer_size=send_buffer_size,
             **kwargs,
         )
 
@@ -515,6 +991,28 @@ class ServingGateway(FastAPIBaseGateway):
         route_type: RouteType = RouteType.HTTP,
         include_ws_callback_handlers: bool = False,
         openai_tracing: bool = False,
+        streaming: bool = False,
+        send_buffer_size: int = None,
+        flush_interval: float = None,
+        flush_max_bytes: int = None,
+        fast_response: bool = False,
+        cache: Union[bool, str, Dict] = None,
+        single_flight: Union[bool, Dict] = None,
+        max_concurrency: int = None,
+        max_queue: int = None,
+        auth_cache_ttl: float = None,
+        auth_negative_ttl: float = None,
+        upload_mode: str = None,
+        max_upload_size: int = None,
+        upload_spill_size: int = None,
+        multiplex: Union[bool, int] = False,
+        timeout: float = None,
+        batch: bool = False,
+        max_batch_size: int = None,
+        max_wait_ms: float = None,
+        executor: str = ExecutorType.THREAD,
+        workers: int = None,
+        queue_size: int = None,
         **kwargs,
     ):
         _name = func.__name__.title().replace('_', '')
@@ -524,37 +1022,102 @@ class ServingGateway(FastAPIBaseGateway):
             self.logger.debug(f'Route {_name} already registered. Skipping...')
             return
 
-        class Config:
-            arbitrary_types_allowed = True
-
-        _input_fields, _file_fields = _get_input_model_fields(func)
+        batch_config = BatchConfig.from_options(
+            batch=batch, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms
+        )
+        if batch_config is not None and route_type != RouteType.HTTP:
+            self.logger.warning(
+                f'Batching ignored for `{func.__name__}`: only HTTP routes are batched'
+            )
+            batch_config = None
 
+        input_model, output_model, _file_fields = _create_models(
+            func, batch=batch_config is not None
+        )
         file_params = _get_file_field_params(_file_fields)
-        input_model = create_model(
-            f'Input{_name}',
-            __config__=Config,
-            **_input_fields,
-            **{'envs': (Dict[str, str], Field(default={}, alias='envs'))},
+
+        call_plan = CallPlan.from_func(
+            func,
+            input_model=input_model,
+            output_model=output_model,
+            file_fields=tuple(_file_fields.keys()),
+            required_file_fields=tuple(
+                _name
+                for _name, (_, _default) in _file_fields.items()
+                if _default is ...
+            ),
+            batched_fields=(
+                get_batched_fields(func) if batch_config is not None else ()
+            ),
         )
+        if call_plan.is_generator and ExecutorType(executor) == ExecutorType.PROCESS:
+            raise ValueError(
+                f'Generator function `{func.__name__}` can not run in a process pool, '
+                'as generators can not be sent back to the gateway.'
+            )
+        if call_plan.file_fields and ExecutorType(executor) == ExecutorType.PROCESS:
+            raise ValueError(
+                f'Function `{func.__name__}` can not run in a process pool, '
+                'as uploaded files can not be sent to other processes.'
+            )
 
-        output_model = create_model(
-            f'Output{_name}',
-            __config__=Config,
-            **_get_output_model_fields(func),
+        worker_pool = self._get_worker_pool(
+            func, executor=executor, workers=workers, queue_size=queue_size
+        )
+        if auth is not None and auth_cache_ttl:
+            auth = self._get_auth_cache(auth, auth_cache_ttl, auth_negative_ttl).verify
+        # Results can only be cached or shared between requests for plain HTTP routes
+        _shareable = route_type == RouteType.HTTP and not (
+            streaming or call_plan.is_generator or call_plan.file_fields
+        )
+        route_cache = self._get_route_cache(func, cache, cacheable=_shareable)
+        single_flight = self._get_single_flight(
+            func, single_flight, shareable=_shareable
+        )
+        admission = self._create_admission_controller(
+            func, max_concurrency=max_concurrency, max_queue=max_queue
+        )
+        call_timeout = self._create_call_timeout(func, timeout)
+        batcher = self._create_batcher(call_plan, batch_config, streaming=streaming)
+        streaming_handler_kwargs = {'flush_interval': flush_interval}
+        if flush_max_bytes is not None:
+            streaming_handler_kwargs['flush_max_bytes'] = flush_max_bytes
+        upload_config = UploadConfig.from_options(
+            upload_mode=upload_mode,
+            max_upload_size=max_upload_size,
+            upload_spill_size=upload_spill_size,
         )
+        if upload_config is not None and not _file_fields:
+            self.logger.warning(
+                f'Upload options ignored for `{func.__name__}`: it has no `UploadFile` parameters'
+            )
+            upload_config = None
+        elif (
+            upload_config is None and _file_fields and route_type == RouteType.WEBSOCKET
+        ):
+            # websocket files are always received by lc-serve
+            upload_config = UploadConfig()
 
         if route_type == RouteType.HTTP:
             self.logger.info(f'Registering HTTP route: {func.__name__}')
 
             create_http_route(
                 app=self.app,
-                func=func,
+                call_plan=call_plan,
                 dirname=dirname,
                 auth_func=auth,
                 file_params=file_params,
-                input_model=input_model,
-                output_model=output_model,
+                upload_config=upload_config,
+                worker_pool=worker_pool,
                 openai_tracing=openai_tracing,
+                streaming=streaming,
+                streaming_handler_kwargs=streaming_handler_kwargs,
+                fast_response=fast_response,
+                route_cache=route_cache,
+                single_flight=single_flight,
+                admission=admission,
+                call_timeout=call_timeout,
+                batcher=batcher,
                 post_kwargs={
                     'path': f'/{func.__name__}',
                     'name': _name,
@@ -572,17 +1135,25 @@ class ServingGateway(FastAPIBaseGateway):
 
             create_websocket_route(
                 app=self.app,
-                func=func,
+                call_plan=call_plan,
                 dirname=dirname,
                 auth=auth,
-                input_model=input_model,
-                output_model=output_model,
+                worker_pool=worker_pool,
                 ws_kwargs={
                     'path': f'/{func.__name__}',
                     'name': _name,
                 },
                 include_ws_callback_handlers=include_ws_callback_handlers,
                 openai_tracing=openai_tracing,
+                send_buffer_size=send_buffer_size or DEFAULT_BUFFER_SIZE,
+                streaming_handler_kwargs=streaming_handler_kwargs,
+                fast_response=fast_response,
+                upload_config=upload_config,
+                multiplex_max_calls=get_max_calls(multiplex),
+                admission=admission,
+                call_timeout=call_timeout,
+                first_frame_histogram=self.ws_first_frame_histogram,
+                frame_rate_histogram=self.ws_frame_rate_histogram,
                 workspace=self.workspace,
                 logger=self.logger,
                 tracer=self.tracer,
@@ -709,28 +1280,68 @@ class ServingGateway(FastAPIBaseGateway):
                 return {"message": 'Job was created!', "job_id": job_response["name"]}
 
 
-def _get_files_data(kwargs: Dict) -> Dict:
-    from fastapi import UploadFile
-    from starlette.datastructures import UploadFile as StarletteUploadFile
+@dataclass(frozen=True)
+class CallPlan:
+    """Per-route call plan, built once in `_register_route`.
+
+    It holds everything the request path needs to call the function, so that
+    requests only fill in values instead of introspecting the function again.
+    """
+
+    func: Callable
+    input_model: Type[BaseModel]
+    output_model: Type[BaseModel]
+    file_fields: Tuple[str, ...] = ()
+    required_file_fields: Tuple[str, ...] = ()
+    # list parameters of batch functions, one item per request
+    batched_fields: Tuple[str, ...] = ()
+    inject_auth_response: bool = False
+    inject_workspace: bool = False
+    inject_extras: bool = False
+    is_generator: bool = False
+
+    @classmethod
+    def from_func(
+        cls,
+        func: Callable,
+        input_model: Type[BaseModel],
+        output_model: Type[BaseModel],
+        file_fields: Tuple[str, ...] = (),
+        required_file_fields: Tuple[str, ...] = (),
+        batched_fields: Tuple[str, ...] = (),
+    ) -> 'CallPlan':
+        # Read functions signature and check if `auth_response`, `workspace` or kwargs is present
+        _func_params_names = inspect.signature(func).parameters.keys()
+        _has_kwargs = 'kwargs' in _func_params_names
+        # `@serving` wraps the function, look at the original one to detect generators
+        _unwrapped = inspect.unwrap(func)
+        return cls(
+            func=func,
+            input_model=input_model,
+            output_model=output_model,
+            file_fields=tuple(file_fields),
+            required_file_fields=tuple(required_file_fields),
+            batched_fields=tuple(batched_fields),
+            inject_auth_response=_has_kwargs or 'auth_response' in _func_params_names,
+            inject_workspace=_has_kwargs or 'workspace' in _func_params_names,
+            inject_extras=_has_kwargs,
+            is_generator=inspect.isgeneratorfunction(_unwrapped)
+            or inspect.isasyncgenfunction(_unwrapped),
+        )
 
-    _files_data = {}
-    for k, v in kwargs.items():
-        if isinstance(v, (UploadFile, StarletteUploadFile)):
-            _files_data[k] = v
 
-    return _files_data
+def _get_files_data(call_plan: CallPlan, kwargs: Dict) -> Dict:
+    return {k: kwargs[k] for k in call_plan.file_fields if kwargs.get(k) is not None}
 
 
 def _get_func_data(
-    func: Callable,
+    call_plan: CallPlan,
     input_data: Union[str, Dict, BaseModel],
     files_data: Dict,
     auth_response: Any = None,
     workspace: str = None,
     to_support_in_kwargs: Dict = {},
 ) -> Tuple[Dict[str, Any], Dict[str, str]]:
-    import json
-
     if isinstance(input_data, BaseModel):
         _func_data = dict(input_data)
     elif isinstance(input_data, str):
@@ -743,31 +1354,64 @@ def _get_func_data(
     if files_data:
         _func_data.update(files_data)
 
-    # Read functions signature and check if `auth_response` is required or kwargs is present
-    _func_params_names = list(inspect.signature(func).parameters.keys())
-    if 'auth_response' in _func_params_names:
+    if call_plan.inject_auth_response:
         _func_data['auth_response'] = auth_response
-    elif 'kwargs' in _func_params_names:
-        _func_data.update({'auth_response': auth_response})
 
     # Workspace handle
-    if 'workspace' in _func_params_names:
+    if call_plan.inject_workspace:
         _func_data['workspace'] = workspace
-    elif 'kwargs' in _func_params_names:
-        _func_data.update({'workspace': workspace})
 
     # Populate extra kwargs
-    if to_support_in_kwargs and 'kwargs' in _func_params_names:
+    if to_support_in_kwargs and call_plan.inject_extras:
         _func_data.update(to_support_in_kwargs)
 
     return _func_data, _envs
 
 
+def _get_tracing_kwargs(
+    call_plan: CallPlan,
+    openai_tracing: bool,
+    tracer: 'Tracer',
+    cancel_event: Optional[threading.Event] = None,
+) -> Dict[str, Any]:
+    # Tracing handler provided only if kwargs is present
+    if not call_plan.inject_extras:
+        return {}
+
+    if openai_tracing:
+        return {
+            'tracing_handler': OpenAITracingCallbackHandler(
+                tracer=tracer, parent_span=get_current_span(), cancel_event=cancel_event
+            )
+        }
+    else:
+        return {
+            'tracing_handler': TracingCallbackHandler(
+                tracer=tracer, parent_span=get_current_span(), cancel_event=cancel_event
+            )
+        }
+
+
+def _get_cancel_kwargs(
+    call_plan: CallPlan, cancel_event: threading.Event
+) -> Dict[str, Any]:
+    # Set once the client is gone, for sync functions & chains to stop early
+    if not call_plan.inject_extras:
+        return {}
+
+    return {
+        'cancel_event': cancel_event,
+        'cancel_handler': CancellationCallbackHandler(cancel_event),
+    }
+
+
 def _get_updated_signature(
     file_params: List[inspect.Parameter],
     output_model: BaseModel,
     include_token: bool = False,
 ) -> inspect.Signature:
+    from fastapi import Request
+
     _params = [
         *file_params,
         inspect.Parameter(
@@ -775,6 +1419,11 @@ def _get_updated_signature(
             kind=inspect.Parameter.POSITIONAL_OR_KEYWORD,
             annotation=str,
         ),
+        inspect.Parameter(
+            name='request',
+            kind=inspect.Parameter.POSITIONAL_OR_KEYWORD,
+            annotation=Request,
+        ),
     ]
 
     if include_token:
@@ -788,25 +1437,157 @@ def _get_updated_signature(
     return inspect.Signature(parameters=_params, return_annotation=output_model)
 
 
+class StreamSender:
+    """Collects the frames sent by the streaming handlers of an HTTP streaming route.
+
+    Handlers call `send_json` just like they would on a websocket, from the loop or from
+    a worker thread, and the route yields the frames to the client as they arrive.
+    """
+
+    def __init__(self):
+        self._loop = asyncio.get_running_loop()
+        self._frames: asyncio.Queue = asyncio.Queue()
+
+    def send_json_threadsafe(self, data: Dict):
+        # only the partial result is streamed, error & stdout are sent in the final frame
+        _frame = {'result': data.get('result')}
+        try:
+            _on_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            _on_loop = False
+
+        if _on_loop:
+            self._frames.put_nowait(_frame)
+        else:
+            self._loop.call_soon_threadsafe(self._frames.put_nowait, _frame)
+
+    async def send_json(self, data: Dict):
+        self.send_json_threadsafe(data)
+
+    async def drain(self, task: asyncio.Future) -> AsyncIterator[Dict]:
+        """Yield the frames sent until `task` is done"""
+        while not task.done():
+            _get = asyncio.ensure_future(self._frames.get())
+            await asyncio.wait({task, _get}, return_when=asyncio.FIRST_COMPLETED)
+            if _get.done():
+                yield _get.result()
+            else:
+                _get.cancel()
+
+        while not self._frames.empty():
+            yield self._frames.get_nowait()
+
+
+class ClosingStreamingResponse(StreamingResponse):
+    """StreamingResponse that closes its body when the response is over, however it ends.
+
+    Starlette leaves the body suspended when sending fails, so its `finally` would only
+    run once garbage collected, out of the request's context.
+    """
+
+    async def stream_response(self, send: Send) -> None:
+        try:
+            await super().stream_response(send)
+        finally:
+            await self.body_iterator.aclose()
+
+
+async def _close_after(stream: AsyncIterator, close: Callable) -> AsyncIterator:
+    """Yield the items of `stream`, then `close()`, however the stream ends"""
+    try:
+        async for _item in stream:
+            yield _item
+    finally:
+        await stream.aclose()
+        close()
+
+
+def _with_timeout(
+    call: Awaitable,
+    call_timeout: Optional[CallTimeout],
+    cancel_event: threading.Event,
+) -> Awaitable:
+    # calls of routes without a timeout are awaited as they are
+    if call_timeout is None:
+        return call
+    return call_timeout.run(call, cancel_event)
+
+
+def _iterate_with_timeout(
+    iterator: AsyncIterator,
+    call_timeout: Optional[CallTimeout],
+    cancel_event: threading.Event,
+) -> AsyncIterator:
+    if call_timeout is None:
+        return iterator
+    return call_timeout.iterate(iterator, cancel_event)
+
+
+async def _flush_streaming_handlers(func_data: Dict):
+    for key in ('streaming_handler', 'async_streaming_handler'):
+        handler = func_data.get(key)
+        if handler is not None:
+            await handler.flush()
+
+
+def _get_stream_media_type(accept: Optional[str]) -> str:
+    # Server-Sent Events if the client asks for it, newline-delimited JSON otherwise
+    if accept and SSE_MEDIA_TYPE in accept:
+        return SSE_MEDIA_TYPE
+    return NDJSON_MEDIA_TYPE
+
+
+def _encode_stream_frame(frame: Dict, media_type: str, event: str = None) -> str:
+    from fastapi.encoders import jsonable_encoder
+
+    _data = json.dumps(jsonable_encoder(frame))
+    if media_type == SSE_MEDIA_TYPE:
+        return (f'event: {event}\n' if event else '') + f'data: {_data}\n\n'
+    return f'{_data}\n'
+
+
 def create_http_route(
     app: 'FastAPI',
-    func: Callable,
+    call_plan: CallPlan,
     dirname: str,
     auth_func: Callable,
     file_params: List,
-    input_model: BaseModel,
-    output_model: BaseModel,
+    upload_config: Optional[UploadConfig],
+    worker_pool: Union[ThreadWorkerPool, ProcessWorkerPool],
     openai_tracing: bool,
+    streaming: bool,
+    streaming_handler_kwargs: Dict,
+    fast_response: bool,
+    route_cache: Optional[RouteCache],
+    single_flight: Optional[SingleFlight],
+    admission: AdmissionController,
+    call_timeout: Optional[CallTimeout],
+    batcher: Optional[Batcher],
     post_kwargs: Dict,
     workspace: str,
     logger: JinaLogger,
     tracer: 'Tracer',
 ):
-    from fastapi import Depends, Form, HTTPException, Security, UploadFile, status
+    from fastapi import (
+        Depends,
+        Form,
+        HTTPException,
+        Request,
+        Security,
+        UploadFile,
+        status,
+    )
     from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
     from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+    from starlette.background import BackgroundTask, BackgroundTasks
 
+    func = call_plan.func
+    input_model = call_plan.input_model
+    output_model = call_plan.output_model
     bearer_scheme = HTTPBearer()
+    # Generators are always streamed, other functions only if they ask for the streaming handlers
+    stream_response = call_plan.is_generator or streaming
 
     async def _the_authorizer(
         credentials: HTTPAuthorizationCredentials = Security(bearer_scheme),
@@ -817,7 +1598,10 @@ def create_http_route(
             )
 
         try:
-            auth_response = await run_function(auth_func, token=credentials.credentials)
+            with timed(Phase.AUTH):
+                auth_response = await run_function(
+                    auth_func, token=credentials.credentials
+                )
         except Exception as e:
             logger.error(f'Could not verify token: {e}')
             raise HTTPException(
@@ -826,50 +1610,346 @@ def create_http_route(
 
         return auth_response
 
+    async def _the_stream(
+        _func_data: Dict,
+        _envs: Dict,
+        sender: StreamSender,
+        media_type: str,
+        cancel_event: threading.Event,
+        release: Callable,
+    ) -> AsyncIterator[str]:
+        try:
+            _output, _error = None, ''
+            with RequestEnvCtxtManager(_envs), RequestDirCtxtManager(dirname):
+                with Capturing() as stdout, timed(Phase.EXECUTE):
+                    _task, _done = None, False
+                    try:
+                        if call_plan.is_generator:
+                            # Calling a generator function doesn't run its body, so it's safe on the loop
+                            async for _chunk in _iterate_with_timeout(
+                                worker_pool.iterate(func(**_func_data)),
+                                call_timeout,
+                                cancel_event,
+                            ):
+                                yield _encode_stream_frame(
+                                    {'result': _chunk}, media_type
+                                )
+                        elif sender is not None:
+                            _task = asyncio.ensure_future(
+                                _with_timeout(
+                                    worker_pool.run(func, **_func_data),
+                                    call_timeout,
+                                    cancel_event,
+                                )
+                            )
+                            async for _frame in sender.drain(_task):
+                                yield _encode_stream_frame(_frame, media_type)
+                            # tokens still buffered by the handlers
+                            await _flush_streaming_handlers(_func_data)
+                            async for _frame in sender.drain(_task):
+                                yield _encode_stream_frame(_frame, media_type)
+                            _output = _task.result()
+                        else:
+                            # no streaming handlers to pass, only the final frame is sent
+                            _output = await _with_timeout(
+                                worker_pool.run(func, **_func_data),
+                                call_timeout,
+                                cancel_event,
+                            )
+                        _done = True
+                    except CallTimeoutError as e:
+                        # the frames streamed so far are the partial result
+                        logger.warning(str(e))
+                        _error = str(e)
+                    except Exception as e:
+                        logger.error(f'Got an exception: {e}')
+                        _error = str(traceback.format_exc())
+                    finally:
+                        if not _done:
+                            # the client is gone (or the call failed), stop what's left of it
+                            cancel_event.set()
+                        if _task is not None and not _task.done():
+                            _task.cancel()
+
+                if _error != '':
+                    print(f'Error: {_error}')
+
+            _final = {'error': _error, 'stdout': '\n'.join(stdout)}
+            if _output is not None:
+                _final['result'] = _output
+            yield _encode_stream_frame(_final, media_type, event='end')
+        finally:
+            # the admission slot is held until the stream is over, however it ends
+            release()
+
     async def _the_route(
         input_data: input_model,
         files_data: Dict[str, UploadFile] = {},
         auth_response: Any = None,
+        request: Request = None,
     ) -> output_model:
-        _output, _error = '', ''
-        # Tracing handler provided if kwargs is present
-        if openai_tracing:
-            to_support_in_kwargs = {
-                'tracing_handler': OpenAITracingCallbackHandler(
-                    tracer=tracer, parent_span=get_current_span()
-                )
-            }
-        else:
-            to_support_in_kwargs = {
-                'tracing_handler': TracingCallbackHandler(
-                    tracer=tracer, parent_span=get_current_span()
-                )
+        _timer = current_timer()
+        if _timer is not None:
+            # reading & validating the body, without the auth
+            _timer.record_since_start(Phase.PARSE)
+
+        cancel_event = threading.Event()
+        # Handlers (& events) can't be pickled to process pools, nor shared by a batch
+        to_support_in_kwargs = (
+            {
+                **_get_tracing_kwargs(call_plan, openai_tracing, tracer, cancel_event),
+                **_get_cancel_kwargs(call_plan, cancel_event),
             }
+            if worker_pool.shares_memory and batcher is None
+            else {}
+        )
+
+        sender = None
+        if stream_response and call_plan.inject_extras and worker_pool.shares_memory:
+            sender = StreamSender()
+            to_support_in_kwargs.update(
+                {
+                    'streaming_handler': StreamingWebsocketCallbackHandler(
+                        websocket=sender,
+                        output_model=output_model,
+                        cancel_event=cancel_event,
+                        **streaming_handler_kwargs,
+                    ),
+                    'async_streaming_handler': AsyncStreamingWebsocketCallbackHandler(
+                        websocket=sender,
+                        output_model=output_model,
+                        cancel_event=cancel_event,
+                        **streaming_handler_kwargs,
+                    ),
+                }
+            )
 
         _func_data, _envs = _get_func_data(
-            func=func,
+            call_plan=call_plan,
             input_data=input_data,
             files_data=files_data,
             auth_response=auth_response,
             workspace=workspace,
             to_support_in_kwargs=to_support_in_kwargs,
         )
-        with EnvironmentVarCtxtManager(_envs), ChangeDirCtxtManager(dirname):
+
+        if stream_response:
+            # the status can't change once the stream has started
+            try:
+                worker_pool.check_capacity(func)
+            except WorkerPoolFullError as e:
+                _raise_service_unavailable(e)
+
+            try:
+                await admission.acquire()
+            except AdmissionRejectedError as e:
+                _raise_too_many_requests(e)
+
+            _released = False
+
+            def _release():
+                nonlocal _released
+                if not _released:
+                    _released = True
+                    admission.release()
+
+            media_type = _get_stream_media_type(request.headers.get('accept'))
+            return ClosingStreamingResponse(
+                _the_stream(
+                    _func_data, _envs, sender, media_type, cancel_event, _release
+                ),
+                media_type=media_type,
+                # keep proxies from buffering the stream
+                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+                # released by the stream, or here if it never started
+                background=BackgroundTask(_release),
+            )
+
+        # validated input, without envs, for the cache & single-flight keys
+        _input = (
+            jsonable_encoder(input_data, exclude={'envs'})
+            if route_cache is not None or single_flight is not None
+            else None
+        )
+
+        _cache_key = None
+        if route_cache is not None:
+            _cache_key = route_cache.key(_input, _envs, auth_response)
+            _cached = await route_cache.get(_cache_key)
+            if _cached is not None:
+                _output, _stdout = _cached
+                return _to_response(_output, '', _stdout, headers={CACHE_HEADER: 'HIT'})
+
+        try:
+            with timed(Phase.EXECUTE):
+                if single_flight is None:
+                    _output, _error, _stdout = await cancel_on_disconnect(
+                        _run_func(_func_data, _envs, cancel_event),
+                        wait_for_http_disconnect(request),
+                        cancel_event,
+                    )
+                else:
+                    # a shared call isn't cancelled, other clients may still wait for it
+                    # only identical requests (same input, envs & auth) share a call
+                    (_output, _error, _stdout), _shared = await single_flight.do(
+                        hash_key(
+                            {'input': _input, 'envs': _envs, 'auth': auth_response}
+                        ),
+                        lambda: _run_func(_func_data, _envs, cancel_event),
+                    )
+                    if (
+                        _shared
+                        and _error != ''
+                        and single_flight.config.error_policy == ErrorPolicy.RETRY
+                    ):
+                        _output, _error, _stdout = await _run_func(
+                            _func_data, _envs, cancel_event
+                        )
+        except WorkerPoolFullError as e:
+            _raise_service_unavailable(e)
+        except AdmissionRejectedError as e:
+            _raise_too_many_requests(e)
+        except ClientDisconnectedError as e:
+            logger.info(str(e))
+            # nobody reads the response, but the status shows up in the access logs
+            raise HTTPException(status_code=499, detail=str(e))
+        except CallTimeoutError as e:
+            logger.warning(str(e))
+            return ORJSONResponse(
+                fast_output(None, error=str(e), stdout=e.stdout),
+                status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            )
+
+        if _cache_key is None:
+            return _to_response(_output, _error, _stdout)
+
+        # only successful calls are cached
+        if _error == '':
+            await route_cache.put(_cache_key, _output, _stdout)
+        return _to_response(_output, _error, _stdout, headers={CACHE_HEADER: 'MISS'})
+
+    def _raise_service_unavailable(e: WorkerPoolFullError):
+        logger.warning(str(e))
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e),
+            headers={'Retry-After': str(e.retry_after)},
+        )
+
+    def _raise_too_many_requests(e: AdmissionRejectedError):
+        logger.warning(str(e))
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=str(e),
+            headers={'Retry-After': str(e.retry_after)},
+        )
+
+    async def _run_batch(items: List[Tuple[Dict, Dict]]) -> List[Any]:
+        # items of a batch only differ in the batched fields
+        _func_data = {
+            k: v for k, v in items[0][0].items() if k not in call_plan.batched_fields
+        }
+        for _name in call_plan.batched_fields:
+            _func_data[_name] = [_data[_name] for _data, _ in items]
+
+        # set once the batch times out, the callback handlers aren't shared by a batch
+        cancel_event = threading.Event()
+        if call_plan.inject_extras and worker_pool.shares_memory:
+            _func_data['cancel_event'] = cancel_event
+
+        with RequestEnvCtxtManager(items[0][1]), RequestDirCtxtManager(dirname):
             with Capturing() as stdout:
-                try:
-                    _output = await run_function(func, **_func_data)
-                except Exception as e:
-                    logger.error(f'Got an exception: {e}')
-                    _error = str(traceback.format_exc())
-
-            if _error != '':
-                print(f'Error: {_error}')
-            return output_model(
-                result=_output,
-                error=_error,
-                stdout='\n'.join(stdout),
+                _outputs = await _with_timeout(
+                    worker_pool.run(func, **_func_data), call_timeout, cancel_event
+                )
+
+        if not isinstance(_outputs, (list, tuple)):
+            # let the batcher report it
+            return _outputs
+        # every request of the batch gets its stdout
+        _stdout = '\n'.join(stdout)
+        return [
+            _output if isinstance(_output, BaseException) else (_output, _stdout)
+            for _output in _outputs
+        ]
+
+    async def _run_batched(_func_data: Dict, _envs: Dict) -> Tuple[Any, str, str]:
+        _output, _error, _stdout = '', '', ''
+        # requests share a batch only with the same envs and other inputs
+        _key = hash_key(
+            {
+                'envs': _envs,
+                'data': {
+                    k: v
+                    for k, v in _func_data.items()
+                    if k not in call_plan.batched_fields
+                },
+            }
+        )
+        async with admission.admit():
+            try:
+                _output, _stdout = await batcher.submit(
+                    _key, (_func_data, _envs), _run_batch
+                )
+            except (WorkerPoolFullError, CallTimeoutError):
+                raise
+            except Exception as e:
+                # the error of the batch, or of this item only
+                logger.error(f'Got an exception: {e}')
+                _error = ''.join(
+                    traceback.format_exception(type(e), e, e.__traceback__)
+                )
+
+        return _output, _error, _stdout
+
+    async def _run_func(
+        _func_data: Dict, _envs: Dict, cancel_event: threading.Event
+    ) -> Tuple[Any, str, str]:
+        if batcher is not None:
+            return await _run_batched(_func_data, _envs)
+
+        _output, _error, _timeout_error = '', '', None
+        async with admission.admit():
+            with RequestEnvCtxtManager(_envs), RequestDirCtxtManager(dirname):
+                with Capturing() as stdout:
+                    try:
+                        _output = await _with_timeout(
+                            worker_pool.run(func, **_func_data),
+                            call_timeout,
+                            cancel_event,
+                        )
+                    except WorkerPoolFullError:
+                        raise
+                    except CallTimeoutError as e:
+                        _timeout_error = e
+                    except Exception as e:
+                        logger.error(f'Got an exception: {e}')
+                        _error = str(traceback.format_exc())
+
+                if _error != '':
+                    print(f'Error: {_error}')
+
+        if _timeout_error is not None:
+            # what the function printed so far goes with the timeout error
+            _timeout_error.stdout = '\n'.join(stdout)
+            raise _timeout_error
+        return _output, _error, '\n'.join(stdout)
+
+    def _to_response(
+        _output: Any, _error: str, _stdout: str, headers: Dict[str, str] = None
+    ) -> Union[output_model, JSONResponse]:
+        if fast_response or _error != '':
+            # trust the function's return type, skip validating the output model
+            # (errors have no result of that type, e.g. failed items of a batch)
+            return ORJSONResponse(
+                fast_output(_output, error=_error, stdout=_stdout), headers=headers
             )
 
+        _response = output_model(result=_output, error=_error, stdout=_stdout)
+        if headers:
+            return JSONResponse(jsonable_encoder(_response), headers=headers)
+        return _response
+
     def _the_parser(data: str = Form(...)) -> input_model:
         try:
             model = input_model.parse_raw(data)
@@ -881,7 +1961,76 @@ def create_http_route(
 
         return model
 
-    if auth_func is not None:
+    async def _the_upload_route(request: Request, auth_response: Any = None):
+        try:
+            uploads = await parse_multipart(
+                request.headers,
+                request.stream(),
+                config=upload_config,
+                upload_dir=get_upload_dir(workspace),
+            )
+        except UploadTooLargeError as e:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e)
+            )
+        except MalformedUploadError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+        try:
+            _missing = [] if 'data' in uploads.fields else ['data']
+            _missing += [
+                _name
+                for _name in call_plan.required_file_fields
+                if _name not in uploads.files
+            ]
+            if _missing:
+                raise HTTPException(
+                    status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    detail=f'Missing form fields: {", ".join(_missing)}',
+                )
+
+            response = await _the_route(
+                input_data=_the_parser(uploads.fields['data']),
+                files_data=uploads.params(call_plan.file_fields, upload_config.mode),
+                auth_response=auth_response,
+                request=request,
+            )
+        except BaseException:
+            uploads.close()
+            raise
+
+        if isinstance(response, StreamingResponse):
+            # the function runs while the response is streamed
+            response.body_iterator = _close_after(response.body_iterator, uploads.close)
+            # if the stream never started
+            response.background = BackgroundTasks(
+                [response.background, BackgroundTask(uploads.close)]
+            )
+        else:
+            uploads.close()
+        return response
+
+    if len(file_params) > 0 and upload_config is not None:
+        # The body is parsed by `_the_upload_route` as it's received, not by FastAPI.
+        post_kwargs = {
+            **post_kwargs,
+            'openapi_extra': get_upload_openapi_extra(file_params),
+        }
+
+        if auth_func is not None:
+
+            async def _the_http_route(
+                request: Request,
+                auth_response: Any = Depends(_the_authorizer),
+            ) -> output_model:
+                return await _the_upload_route(request, auth_response=auth_response)
+
+        else:
+
+            async def _the_http_route(request: Request) -> output_model:
+                return await _the_upload_route(request)
+
+    elif auth_func is not None:
         # If an auth function is present, we need to include the authorizer in the route.
 
         if len(file_params) > 0:
@@ -889,14 +2038,16 @@ def create_http_route(
             # the input data included in the Form and parsed correctly.
 
             async def _the_http_route(
+                request: Request,
                 input_data: input_model = Depends(_the_parser),
                 auth_response: Any = Depends(_the_authorizer),
                 **kwargs,
             ) -> output_model:
                 return await _the_route(
                     input_data=input_data,
-                    files_data=_get_files_data(kwargs),
+                    files_data=_get_files_data(call_plan, kwargs),
                     auth_response=auth_response,
+                    request=request,
                 )
 
             _the_http_route.__signature__ = _get_updated_signature(
@@ -907,12 +2058,15 @@ def create_http_route(
             # If no file params are present, we include the input args in the Body.
 
             async def _the_http_route(
-                input_data: input_model, auth_response: Any = Depends(_the_authorizer)
+                request: Request,
+                input_data: input_model,
+                auth_response: Any = Depends(_the_authorizer),
             ) -> output_model:
                 return await _the_route(
                     input_data=input_data,
                     files_data={},
                     auth_response=auth_response,
+                    request=request,
                 )
 
     else:
@@ -923,12 +2077,15 @@ def create_http_route(
             # the input data included in the Form and parsed correctly.
 
             async def _the_http_route(
-                input_data: input_model = Depends(_the_parser), **kwargs
+                request: Request,
+                input_data: input_model = Depends(_the_parser),
+                **kwargs,
             ) -> output_model:
                 return await _the_route(
                     input_data=input_data,
-                    files_data=_get_files_data(kwargs),
+                    files_data=_get_files_data(call_plan, kwargs),
                     auth_response=None,
+                    request=request,
                 )
 
             _the_http_route.__signature__ = _get_updated_signature(
@@ -938,27 +2095,37 @@ def create_http_route(
         else:
             # If no file params are present, we include the input args in the Body.
 
-            async def _the_http_route(input_data: input_model) -> output_model:
+            async def _the_http_route(
+                request: Request, input_data: input_model
+            ) -> output_model:
                 return await _the_route(
                     input_data=input_data,
                     files_data={},
                     auth_response=None,
+                    request=request,
                 )
 
     # Add the route to the app with POST method
     app.post(**post_kwargs)(_the_http_route)
 
 
-# TODO: add file upload support for websocket routes
 def create_websocket_route(
     app: 'FastAPI',
-    func: Callable,
+    call_plan: CallPlan,
     dirname: str,
     auth: Callable,
-    input_model: BaseModel,
-    output_model: BaseModel,
+    worker_pool: Union[ThreadWorkerPool, ProcessWorkerPool],
     include_ws_callback_handlers: bool,
     openai_tracing: bool,
+    send_buffer_size: int,
+    streaming_handler_kwargs: Dict,
+    fast_response: bool,
+    upload_config: Optional[UploadConfig],
+    multiplex_max_calls: Optional[int],
+    admission: AdmissionController,
+    call_timeout: Optional[CallTimeout],
+    first_frame_histogram: Optional['Histogram'],
+    frame_rate_histogram: Optional['Histogram'],
     ws_kwargs: Dict,
     workspace: str,
     logger: JinaLogger,
@@ -975,6 +2142,10 @@ def create_websocket_route(
     from fastapi.security.utils import get_authorization_scheme_param
     from fastapi.websockets import WebSocketState
 
+    func = call_plan.func
+    input_model = call_plan.input_model
+    output_model = call_plan.output_model
+
     async def _the_authorizer(
         authorization: Union[str, None] = Header(None, alias="Authorization"),
     ) -> Any:
@@ -999,24 +2170,294 @@ def create_websocket_route(
 
         return auth_response
 
+    def _record_frames(sender: WebsocketSender, requested_at: float):
+        _attributes = {'route': func.__name__}
+        if first_frame_histogram and sender.first_frame_at is not None:
+            first_frame_histogram.record(
+                max(0.0, sender.first_frame_at - requested_at), _attributes
+            )
+        _elapsed = time.perf_counter() - requested_at
+        if frame_rate_histogram and sender.frames_sent and _elapsed > 0:
+            frame_rate_histogram.record(sender.frames_sent / _elapsed, _attributes)
+
+    # Functions given the websocket may read from it (e.g. `receive_json()`), a call of
+    # theirs isn't watched for a disconnect, which would take their frames.
+    gets_websocket = (
+        include_ws_callback_handlers
+        and call_plan.inject_extras
+        and worker_pool.shares_memory
+    )
+
+    async def _receive_frame(
+        websocket: WebSocket, pending: Optional[Deque[Message]] = None
+    ) -> Union[str, bytes]:
+        # frames read while watching for a disconnect go first
+        message = pending.popleft() if pending else await websocket.receive()
+        if message['type'] == 'websocket.disconnect':
+            raise WebSocketDisconnect(
+                code=message.get('code', status.WS_1000_NORMAL_CLOSURE),
+                reason=message.get('reason'),
+            )
+        if message.get('text') is not None:
+            return message['text']
+        return message['bytes']
+
+    async def _receive_bytes(
+        websocket: WebSocket, pending: Optional[Deque[Message]] = None
+    ) -> bytes:
+        _frame = await _receive_frame(websocket, pending)
+        if not isinstance(_frame, bytes):
+            raise MalformedUploadError('Expected a binary frame with the file content')
+        return _frame
+
+    async def _receive_input(
+        websocket: WebSocket, uploads: Uploads, pending: Deque[Message]
+    ) -> Any:
+        # the input frame, after the files sent before it
+        while True:
+            _frame = await _receive_frame(websocket, pending)
+            if isinstance(_frame, bytes):
+                raise MalformedUploadError('Binary frame without a file header')
+
+            _data = json.loads(_frame)
+            if not is_ws_file_header(_data):
+                return _data
+
+            if upload_config is None:
+                raise MalformedUploadError(
+                    f'`{func.__name__}` has no `UploadFile` parameters'
+                )
+            await receive_ws_file(
+                _data,
+                lambda: _receive_bytes(websocket, pending),
+                uploads,
+                config=upload_config,
+                upload_dir=get_upload_dir(workspace),
+            )
+
+    async def _wait_for_disconnect(
+        websocket: WebSocket, recv_lock: asyncio.Lock, pending: Deque[Message]
+    ):
+        # `input` reads frames too, the lock is only held for a short while at a time
+        while True:
+            async with recv_lock:
+                try:
+                    message = await asyncio.wait_for(
+                        websocket.receive(), WS_DISCONNECT_POLL_INTERVAL
+                    )
+                except asyncio.TimeoutError:
+                    continue
+                if message['type'] == 'websocket.disconnect':
+                    return
+                # queued before `input` can take the lock
+                pending.append(message)
+
+    def _to_frame(result: Any) -> str:
+        with timed(Phase.SERIALIZE):
+            if fast_response:
+                # trust the function's return type, skip validating the output model
+                return dumps(fast_output(result)).decode()
+            return output_model(result=result, error='').json()
+
     async def _the_route(websocket: WebSocket, auth_response: Any = None):
+        if multiplex_max_calls is not None:
+            # each call of the connection is admitted on its own
+            return await _the_admitted_route(websocket, auth_response)
+
+        try:
+            await admission.acquire()
+        except AdmissionRejectedError as e:
+            logger.warning(str(e))
+            # accepted first, so that the client gets the close code instead of a 403
+            await websocket.accept()
+            await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER, reason=str(e))
+            return
+
+        try:
+            await _the_admitted_route(websocket, auth_response)
+        finally:
+            admission.release()
+
+    def _get_error_msg(
+        websocket: WebSocket, e: Union[WebSocketDisconnect, ConnectionClosed]
+    ) -> str:
+        return (
+            f'Client {websocket.client} disconnected from `{func.__name__}` with code {e.code}'
+            + (f' and reason {e.reason}' if e.reason else '')
+        )
+
+    async def _run_call(
+        websocket: WebSocket,
+        sender: Union[WebsocketSender, TaggedSender],
+        _data: Any,
+        _uploads: Uploads,
+        auth_response: Any = None,
+        cancel_event: Optional[threading.Event] = None,
+    ) -> bool:
+        """Run the function for an input frame, False if the client can send another one"""
+        try:
+            with timed(Phase.PARSE):
+                _input_data = input_model(**_data)
+                _missing_files = [
+                    _name
+                    for _name in call_plan.required_file_fields
+                    if _name not in _uploads.files
+                ]
+                if _missing_files:
+                    raise ValueError(f'Missing files: {", ".join(_missing_files)}')
+        except ValueError as e:
+            # pydantic's ValidationError included
+            logger.error(f'Exception while converting data to input model: {e}')
+            _ws_serving_error = str(e)
+            _data = output_model(
+                result='',
+                error=_ws_serving_error,
+            )
+            await sender.send_text(_data.json())
+            return False
+
+        cancel_event = cancel_event or threading.Event()
+        # Handlers (& events) can't be pickled to process pools
+        to_support_in_kwargs = (
+            {
+                **_get_tracing_kwargs(call_plan, openai_tracing, tracer, cancel_event),
+                **_get_cancel_kwargs(call_plan, cancel_event),
+            }
+            if worker_pool.shares_memory
+            else {}
+        )
+
+        # If the function is a streaming response, we pass the websocket callback handler,
+        # so that stream data can be sent back to the client.
+        if gets_websocket:
+            to_support_in_kwargs.update(
+                {
+                    # frames of multiplexed calls are tagged, even when sent by the function
+                    'websocket': (
+                        sender if isinstance(sender, TaggedSender) else websocket
+                    ),
+                    'streaming_handler': StreamingWebsocketCallbackHandler(
+                        websocket=sender,
+                        output_model=output_model,
+                        cancel_event=cancel_event,
+                        **streaming_handler_kwargs,
+                    ),
+                    'async_streaming_handler': AsyncStreamingWebsocketCallbackHandler(
+                        websocket=sender,
+                        output_model=output_model,
+                        cancel_event=cancel_event,
+                        **streaming_handler_kwargs,
+                    ),
+                }
+            )
+        _returned_data, _ws_serving_error = '', ''
+        _func_data, _envs = _get_func_data(
+            call_plan=call_plan,
+            input_data=_input_data,
+            files_data=(
+                _uploads.params(call_plan.file_fields, upload_config.mode)
+                if upload_config is not None
+                else {}
+            ),
+            auth_response=auth_response,
+            workspace=workspace,
+            to_support_in_kwargs=to_support_in_kwargs,
+        )
+        with RequestEnvCtxtManager(_envs), RequestDirCtxtManager(dirname), timed(
+            Phase.EXECUTE
+        ):
+            try:
+                if call_plan.is_generator:
+                    # Calling a generator function doesn't run its body, so it's safe on the loop
+                    _returned_data = func(**_func_data)
+                else:
+                    _returned_data = await _with_timeout(
+                        worker_pool.run(func, **_func_data),
+                        call_timeout,
+                        cancel_event,
+                    )
+                    # tokens still buffered by the handlers go before the result
+                    await _flush_streaming_handlers(_func_data)
+
+                if inspect.isgenerator(_returned_data) or inspect.isasyncgen(
+                    _returned_data
+                ):
+                    # If the function is a generator, we iterate through the generator and send each item back to the client.
+                    # Sync generators run in a worker, so that `next` doesn't block the loop.
+                    async for _stream in _iterate_with_timeout(
+                        worker_pool.iterate(
+                            _returned_data, buffer_size=send_buffer_size
+                        ),
+                        call_timeout,
+                        cancel_event,
+                    ):
+                        await sender.send_text(_to_frame(_stream))
+
+                else:
+                    # If the function is not a generator, we send the result back to the client.
+                    await sender.send_text(_to_frame(_returned_data))
+
+                return True
+
+            except (WebSocketDisconnect, ConnectionClosed):
+                raise
+
+            except WorkerPoolFullError as e:
+                logger.warning(str(e))
+                # The client can retry on the same connection.
+                _data = output_model(result='', error=str(e))
+                await sender.send_text(_data.json())
+                return False
+
+            except CallTimeoutError as e:
+                logger.warning(str(e))
+                # the frames & tokens sent so far are the partial result
+                await _flush_streaming_handlers(_func_data)
+                await sender.send_text(dumps(fast_output(None, error=str(e))).decode())
+                return False
+
+            except Exception as e:
+                logger.error(f'Got an exception: {e}', exc_info=True)
+                _ws_serving_error = str(traceback.format_exc())
+                # For other errors, we send the error back to the client.
+                _data = output_model(
+                    result='',
+                    error=_ws_serving_error,
+                )
+                await sender.send_text(_data.json())
+
+            if _ws_serving_error != '':
+                print(f'Error: {_ws_serving_error}')
+        return False
+
+    async def _the_admitted_route(websocket: WebSocket, auth_response: Any = None):
+        _ws_recv_lock = asyncio.Lock()
+        # Frames sent by the route, the handlers and `input` go through a single bounded buffer,
+        # so that they stay in order and a slow client slows down the function instead of
+        # piling up frames in memory.
+        sender = WebsocketSender(websocket, buffer_size=send_buffer_size)
+        # frames received while watching for a disconnect, read by the route & `input` first
+        _pending: Deque[Message] = deque()
         with BuiltinsWrapper(
-            loop=asyncio.get_event_loop(),
-            websocket=websocket,
+            sender=sender,
             output_model=output_model,
+            recv_lock=_ws_recv_lock,
             wrap_print=False,
+            # frames of multiplexed connections are read by the route only
+            wrap_input=multiplex_max_calls is None,
+            pending=_pending,
         ):
-
-            def _get_error_msg(e: Union[WebSocketDisconnect, ConnectionClosed]) -> str:
-                return (
-                    f'Client {websocket.client} disconnected from `{func.__name__}` with code {e.code}'
-                    + (f' and reason {e.reason}' if e.reason else '')
-                )
-
             await websocket.accept()
             logger.info(f'Client {websocket.client} connected to `{func.__name__}`.')
-            _ws_recv_lock = asyncio.Lock()
+            sender.start()
+            _requested_at = None
+            _uploads = Uploads()
             try:
+                if multiplex_max_calls is not None:
+                    _requested_at = time.perf_counter()
+                    await _the_multiplexed_route(websocket, sender, auth_response)
+                    return
+
                 while True:
                     # if websocket is closed, break
                     if websocket.client_state not in [
@@ -1028,112 +2469,196 @@ def create_websocket_route(
                         )
                         break
 
-                    async with _ws_recv_lock:
-                        _data = await websocket.receive_json()
-
+                    # files of the previous call
+                    _uploads.close()
+                    _uploads = Uploads()
                     try:
-                        _input_data = input_model(**_data)
-                    except ValidationError as e:
-                        logger.error(
-                            f'Exception while converting data to input model: {e}'
+                        async with _ws_recv_lock:
+                            _data = await _receive_input(websocket, _uploads, _pending)
+                    except UploadTooLargeError as e:
+                        logger.warning(str(e))
+                        await websocket.close(
+                            code=status.WS_1009_MESSAGE_TOO_BIG, reason=str(e)
                         )
-                        _ws_serving_error = str(e)
-                        _data = output_model(
-                            result='',
-                            error=_ws_serving_error,
-                        )
-                        await websocket.send_text(_data.json())
-                        continue
-
-                    # Tracing handler provided if kwargs is present
-                    if openai_tracing:
-                        to_support_in_kwargs = {
-                            'tracing_handler': OpenAITracingCallbackHandler(
-                                tracer=tracer, parent_span=get_current_span()
-                            )
-                        }
-                    else:
-                        to_support_in_kwargs = {
-                            'tracing_handler': TracingCallbackHandler(
-                                tracer=tracer, parent_span=get_current_span()
-                            )
-                        }
-
-                    # If the function is a streaming response, we pass the websocket callback handler,
-                    # so that stream data can be sent back to the client.
-                    if include_ws_callback_handlers:
-                        to_support_in_kwargs.update(
-                            {
-                                'websocket': websocket,
-                                'streaming_handler': StreamingWebsocketCallbackHandler(
-                                    websocket=websocket,
-                                    output_model=output_model,
-                                ),
-                                'async_streaming_handler': AsyncStreamingWebsocketCallbackHandler(
-                                    websocket=websocket,
-                                    output_model=output_model,
-                                ),
-                            }
+                        break
+                    except MalformedUploadError as e:
+                        logger.warning(str(e))
+                        await websocket.close(
+                            code=status.WS_1003_UNSUPPORTED_DATA, reason=str(e)
                         )
-                    _returned_data, _ws_serving_error = '', ''
-                    # TODO: add support for file upload
-                    _func_data, _envs = _get_func_data(
-                        func=func,
-                        input_data=_input_data,
-                        files_data={},
-                        auth_response=auth_response,
-                        workspace=workspace,
-                        to_support_in_kwargs=to_support_in_kwargs,
+                        break
+                    _requested_at = time.perf_counter()
+
+                    _cancel_event = threading.Event()
+                    _call = _run_call(
+                        websocket,
+                        sender,
+                        _data,
+                        _uploads,
+                        auth_response,
+                        _cancel_event,
                     )
-                    with EnvironmentVarCtxtManager(_envs), ChangeDirCtxtManager(
-                        dirname
-                    ):
-                        try:
-                            _returned_data = await run_function(func, **_func_data)
-                            if inspect.isgenerator(_returned_data):
-                                # If the function is a generator, we iterate through the generator and send each item back to the client.
-                                for _stream in _returned_data:
-                                    _data = output_model(
-                                        result=_stream,
-                                        error=_ws_serving_error,
-                                    )
-                                    await websocket.send_text(_data.json())
-
-                            else:
-                                # If the function is not a generator, we send the result back to the client.
-                                _data = output_model(
-                                    result=_returned_data,
-                                    error=_ws_serving_error,
-                                )
-                                await websocket.send_text(_data.json())
-
-                            # Once the generator is exhausted/ function call is completed, send a close message
-                            logger.info(
-                                f'Closing ws connection `{func.__name__}` for client: {websocket.client}'
-                            )
-                            await websocket.close()
-                            break
-
-                        except (WebSocketDisconnect, ConnectionClosed) as e:
-                            logger.info(_get_error_msg(e))
-                            break
-
-                        except Exception as e:
-                            logger.error(f'Got an exception: {e}', exc_info=True)
-                            _ws_serving_error = str(traceback.format_exc())
-                            # For other errors, we send the error back to the client.
-                            _data = output_model(
-                                result='',
-                                error=_ws_serving_error,
+                    try:
+                        if gets_websocket:
+                            _completed = await _call
+                        else:
+                            # the call stops as soon as the client disconnects
+                            _completed = await cancel_on_disconnect(
+                                _call,
+                                _wait_for_disconnect(
+                                    websocket, _ws_recv_lock, _pending
+                                ),
+                                _cancel_event,
                             )
-                            await websocket.send_text(_data.json())
+                    except ClientDisconnectedError as e:
+                        logger.info(
+                            f'Client {websocket.client} disconnected from `{func.__name__}`: {e}'
+                        )
+                        break
 
-                        if _ws_serving_error != '':
-                            print(f'Error: {_ws_serving_error}')
+                    if _completed:
+                        # Once the generator is exhausted/ function call is completed, send a close message
+                        logger.info(
+                            f'Closing ws connection `{func.__name__}` for client: {websocket.client}'
+                        )
+                        await sender.flush()
+                        await websocket.close()
+                        break
 
             except (WebSocketDisconnect, ConnectionClosed) as e:
-                logger.info(_get_error_msg(e))
+                logger.info(_get_error_msg(websocket, e))
                 return
+            finally:
+                sender.close()
+                _uploads.close()
+                if _requested_at is not None:
+                    _record_frames(sender, _requested_at)
+
+    async def _run_multiplexed_call(
+        websocket: WebSocket,
+        sender: TaggedSender,
+        _data: Dict,
+        _uploads: Uploads,
+        auth_response: Any = None,
+        cancel_event: Optional[threading.Event] = None,
+    ):
+        # calls run concurrently, each one times its own phases
+        _timer = current_timer()
+        try:
+            try:
+                with request_timer(
+                    _timer.histogram if _timer else None,
+                    _timer.attributes if _timer else None,
+                ):
+                    async with admission.admit():
+                        await _run_call(
+                            websocket,
+                            sender,
+                            _data,
+                            _uploads,
+                            auth_response,
+                            cancel_event,
+                        )
+            except AdmissionRejectedError as e:
+                # only this call is rejected, the connection stays open
+                logger.warning(str(e))
+                await sender.send_text(output_model(result='', error=str(e)).json())
+                await sender.send_event(CallEvent.REJECTED)
+            else:
+                await sender.send_event(CallEvent.END)
+        except Exception as e:
+            # the client is gone
+            logger.info(f'Call `{sender.request_id}` of `{func.__name__}` stopped: {e}')
+
+    def _on_multiplexed_call_done(
+        websocket: WebSocket,
+        sender: TaggedSender,
+        _uploads: Uploads,
+        task: asyncio.Task,
+    ):
+        # also called for calls cancelled before they started
+        _uploads.close()
+        if task.cancelled():
+            logger.info(f'Call `{sender.request_id}` of `{func.__name__}` cancelled')
+            if websocket.client_state == WebSocketState.CONNECTED:
+                sender.send_event_threadsafe(CallEvent.CANCELLED)
+
+    async def _the_multiplexed_route(
+        websocket: WebSocket, sender: WebsocketSender, auth_response: Any = None
+    ):
+        calls = MultiplexedCalls(max_calls=multiplex_max_calls)
+        # files received for calls that aren't started yet
+        _pending_uploads: Dict[str, Uploads] = {}
+        try:
+            while True:
+                _frame = await _receive_frame(websocket)
+                if isinstance(_frame, bytes):
+                    raise MalformedUploadError('Binary frame without a file header')
+
+                _data = json.loads(_frame)
+                if isinstance(_data, dict) and CANCEL_KEY in _data:
+                    calls.cancel(str(_data[CANCEL_KEY]))
+                    continue
+
+                if not isinstance(_data, dict) or ID_KEY not in _data:
+                    await sender.send_text(
+                        output_model(
+                            result='', error=f'Missing `{ID_KEY}` in the frame'
+                        ).json()
+                    )
+                    continue
+
+                _request_id = str(_data.pop(ID_KEY))
+                _tagged = TaggedSender(sender, _request_id)
+                if is_ws_file_header(_data):
+                    if upload_config is None:
+                        raise MalformedUploadError(
+                            f'`{func.__name__}` has no `UploadFile` parameters'
+                        )
+                    await receive_ws_file(
+                        _data,
+                        lambda: _receive_bytes(websocket),
+                        _pending_uploads.setdefault(_request_id, Uploads()),
+                        config=upload_config,
+                        upload_dir=get_upload_dir(workspace),
+                    )
+                    continue
+
+                _uploads = _pending_uploads.pop(_request_id, None) or Uploads()
+                _cancel_event = threading.Event()
+                try:
+                    calls.start(
+                        _request_id,
+                        _run_multiplexed_call(
+                            websocket,
+                            _tagged,
+                            _data,
+                            _uploads,
+                            auth_response,
+                            _cancel_event,
+                        ),
+                        cancel_event=_cancel_event,
+                    ).add_done_callback(
+                        partial(_on_multiplexed_call_done, websocket, _tagged, _uploads)
+                    )
+                except MultiplexError as e:
+                    logger.warning(str(e))
+                    _uploads.close()
+                    await _tagged.send_text(
+                        output_model(result='', error=str(e)).json()
+                    )
+                    await _tagged.send_event(CallEvent.END)
+
+        except UploadTooLargeError as e:
+            logger.warning(str(e))
+            await websocket.close(code=status.WS_1009_MESSAGE_TOO_BIG, reason=str(e))
+        except MalformedUploadError as e:
+            logger.warning(str(e))
+            await websocket.close(code=status.WS_1003_UNSUPPORTED_DATA, reason=str(e))
+        finally:
+            await calls.cancel_all()
+            for _uploads in _pending_uploads.values():
+                _uploads.close()
 
     if auth is not None:
         logger.info(f'Auth enabled for `{func.__name__}`')
@@ -1151,8 +2676,36 @@ def create_websocket_route(
             return await _the_route(websocket=websocket, auth_response=None)
 
 
+def _create_models(
+    func: Callable, batch: bool = False
+) -> Tuple[Type[BaseModel], Type[BaseModel], Dict[str, Tuple[Type, Any]]]:
+    """Input & output models of a `@serving` function, and its file fields.
+
+    Requests of batch functions send & get a single item, instead of the lists.
+    """
+    _name = func.__name__.title().replace('_', '')
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    _input_fields, _file_fields = _get_input_model_fields(func, batch=batch)
+    input_model = create_model(
+        f'Input{_name}',
+        __config__=Config,
+        **_input_fields,
+        **{'envs': (Dict[str, str], Field(default={}, alias='envs'))},
+    )
+
+    output_model = create_model(
+        f'Output{_name}',
+        __config__=Config,
+        **_get_output_model_fields(func, batch=batch),
+    )
+    return input_model, output_model, _file_fields
+
+
 def _get_input_model_fields(
-    func: Callable,
+    func: Callable, batch: bool = False
 ) -> Tuple[Dict[str, Tuple[Type, Any]], Dict[str, Tuple[Type, Any]]]:
     from fastapi import UploadFile
 
@@ -1175,10 +2728,13 @@ def _get_input_model_fields(
             else:
                 _file_fields[_name] = (_param.annotation, _param.default)
         else:
+            _annotation = _param.annotation
+            if batch and get_item_type(_annotation) is not None:
+                _annotation = get_item_type(_annotation)
             if _param.default is inspect.Parameter.empty:
-                _input_model_fields[_name] = (_param.annotation, ...)
+                _input_model_fields[_name] = (_annotation, ...)
             else:
-                _input_model_fields[_name] = (_param.annotation, _param.default)
+                _input_model_fields[_name] = (_annotation, _param.default)
 
     return _input_model_fields, _file_fields
 
@@ -1199,7 +2755,9 @@ def _get_file_field_params(
     return _file_field_params
 
 
-def _get_output_model_fields(func: Callable) -> Dict[str, Tuple[Type, Any]]:
+def _get_output_model_fields(
+    func: Callable, batch: bool = False
+) -> Dict[str, Tuple[Type, Any]]:
     def _get_result_type():
         if 'return' in func.__annotations__:
             _return = func.__annotations__['return']
@@ -1207,6 +2765,9 @@ def _get_output_model_fields(func: Callable) -> Dict[str, Tuple[Type, Any]]:
                 return _return.__next__.__annotations__['return']
             elif _return is None:
                 return str
+            elif batch and get_item_type(_return) is not None:
+                # the result of a single item
+                return get_item_type(_return)
             else:
                 return _return
         else:
@@ -1221,31 +2782,85 @@ def _get_output_model_fields(func: Callable) -> Dict[str, Tuple[Type, Any]]:
     return _output_model_fields
 
 
-class Timer:
-    class SharedData:
-        def __init__(self, last_reported_time):
-            self.last_reported_time = last_reported_time
+class LazyRoute:
+    """ASGI app standing in for a `@serving` route until it's created.
+
+    On the first request, the route (and its models) is created, then the request is
+    dispatched again, to the route that replaced the placeholder.
+    """
+
+    def __init__(self, name: str, register: Callable[[], None], router: ASGIApp):
+        self.name = name
+        self.router = router
+        self._register = register
+        self._registered = False
+
+    def register(self):
+        if not self._registered:
+            # raises if the route can't be created, the next request tries again
+            self._register()
+            self._registered = True
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        self.register()
+        await self.router(scope, receive, send)
+
+
+class DurationSampler:
+    """Reports the duration of in-progress requests to a counter, every `interval` seconds.
 
-    def __init__(self, interval: int):
+    A single task samples all active requests, so that long running requests (e.g.
+    websockets) are accounted for while they run, without a timer task per request.
+    The remainder is reported when a request is done.
+    """
+
+    def __init__(self, interval: float = 5, counter: Optional['Counter'] = None):
         self.interval = interval
+        self.counter = counter
+        # request id -> [last reported time, (route, protocol)]
+        self._active: Dict[int, List] = {}
+        self._attributes: Dict[Tuple[str, str], Dict[str, str]] = {}
+        self._ids = itertools.count()
+        self._task: Optional[asyncio.Task] = None
 
-    async def send_duration_periodically(
-        self,
-        shared_data: SharedData,
-        route: str,
-        protocol: str,
-        counter: Optional['Counter'] = None,
-    ):
-        while True:
+    @property
+    def active(self) -> int:
+        """Number of requests in progress"""
+        return len(self._active)
+
+    def _add(self, duration: float, key: Tuple[str, str]):
+        if self.counter:
+            if key not in self._attributes:
+                self._attributes[key] = {'route': key[0], 'protocol': key[1]}
+            self.counter.add(duration, self._attributes[key])
+
+    def start(self, route: str, protocol: str) -> int:
+        request_id = next(self._ids)
+        self._active[request_id] = [time.perf_counter(), (route, protocol)]
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._sample_periodically())
+        return request_id
+
+    def stop(self, request_id: int):
+        last_reported_time, key = self._active.pop(request_id)
+        self._add(time.perf_counter() - last_reported_time, key)
+
+    def sample(self):
+        """Report the time since the last report of all requests in progress"""
+        current_time = time.perf_counter()
+        durations: Dict[Tuple[str, str], float] = {}
+        for entry in self._active.values():
+            durations[entry[1]] = durations.get(entry[1], 0) + current_time - entry[0]
+            entry[0] = current_time
+
+        for key, duration in durations.items():
+            self._add(duration, key)
+
+    async def _sample_periodically(self):
+        # stops once there's nothing to sample, restarted by the next request
+        while self._active:
             await asyncio.sleep(self.interval)
-            current_time = time.perf_counter()
-            if counter:
-                counter.add(
-                    current_time - shared_data.last_reported_time,
-                    {'route': route, 'protocol': protocol},
-                )
-
-            shared_data.last_reported_time = current_time
+            self.sample()
 
 
 class MetricsMiddleware:
@@ -1254,10 +2869,18 @@ class MetricsMiddleware:
         app: ASGIApp,
         duration_counter: Optional['Counter'] = None,
         request_counter: Optional['Counter'] = None,
+        latency_histogram: Optional['Histogram'] = None,
+        phase_histogram: Optional['Histogram'] = None,
+        sample_interval: float = 5,
     ):
         self.app = app
         self.duration_counter = duration_counter
         self.request_counter = request_counter
+        self.latency_histogram = latency_histogram
+        self.phase_histogram = phase_histogram
+        self.duration_sampler = DurationSampler(
+            interval=sample_interval, counter=duration_counter
+        )
         # TODO: figure out solution for static assets
         self.skip_routes = [
             '/docs',
@@ -1274,26 +2897,32 @@ class MetricsMiddleware:
         # Not all Scope objs have path key, e.g., lifespan type of scope
         path = scope.get('path')
         if path and path not in self.skip_routes:
-            timer = Timer(5)
-            shared_data = timer.SharedData(last_reported_time=time.perf_counter())
-            send_duration_task = asyncio.create_task(
-                timer.send_duration_periodically(
-                    shared_data, path, scope['type'], self.duration_counter
-                )
-            )
-            try:
-                await self.app(scope, receive, send)
-            finally:
-                send_duration_task.cancel()
-                if self.duration_counter:
-                    self.duration_counter.add(
-                        time.perf_counter() - shared_data.last_reported_time,
-                        {'route': path, 'protocol': scope['type']},
-                    )
-                if self.request_counter:
-                    self.request_counter.add(
-                        1, {'route': path, 'protocol': scope['type']}
+            _attributes = {'route': path, 'protocol': scope['type']}
+            request_id = self.duration_sampler.start(path, scope['type'])
+            with request_timer(self.phase_histogram, _attributes) as timer:
+
+                async def _send(message: dict) -> None:
+                    if message.get('type') == 'http.response.start':
+                        # what's left after the function, i.e. building the response
+                        timer.record_since_start(Phase.SERIALIZE)
+                    await send(message)
+
+                try:
+                    await self.app(
+                        scope,
+                        receive,
+                        _send
+                        if self.phase_histogram and scope['type'] == 'http'
+                        else send,
                     )
+                finally:
+                    self.duration_sampler.stop(request_id)
+                    if self.latency_histogram:
+                        self.latency_histogram.record(
+                            time.perf_counter() - timer.started_at, _attributes
+                        )
+                    if self.request_counter:
+                        self.request_counter.add(1, _attributes)
         else:
             await self.app(scope, receive, send)
 
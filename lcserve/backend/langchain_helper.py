@@ -2,8 +2,10 @@ import asyncio
 import copy
 import json
 import logging
+import threading
+import time
 from dataclasses import dataclass
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, Deque, Dict, List, Optional, Union
 from uuid import UUID
 
 from fastapi import WebSocket
@@ -20,6 +22,8 @@ from opentelemetry.trace import (
 )
 from pydantic import BaseModel, ValidationError
 
+from .concurrency import RequestCancelledError
+
 
 def get_tracing_logger():
     logger = logging.getLogger("tracing")
@@ -52,11 +56,61 @@ class TraceInfo:
     total_cost: float = 0
 
 
-class TracingCallbackHandlerMixin(BaseCallbackHandler):
-    def __init__(self, tracer: Tracer, parent_span: Span):
+class CancellableCallbackHandlerMixin:
+    """Stops the chain with `RequestCancelledError` once `cancel_event` is set.
+
+    LangChain only logs the errors of callback handlers, unless their `raise_error` is
+    set. It's only set once cancelled, so other errors of the handlers stay harmless.
+    """
+
+    cancel_event: Optional[threading.Event] = None
+
+    @property
+    def raise_error(self) -> bool:
+        return self.cancel_event is not None and self.cancel_event.is_set()
+
+    def _check_cancelled(self):
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise RequestCancelledError("Request cancelled, the client disconnected")
+
+
+class CancellationCallbackHandler(CancellableCallbackHandlerMixin, BaseCallbackHandler):
+    """Stops the chain at the next step or token once the request is cancelled"""
+
+    def __init__(self, cancel_event: threading.Event):
+        super().__init__()
+        self.cancel_event = cancel_event
+
+    def on_llm_start(self, *args: Any, **kwargs: Any) -> None:
+        self._check_cancelled()
+
+    def on_chat_model_start(self, *args: Any, **kwargs: Any) -> None:
+        self._check_cancelled()
+
+    def on_llm_new_token(self, *args: Any, **kwargs: Any) -> None:
+        self._check_cancelled()
+
+    def on_chain_start(self, *args: Any, **kwargs: Any) -> None:
+        self._check_cancelled()
+
+    def on_tool_start(self, *args: Any, **kwargs: Any) -> None:
+        self._check_cancelled()
+
+    def on_agent_action(self, *args: Any, **kwargs: Any) -> None:
+        self._check_cancelled()
+
+
+class TracingCallbackHandlerMixin(CancellableCallbackHandlerMixin, BaseCallbackHandler):
+    def __init__(
+        self,
+        tracer: Tracer,
+        parent_span: Span,
+        cancel_event: Optional[threading.Event] = None,
+    ):
         super().__init__()
         self.tracer = tracer
         self.parent_span = parent_span
+        self.cancel_event = cancel_event
         self.logger = get_tracing_logger()
         self.cost_per_llm_op = 0
         self.total_tokens = 0
@@ -82,6 +136,7 @@ class TracingCallbackHandlerMixin(BaseCallbackHandler):
         parent_run_id: Optional[UUID] = None,
         **kwargs: Any,
     ) -> None:
+        self._check_cancelled()
         if not self.tracer:
             return
 
@@ -156,6 +211,7 @@ class TracingCallbackHandlerMixin(BaseCallbackHandler):
         parent_run_id: Optional[UUID] = None,
         **kwargs: Any,
     ) -> None:
+        self._check_cancelled()
         if not self.tracer:
             return
 
@@ -204,6 +260,7 @@ class TracingCallbackHandlerMixin(BaseCallbackHandler):
         parent_run_id: Optional[UUID] = None,
         **kwargs: Any,
     ) -> None:
+        self._check_cancelled()
         if not self.tracer:
             return
 
@@ -229,6 +286,7 @@ class TracingCallbackHandlerMixin(BaseCallbackHandler):
         parent_run_id: Optional[UUID] = None,
         **kwargs: Any,
     ) -> None:
+        self._check_cancelled()
         if not self.tracer:
             return
 
@@ -330,11 +388,37 @@ class OpenAITracingCallbackHandler(TracingCallbackHandlerMixin, OpenAICallbackHa
         TracingCallbackHandlerMixin.on_llm_end(self, response, run_id=run_id, **kwargs)
 
 
-class AsyncStreamingWebsocketCallbackHandler(StreamingStdOutCallbackHandler):
-    def __init__(self, websocket: "WebSocket", output_model: "BaseModel"):
+class AsyncStreamingWebsocketCallbackHandler(
+    CancellableCallbackHandlerMixin, StreamingStdOutCallbackHandler
+):
+    def __init__(
+        self,
+        websocket: "WebSocket",
+        output_model: "BaseModel",
+        flush_interval: Optional[float] = None,
+        flush_max_bytes: int = 4096,
+        cancel_event: Optional[threading.Event] = None,
+    ):
+        """
+        :param websocket: websocket (or sender) to send the tokens to
+        :param output_model: output model of the route, used to build the frames
+        :param flush_interval: if set, consecutive tokens are merged into one frame, sent
+            at most `flush_interval` seconds after its first token
+        :param flush_max_bytes: a merged frame is sent as soon as it reaches this size
+        :param cancel_event: once set, the next token stops the chain
+        """
         super().__init__()
+        self.cancel_event = cancel_event
         self.websocket = websocket
         self.output_model = output_model
+        self.flush_interval = flush_interval
+        self.flush_max_bytes = flush_max_bytes
+        self._buffer: List[str] = []
+        self._buffered_bytes = 0
+        self._buffered_at = 0.0
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        # fields of the frame other than `result`, built once with the output model
+        self._frame_fields: Optional[Dict[str, Any]] = None
 
     @property
     def always_verbose(self) -> bool:
@@ -344,19 +428,78 @@ class AsyncStreamingWebsocketCallbackHandler(StreamingStdOutCallbackHandler):
     def is_async(self) -> bool:
         return True
 
+    def _to_frame(self, text: str) -> Dict[str, Any]:
+        # Validating the output model for every token is costly, and all frames hold a str
+        # result, so the model is only used for the first one.
+        if self._frame_fields is None:
+            try:
+                data = self.output_model(result=text, error="").dict()
+            except ValidationError:
+                data = {"result": text, "error": ""}
+            self._frame_fields = {k: v for k, v in data.items() if k != "result"}
+            return data
+        return {"result": text, **self._frame_fields}
+
+    def _add_token(self, token: str) -> Optional[str]:
+        """Buffer a token, return the text to send if a frame is ready"""
+        if not self.flush_interval:
+            return token
+
+        if not self._buffer:
+            self._buffered_at = time.monotonic()
+        self._buffer.append(token)
+        self._buffered_bytes += len(token.encode())
+        if (
+            self._buffered_bytes >= self.flush_max_bytes
+            or time.monotonic() - self._buffered_at >= self.flush_interval
+        ):
+            return self._take_buffer()
+        return None
+
+    def _take_buffer(self) -> Optional[str]:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        if not self._buffer:
+            return None
+
+        text = "".join(self._buffer)
+        self._buffer.clear()
+        self._buffered_bytes = 0
+        return text
+
+    async def _send(self, text: Optional[str]):
+        if text is not None:
+            await self.websocket.send_json(self._to_frame(text))
+
+    async def flush(self):
+        """Send the buffered tokens, if any"""
+        await self._send(self._take_buffer())
+
+    def _schedule_flush(self):
+        if self._buffer and self._flush_handle is None:
+            loop = asyncio.get_running_loop()
+            self._flush_handle = loop.call_later(
+                self.flush_interval, lambda: asyncio.ensure_future(self.flush())
+            )
+
     async def on_llm_new_token(self, token: str, **kwargs) -> None:
-        try:
-            data = self.output_model(result=token, error="").dict()
-        except ValidationError:
-            data = {"result": token, "error": ""}
-        await self.websocket.send_json(data)
+        self._check_cancelled()
+        await self._send(self._add_token(token))
+        self._schedule_flush()
+
+    async def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        await self.flush()
+
+    async def on_llm_error(
+        self, error: Union[Exception, KeyboardInterrupt], **kwargs: Any
+    ) -> None:
+        await self.flush()
 
     async def on_text(self, text: str, **kwargs: Any) -> None:
-        try:
-            data = self.output_model(result=text, error="").dict()
-        except ValidationError:
-            data = {"result": text, "error": ""}
-        await self.websocket.send_json(data)
+        await self.flush()
+        await self._send(text)
 
 
 class AsyncTracingCallbackHandler(TracingCallbackHandler):
@@ -429,15 +572,157 @@ class AsyncTracingCallbackHandler(TracingCallbackHandler):
 
 
 class StreamingWebsocketCallbackHandler(AsyncStreamingWebsocketCallbackHandler):
+    """Streaming handler for sync functions, running in a worker thread.
+
+    `websocket` must be a sender that is safe to use from other threads (`WebsocketSender`),
+    frames are pushed to the serving loop instead of running a new loop per token.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # the serving loop, which runs the timer flushing buffered tokens
+        self._loop = _get_running_loop()
+        # the buffer is filled by the worker thread and flushed by the timer on the loop
+        self._lock = threading.RLock()
+        self._flush_scheduled = False
+
     @property
     def is_async(self) -> bool:
         return False
 
+    def _add_token(self, token: str) -> Optional[str]:
+        with self._lock:
+            return super()._add_token(token)
+
+    def _take_buffer(self) -> Optional[str]:
+        with self._lock:
+            return super()._take_buffer()
+
+    def _send_threadsafe(self, text: Optional[str]):
+        if text is not None:
+            self.websocket.send_json_threadsafe(self._to_frame(text))
+
+    def _flush_on_loop(self):
+        with self._lock:
+            self._flush_scheduled = False
+            text = self._take_buffer()
+        self._send_threadsafe(text)
+
+    def _schedule_flush_threadsafe(self):
+        with self._lock:
+            if not self._buffer or self._flush_scheduled or self._loop is None:
+                return
+            self._flush_scheduled = True
+
+        # A timer left by a buffer already sent fires early for the next one, which
+        # still goes out within `flush_interval` of its first token.
+        self._loop.call_soon_threadsafe(
+            self._loop.call_later, self.flush_interval, self._flush_on_loop
+        )
+
     def on_llm_new_token(self, token: str, **kwargs) -> None:
-        asyncio.run(super().on_llm_new_token(token, **kwargs))
+        self._check_cancelled()
+        self._send_threadsafe(self._add_token(token))
+        self._schedule_flush_threadsafe()
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        self._send_threadsafe(self._take_buffer())
+
+    def on_llm_error(
+        self, error: Union[Exception, KeyboardInterrupt], **kwargs: Any
+    ) -> None:
+        self._send_threadsafe(self._take_buffer())
 
     def on_text(self, text: str, **kwargs: Any) -> None:
-        asyncio.run(super().on_text(text, **kwargs))
+        self._send_threadsafe(self._take_buffer())
+        self._send_threadsafe(text)
+
+
+class WebsocketSender:
+    """Sends frames to a websocket in order, from a single writer task per connection.
+
+    Frames wait in a buffer of `buffer_size` frames. When a slow client can't keep up,
+    `send_text` / `send_json` wait for room in the buffer, which slows down the producer
+    instead of growing memory.
+    """
+
+    def __init__(self, websocket: "WebSocket", buffer_size: int = 64):
+        self.websocket = websocket
+        # the serving loop, frames sent from other threads are pushed to it
+        self.loop = asyncio.get_running_loop()
+        self._frames: asyncio.Queue = asyncio.Queue(maxsize=buffer_size)
+        self._error: Optional[Exception] = None
+        self._writer: Optional[asyncio.Task] = None
+        self.frames_sent = 0
+        # perf_counter time of the first frame sent to the client
+        self.first_frame_at: Optional[float] = None
+
+    def start(self):
+        self._writer = asyncio.ensure_future(self._write())
+
+    async def _write(self):
+        while True:
+            is_json, data = await self._frames.get()
+            try:
+                # once the client is gone, frames are dropped so that producers don't block
+                if self._error is None:
+                    if is_json:
+                        await self.websocket.send_json(data)
+                    else:
+                        await self.websocket.send_text(data)
+                    if self.first_frame_at is None:
+                        self.first_frame_at = time.perf_counter()
+                    self.frames_sent += 1
+            except Exception as e:
+                self._error = e
+            finally:
+                self._frames.task_done()
+
+    async def _put(self, is_json: bool, data: Any):
+        if self._error is not None:
+            raise self._error
+        await self._frames.put((is_json, data))
+
+    async def send_text(self, data: str):
+        await self._put(False, data)
+
+    async def send_json(self, data: Any):
+        await self._put(True, data)
+
+    def send_json_threadsafe(self, data: Any):
+        """Send from any thread, in order with the frames sent on the loop.
+
+        Worker threads wait for room in the buffer, the loop's thread never blocks.
+        """
+        if _get_running_loop() is self.loop:
+            self.loop.create_task(self._put(True, data)).add_done_callback(
+                _ignore_task_error
+            )
+        else:
+            asyncio.run_coroutine_threadsafe(self._put(True, data), self.loop).result()
+
+    async def flush(self):
+        """Wait until all buffered frames are sent"""
+        await self._frames.join()
+        if self._error is not None:
+            raise self._error
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.cancel()
+
+
+def _get_running_loop() -> Optional[asyncio.AbstractEventLoop]:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+def _ignore_task_error(task: asyncio.Task):
+    # the client is gone, nobody is left to report the error to
+    if not task.cancelled():
+        task.exception()
 
 
 class _HumanInput(BaseModel):
@@ -449,44 +734,44 @@ class InputWrapper:
 
     def __init__(
         self,
-        loop: asyncio.AbstractEventLoop,
-        websocket: "WebSocket",
+        sender: WebsocketSender,
         recv_lock: asyncio.Lock,
+        pending: Optional[Deque[Dict]] = None,
     ):
-        self.loop = loop
-        self.websocket = websocket
+        self.sender = sender
         self.recv_lock = recv_lock
+        # messages already received by the route, e.g. while watching for a disconnect
+        self.pending = pending
 
     async def __acall__(self, __prompt: str = ""):
         _human_input = _HumanInput(prompt=__prompt)
         async with self.recv_lock:
-            await self.websocket.send_json(_human_input.dict())
-        return await self.websocket.receive_text()
+            # sent after the frames already buffered, so the prompt comes after the output
+            await self.sender.send_json(_human_input.dict())
+            await self.sender.flush()
+            if self.pending:
+                return self.pending.popleft()['text']
+            return await self.sender.websocket.receive_text()
 
     def __call__(self, __prompt: str = ""):
         return asyncio.run_coroutine_threadsafe(
-            self.__acall__(__prompt), self.loop
+            self.__acall__(__prompt), self.sender.loop
         ).result()
 
 
 class PrintWrapper:
-    def __init__(
-        self,
-        loop: asyncio.AbstractEventLoop,
-        websocket: "WebSocket",
-        output_model: "BaseModel",
-    ):
-        self.loop = loop
-        self.websocket = websocket
+    def __init__(self, sender: WebsocketSender, output_model: "BaseModel"):
+        self.sender = sender
         self.output_model = output_model
 
+    def _to_frame(self, *args: Any) -> Dict[str, Any]:
+        return self.output_model(result="", error="", stdout=" ".join(args)).dict()
+
     def __call__(self, *args: Any, **kwds: Any) -> Any:
-        asyncio.run_coroutine_threadsafe(self.__acall__(*args, **kwds), self.loop)
+        self.sender.send_json_threadsafe(self._to_frame(*args))
 
     async def __acall__(self, *args: Any, **kwds: Any) -> Any:
-        await self.websocket.send_json(
-            self.output_model(result="", error="", stdout=" ".join(args)).dict()
-        )
+        await self.sender.send_json(self._to_frame(*args))
 
 
 class BuiltinsWrapper:
@@ -494,15 +779,17 @@ class BuiltinsWrapper:
 
     def __init__(
         self,
-        loop: asyncio.AbstractEventLoop,
-        websocket: "WebSocket",
+        sender: WebsocketSender,
         output_model: "BaseModel",
+        recv_lock: Optional[asyncio.Lock] = None,
         wrap_print: bool = True,
         wrap_input: bool = True,
+        pending: Optional[Deque[Dict]] = None,
     ):
-        self.loop = loop
-        self.websocket = websocket
+        self.sender = sender
         self.output_model = output_model
+        self.recv_lock = recv_lock or asyncio.Lock()
+        self.pending = pending
         self._wrap_print = wrap_print
         self._wrap_input = wrap_input
 
@@ -511,11 +798,11 @@ class BuiltinsWrapper:
 
         if self._wrap_print:
             self._print = builtins.print
-            builtins.print = PrintWrapper(self.loop, self.websocket, self.output_model)
+            builtins.print = PrintWrapper(self.sender, self.output_model)
 
         if self._wrap_input:
             self._input = builtins.input
-            builtins.input = InputWrapper(self.loop, self.websocket, asyncio.Lock())
+            builtins.input = InputWrapper(self.sender, self.recv_lock, self.pending)
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         import builtins
@@ -0,0 +1,149 @@
+"""Multiplexed websockets, set with `@serving(websocket=True, multiplex=True)`.
+
+The connection stays open and carries many calls, each tagged with an id chosen
+by the client:
+
+- `{"__id__": "1", "question": "..."}` starts a call, files are sent before it with
+  the same id, e.g. `{"__id__": "1", "__file__": {...}}`.
+- `{"__cancel__": "1"}` cancels it.
+
+Calls run concurrently, and every frame they send is tagged with their `__id__`.
+The last frame of a call is `{"__id__": "1", "__event__": "end"}`, or `"cancelled"`.
+Calls are admitted one by one (`max_concurrency` & `max_queue`), a call rejected
+because the route is busy ends with `"rejected"`, after a frame with the error.
+"""
+
+import asyncio
+import json
+import threading
+from enum import Enum
+from typing import TYPE_CHECKING, Any, Coroutine, Dict, Optional, Union
+
+if TYPE_CHECKING:
+    from .langchain_helper import WebsocketSender
+
+ID_KEY = '__id__'
+CANCEL_KEY = '__cancel__'
+EVENT_KEY = '__event__'
+DEFAULT_MAX_CALLS = 16
+
+
+class CallEvent(str, Enum):
+    """CallEvent is the last frame of a multiplexed call"""
+
+    END = 'end'
+    CANCELLED = 'cancelled'
+    # the route is busy, the call didn't run
+    REJECTED = 'rejected'
+
+
+class MultiplexError(Exception):
+    pass
+
+
+def get_max_calls(multiplex: Union[bool, int, None]) -> Optional[int]:
+    """Max concurrent calls per connection, None if the route isn't multiplexed"""
+    if not multiplex:
+        return None
+    if multiplex is True:
+        return DEFAULT_MAX_CALLS
+    return int(multiplex)
+
+
+class TaggedSender:
+    """Sends the frames of one multiplexed call, tagged with its id.
+
+    Used in place of the connection's `WebsocketSender` (and of the websocket passed
+    to the function), so that the handlers & the function don't need to know about it.
+    """
+
+    def __init__(self, sender: 'WebsocketSender', request_id: str):
+        self.sender = sender
+        self.request_id = request_id
+        self.loop = sender.loop
+        self._prefix = '{' + json.dumps(ID_KEY) + ': ' + json.dumps(request_id)
+
+    def _tag(self, data: Any) -> Dict[str, Any]:
+        if isinstance(data, dict):
+            return {ID_KEY: self.request_id, **data}
+        return {ID_KEY: self.request_id, 'text': data}
+
+    def _tag_text(self, data: str) -> str:
+        # frames of the route are JSON objects, tagged without decoding them again
+        if data.startswith('{'):
+            _rest = data[1:].lstrip()
+            return self._prefix + ('}' if _rest == '}' else ', ' + _rest)
+        return json.dumps(self._tag(data))
+
+    async def send_text(self, data: str):
+        await self.sender.send_text(self._tag_text(data))
+
+    async def send_json(self, data: Any):
+        await self.sender.send_json(self._tag(data))
+
+    def send_json_threadsafe(self, data: Any):
+        self.sender.send_json_threadsafe(self._tag(data))
+
+    async def send_event(self, event: CallEvent):
+        await self.send_json({EVENT_KEY: event.value})
+
+    def send_event_threadsafe(self, event: CallEvent):
+        self.send_json_threadsafe({EVENT_KEY: event.value})
+
+    async def flush(self):
+        await self.sender.flush()
+
+
+class MultiplexedCalls:
+    """The running calls of a connection, by id"""
+
+    def __init__(self, max_calls: int = DEFAULT_MAX_CALLS):
+        self.max_calls = max_calls
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._cancel_events: Dict[str, threading.Event] = {}
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    def _remove(self, request_id: str):
+        self._tasks.pop(request_id, None)
+        self._cancel_events.pop(request_id, None)
+
+    def start(
+        self,
+        request_id: str,
+        call: Coroutine,
+        cancel_event: Optional[threading.Event] = None,
+    ) -> asyncio.Task:
+        """Start a call, `cancel_event` is set when it's cancelled, for sync functions"""
+        if request_id in self._tasks:
+            call.close()
+            raise MultiplexError(f'Call `{request_id}` is already running')
+        if len(self._tasks) >= self.max_calls:
+            call.close()
+            raise MultiplexError(
+                f'Too many concurrent calls, at most {self.max_calls} per connection'
+            )
+
+        task = asyncio.ensure_future(call)
+        self._tasks[request_id] = task
+        if cancel_event is not None:
+            self._cancel_events[request_id] = cancel_event
+        task.add_done_callback(lambda _: self._remove(request_id))
+        return task
+
+    def cancel(self, request_id: str) -> bool:
+        task = self._tasks.get(request_id)
+        if task is None:
+            return False
+        if request_id in self._cancel_events:
+            self._cancel_events[request_id].set()
+        return task.cancel()
+
+    async def cancel_all(self):
+        tasks = list(self._tasks.values())
+        for cancel_event in self._cancel_events.values():
+            cancel_event.set()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -1,4 +1,5 @@
 import asyncio
+import contextvars
 import functools
 import importlib
 import inspect
@@ -8,8 +9,10 @@ import sys
 import threading
 import uuid
 from collections import defaultdict
+from collections.abc import MutableMapping
+from contextvars import ContextVar
 from io import StringIO
-from typing import Any, Callable, Dict, List, Tuple, Union
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
 
 import nest_asyncio
 from pydantic import BaseModel
@@ -94,21 +97,59 @@ def parse_uses_with(uses_with: Union[Dict, BaseModel, List]) -> Dict[str, Any]:
     return _uses_with
 
 
+# Buffer of the request (task) whose stdout is being captured, if any
+_stdout_buffer: ContextVar[Optional[StringIO]] = ContextVar(
+    'lcserve_stdout_buffer', default=None
+)
+
+
+class _StdoutProxy:
+    """Routes writes to the capture buffer of the current context, or to the original stdout"""
+
+    def __init__(self, stdout):
+        self._stdout = stdout
+
+    def write(self, s: str) -> int:
+        _buffer = _stdout_buffer.get()
+        if _buffer is None:
+            return self._stdout.write(s)
+        return _buffer.write(s)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        if _stdout_buffer.get() is None:
+            self._stdout.flush()
+
+    def __getattr__(self, name):
+        return getattr(self._stdout, name)
+
+
+def _install_stdout_proxy():
+    if not isinstance(sys.stdout, _StdoutProxy):
+        sys.stdout = _StdoutProxy(sys.stdout)
+
+
 class Capturing(list):
-    def __enter__(self, lock: threading.Lock = None):
-        self._lock = lock
-        if self._lock:
-            self._lock.acquire()
-        self._stdout = sys.stdout
-        sys.stdout = self._stringio = StringIO()
+    """Captures stdout of the current context (request/task) into a list of lines.
+
+    `sys.stdout` is replaced once by a proxy which looks up the capture buffer in a
+    contextvar, so concurrent requests get their own output without locking. Executor
+    threads see the buffer as long as they run in a copy of the caller's context.
+    """
+
+    def __enter__(self):
+        _install_stdout_proxy()
+        self._stringio = StringIO()
+        self._token = _stdout_buffer.set(self._stringio)
         return self
 
     def __exit__(self, *args):
+        _stdout_buffer.reset(self._token)
         self.extend(self._stringio.getvalue().splitlines())
         del self._stringio  # free up some memory
-        sys.stdout = self._stdout
-        if self._lock:
-            self._lock.release()
 
 
 class EnvironmentVarCtxtManager:
@@ -135,7 +176,8 @@ class EnvironmentVarCtxtManager:
             os.environ[key] = str(val)
         # Remove any newly added environment variables
         for key in self._env_keys_added.keys():
-            os.unsetenv(key)
+            if key not in self._env_keys_old:
+                os.environ.pop(key, None)
 
 
 class ChangeDirCtxtManager:
@@ -156,15 +198,212 @@ class ChangeDirCtxtManager:
         os.chdir(self._old_path)
 
 
+# Envs of the request (task) being served, layered on top of the process environment
+_request_envs: ContextVar[Optional[Dict[str, Optional[str]]]] = ContextVar(
+    'lcserve_request_envs', default=None
+)
+_request_cwd: ContextVar[Optional[str]] = ContextVar(
+    'lcserve_request_cwd', default=None
+)
+
+
+class _EnvironProxy(MutableMapping):
+    """`os.environ` shim which overlays the envs of the current request.
+
+    Reads and writes inside a request only see/touch the request's overlay, while
+    outside a request everything goes to the process environment. A deleted key is
+    kept as `None` in the overlay to hide the process value.
+    """
+
+    def __init__(self, environ: MutableMapping):
+        self._environ = environ
+
+    def __getitem__(self, key: str) -> str:
+        _overlay = _request_envs.get()
+        if _overlay is not None and key in _overlay:
+            if _overlay[key] is None:
+                raise KeyError(key)
+            return _overlay[key]
+        return self._environ[key]
+
+    def __setitem__(self, key: str, value: str):
+        _overlay = _request_envs.get()
+        if _overlay is None:
+            self._environ[key] = value
+        elif not isinstance(value, str):
+            raise TypeError(f'str expected, not {type(value).__name__}')
+        else:
+            _overlay[key] = value
+
+    def __delitem__(self, key: str):
+        _overlay = _request_envs.get()
+        if _overlay is None:
+            del self._environ[key]
+        elif key not in self:
+            raise KeyError(key)
+        else:
+            _overlay[key] = None
+
+    def __iter__(self) -> Iterator[str]:
+        _overlay = _request_envs.get()
+        if not _overlay:
+            yield from self._environ
+            return
+
+        for key in self._environ:
+            if key not in _overlay:
+                yield key
+        for key, value in _overlay.items():
+            if value is not None:
+                yield key
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return f'environ({dict(self)})'
+
+    def copy(self) -> Dict[str, str]:
+        return dict(self)
+
+    def __getattr__(self, name):
+        return getattr(self._environ, name)
+
+
+_environ_proxy_lock = threading.Lock()
+_environ_proxy_refs = 0
+
+
+def install_environ_proxy():
+    """Overlay the envs of the current request on `os.environ`, until `uninstall_environ_proxy`.
+
+    Calls are counted, the process environment is put back by the last uninstall.
+    """
+    global _environ_proxy_refs
+    with _environ_proxy_lock:
+        _environ_proxy_refs += 1
+        if not isinstance(os.environ, _EnvironProxy):
+            os.environ = _EnvironProxy(os.environ)
+
+
+def uninstall_environ_proxy():
+    global _environ_proxy_refs
+    with _environ_proxy_lock:
+        _environ_proxy_refs = max(_environ_proxy_refs - 1, 0)
+        if _environ_proxy_refs == 0 and isinstance(os.environ, _EnvironProxy):
+            os.environ = os.environ._environ
+
+
+def request_env() -> Dict[str, str]:
+    """Environment of the current request: the process envs updated with the request `envs`.
+
+    Subprocesses inherit the process environment only, pass `env=request_env()` to them.
+    """
+    return dict(os.environ)
+
+
+def request_env_overlay() -> Dict[str, Optional[str]]:
+    """Envs set (or unset, as None) by the current request on top of the process envs"""
+    return dict(_request_envs.get() or {})
+
+
+def request_cwd() -> str:
+    """Working directory of the current request"""
+    return _request_cwd.get() or os.getcwd()
+
+
+class RequestEnvCtxtManager:
+    """Request-scoped env vars, visible through `os.environ` in the current context only.
+
+    Unlike `EnvironmentVarCtxtManager`, concurrent requests don't see each other's envs.
+    Executor threads see them as long as they run in a copy of the caller's context.
+    """
+
+    def __init__(self, envs: Dict):
+        """
+        :param envs: a dictionary of environment variables
+        """
+        self._envs = {key: str(val) for key, val in envs.items()}
+        self._token = None
+
+    def __enter__(self):
+        install_environ_proxy()
+        self._token = _request_envs.set({**(_request_envs.get() or {}), **self._envs})
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        _request_envs.reset(self._token)
+        uninstall_environ_proxy()
+
+
+class _WorkingDirRefs:
+    """Tracks the working directories of running requests.
+
+    The process has a single working directory, so it's only switched back once
+    the last request using a directory is done. Requests running concurrently in
+    different directories share the directory of the last one to start.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._refs: Dict[str, int] = defaultdict(int)
+        self._original: Optional[str] = None
+
+    def acquire(self, path: str):
+        with self._lock:
+            if not self._refs:
+                self._original = os.getcwd()
+            self._refs[path] += 1
+            if os.getcwd() != path:
+                os.chdir(path)
+
+    def release(self, path: str):
+        with self._lock:
+            self._refs[path] -= 1
+            if self._refs[path] == 0:
+                del self._refs[path]
+
+            if not self._refs:
+                os.chdir(self._original)
+            elif path not in self._refs and os.getcwd() == path:
+                os.chdir(next(iter(self._refs)))
+
+
+_working_dir_refs = _WorkingDirRefs()
+
+
+class RequestDirCtxtManager:
+    """Request-scoped working directory.
+
+    Unlike `ChangeDirCtxtManager`, a request leaving doesn't change the working directory
+    of other requests still running in the same directory. `request_cwd()` returns the
+    directory of the current request.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: a path to change
+        """
+        self._path = os.path.abspath(path)
+        self._token = None
+
+    def __enter__(self):
+        _working_dir_refs.acquire(self._path)
+        self._token = _request_cwd.set(self._path)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        _request_cwd.reset(self._token)
+        _working_dir_refs.release(self._path)
+
+
 def run_cmd(command, std_output=False, wait=True):
     if isinstance(command, str):
         command = command.split()
     if not std_output:
         process = subprocess.Popen(
-            command, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+            command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=request_env()
         )
     else:
-        process = subprocess.Popen(command)
+        process = subprocess.Popen(command, env=request_env())
     if wait:
         output, error = process.communicate()
         return output, error
@@ -182,9 +421,10 @@ async def run_function(func: Callable, **kwargs):
     if inspect.iscoroutinefunction(func):
         return await func(**kwargs)
     else:
+        # copy the context, so that the function's stdout is captured with the request
         return await asyncio.get_running_loop().run_in_executor(
             None,
-            functools.partial(func, **kwargs),
+            functools.partial(contextvars.copy_context().run, func, **kwargs),
         )
 
 
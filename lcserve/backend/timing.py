@@ -0,0 +1,188 @@
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from enum import Enum
+from typing import TYPE_CHECKING, Dict, Iterator, Optional, Sequence, Set
+
+if TYPE_CHECKING:
+    from opentelemetry.metrics import Histogram, Meter
+
+# seconds, from cached responses to long running chains
+DEFAULT_LATENCY_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+    120,
+    300,
+)
+
+
+class Phase(str, Enum):
+    """Phase is a part of a request's latency"""
+
+    # until the route is called, i.e. reading & validating the body
+    PARSE = 'parse'
+    # the `auth` function
+    AUTH = 'auth'
+    # waiting for a free worker of the executor
+    QUEUE = 'queue'
+    # the `@serving` function
+    EXECUTE = 'execute'
+    # building & encoding the response
+    SERIALIZE = 'serialize'
+
+
+logger = logging.getLogger(__name__)
+# histograms already warned about ignored buckets
+_ignored_buckets: Set[str] = set()
+
+
+def create_histogram(
+    meter: 'Meter',
+    name: str,
+    description: str,
+    unit: str = 's',
+    buckets: Optional[Sequence[float]] = None,
+) -> 'Histogram':
+    """Histogram with the given bucket boundaries, if the OpenTelemetry API supports them.
+
+    Older versions of the API don't take advisory buckets, the default buckets of the
+    SDK (or the views of the meter provider) are used then.
+    """
+    if buckets is not None:
+        try:
+            return meter.create_histogram(
+                name=name,
+                description=description,
+                unit=unit,
+                explicit_bucket_boundaries_advisory=list(buckets),
+            )
+        except TypeError:
+            if name not in _ignored_buckets:
+                _ignored_buckets.add(name)
+                logger.warning(
+                    f'The buckets configured for the `{name}` histogram are ignored: this OpenTelemetry API '
+                    f'doesn\'t take advisory buckets, the SDK defaults (or the views of the meter provider) apply'
+                )
+
+    return meter.create_histogram(name=name, description=description, unit=unit)
+
+
+class _PhaseFrame:
+    """Time recorded by the phases nested in a phase of a request"""
+
+    __slots__ = ('timer', 'nested')
+
+    def __init__(self, timer: 'RequestTimer'):
+        self.timer = timer
+        self.nested = 0.0
+
+
+# The innermost phase of the current task, so that concurrent phases of a request
+# (e.g. in tasks or worker threads) don't count each other's time.
+_phase_frame: ContextVar[Optional[_PhaseFrame]] = ContextVar(
+    'phase_frame', default=None
+)
+
+
+class RequestTimer:
+    """Records the time spent in each phase of a request to a histogram.
+
+    Phases can be nested, e.g. the queue wait happens during the execution, each phase
+    is recorded without the time of the phases nested in it, so that they add up to the
+    request's latency.
+    """
+
+    def __init__(
+        self, histogram: Optional['Histogram'] = None, attributes: Dict = None
+    ):
+        self.histogram = histogram
+        self.attributes = attributes or {}
+        self.started_at = time.perf_counter()
+        # time recorded by the phases outside of any other phase
+        self._root = _PhaseFrame(self)
+        self._phase_attributes: Dict[Phase, Dict] = {}
+
+    def _frame(self) -> _PhaseFrame:
+        frame = _phase_frame.get()
+        return frame if frame is not None and frame.timer is self else self._root
+
+    def record(self, phase: Phase, duration: float):
+        self._frame().nested += duration
+        if self.histogram:
+            if phase not in self._phase_attributes:
+                self._phase_attributes[phase] = {**self.attributes, 'phase': phase}
+            self.histogram.record(duration, self._phase_attributes[phase])
+
+    def record_since_start(self, phase: Phase):
+        """Record the time since the request started, not yet recorded by other phases"""
+        _elapsed = time.perf_counter() - self.started_at
+        self.record(phase, max(0.0, _elapsed - self._frame().nested))
+
+    @contextmanager
+    def phase(self, phase: Phase) -> Iterator[None]:
+        started_at = time.perf_counter()
+        _outer = _phase_frame.get()
+        frame = _PhaseFrame(self)
+        _phase_frame.set(frame)
+        try:
+            yield
+        finally:
+            # not reset with a token, phases of streams may end in another context
+            _phase_frame.set(_outer)
+            _elapsed = time.perf_counter() - started_at
+            _own = max(0.0, _elapsed - frame.nested)
+            self._frame().nested += _elapsed - _own
+            self.record(phase, _own)
+
+
+_request_timer: ContextVar[Optional[RequestTimer]] = ContextVar(
+    'request_timer', default=None
+)
+
+
+@contextmanager
+def request_timer(
+    histogram: Optional['Histogram'] = None, attributes: Dict = None
+) -> Iterator[RequestTimer]:
+    """Time the phases of the current request, see `timed` & `record_phase`"""
+    timer = RequestTimer(histogram, attributes)
+    token = _request_timer.set(timer)
+    try:
+        yield timer
+    finally:
+        _request_timer.reset(token)
+
+
+def current_timer() -> Optional[RequestTimer]:
+    return _request_timer.get()
+
+
+@contextmanager
+def timed(phase: Phase) -> Iterator[None]:
+    """Record the time spent in the block as a phase of the current request"""
+    timer = _request_timer.get()
+    if timer is None:
+        yield
+        return
+
+    with timer.phase(phase):
+        yield
+
+
+def record_phase(phase: Phase, duration: float):
+    """Record a phase of the current request, measured elsewhere (e.g. in a worker)"""
+    timer = _request_timer.get()
+    if timer is not None:
+        timer.record(phase, duration)
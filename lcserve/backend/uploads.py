@@ -0,0 +1,439 @@
+"""Multipart parsing for `@serving` routes with `UploadFile` parameters.
+
+FastAPI parses the whole form before the route runs, and hands over the files
+as-is. With `upload_mode`, `max_upload_size` or `upload_spill_size` set, the
+body is instead read as a stream, each file is written to a temp file under the
+workspace once it's bigger than `upload_spill_size`, and the body is rejected as
+soon as it's bigger than `max_upload_size`.
+
+Websocket routes receive files the same way, as binary frames announced by a
+header frame, see `receive_ws_file`.
+"""
+
+import inspect
+import mmap
+import os
+from dataclasses import dataclass
+from enum import Enum
+from tempfile import SpooledTemporaryFile
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+)
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, UploadFile
+
+UPLOADS_DIR = 'uploads'
+# key of the text frame announcing a file on websockets, its content follows as binary frames
+WS_FILE_KEY = '__file__'
+DEFAULT_SPILL_SIZE = 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+
+class UploadMode(str, Enum):
+    """UploadMode is what `UploadFile` parameters receive"""
+
+    # a starlette `UploadFile`, like without the upload options
+    FILE = 'file'
+    # an `UploadStream`, iterated in chunks
+    STREAM = 'stream'
+    # a `MappedUpload`, the read-only memory map of the file
+    MMAP = 'mmap'
+
+
+@dataclass(frozen=True)
+class UploadConfig:
+    """Upload handling of a `@serving` route, set with `upload_mode`, `max_upload_size`
+    & `upload_spill_size`."""
+
+    mode: UploadMode = UploadMode.FILE
+    # bytes of the whole body, larger requests are rejected with 413
+    max_size: Optional[int] = None
+    # bytes of a file kept in memory before it's written to disk
+    spill_size: int = DEFAULT_SPILL_SIZE
+
+    @classmethod
+    def from_options(
+        cls,
+        upload_mode: Optional[str] = None,
+        max_upload_size: Optional[int] = None,
+        upload_spill_size: Optional[int] = None,
+    ) -> Optional['UploadConfig']:
+        """None if no option is set, to let FastAPI parse the form"""
+        if (
+            upload_mode is None
+            and max_upload_size is None
+            and upload_spill_size is None
+        ):
+            return None
+
+        return cls(
+            mode=UploadMode(upload_mode or UploadMode.FILE),
+            max_size=max_upload_size,
+            spill_size=(
+                DEFAULT_SPILL_SIZE if upload_spill_size is None else upload_spill_size
+            ),
+        )
+
+
+class UploadTooLargeError(Exception):
+    def __init__(self, max_size: int, what: str = 'Request body'):
+        self.max_size = max_size
+        super().__init__(f'{what} is larger than {max_size} bytes')
+
+
+class MalformedUploadError(Exception):
+    pass
+
+
+class UploadStream:
+    """A file uploaded with `upload_mode='stream'`.
+
+    Iterate it in chunks, with `for` in sync functions or `async for` in async ones,
+    instead of reading the whole file into memory.
+    """
+
+    def __init__(
+        self,
+        file: SpooledTemporaryFile,
+        filename: Optional[str],
+        content_type: Optional[str],
+        size: int,
+        chunk_size: int = CHUNK_SIZE,
+    ):
+        self.file = file
+        self.filename = filename
+        self.content_type = content_type
+        self.size = size
+        self.chunk_size = chunk_size
+
+    def __iter__(self) -> Iterator[bytes]:
+        self.file.seek(0)
+        while True:
+            chunk = self.file.read(self.chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        self.file.seek(0)
+        while True:
+            if _in_memory(self.file):
+                chunk = self.file.read(self.chunk_size)
+            else:
+                chunk = await run_in_threadpool(self.file.read, self.chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def __repr__(self) -> str:
+        return f'UploadStream(filename={self.filename!r}, size={self.size})'
+
+
+class MappedUpload(mmap.mmap):
+    """A file uploaded with `upload_mode='mmap'`.
+
+    The read-only memory map of the temp file: slice it or use it as a file object,
+    pages are loaded by the OS as they are accessed. Empty files can't be mapped
+    and are passed as `b''`.
+    """
+
+    filename: Optional[str] = None
+    content_type: Optional[str] = None
+
+
+def _in_memory(file: SpooledTemporaryFile) -> bool:
+    return getattr(file, '_rolled', True) is False
+
+
+class Upload:
+    """A file of the request, until it's handed over to the function"""
+
+    def __init__(
+        self,
+        field_name: str,
+        filename: Optional[str],
+        headers: Headers,
+        spill_size: int,
+        upload_dir: str,
+    ):
+        self.field_name = field_name
+        self.filename = filename
+        self.headers = headers
+        self.size = 0
+        self.file = SpooledTemporaryFile(max_size=spill_size, dir=upload_dir)
+        if spill_size == 0:
+            # `max_size=0` means never, not right away
+            self.file.rollover()
+        self._mapped: Optional[MappedUpload] = None
+
+    @property
+    def content_type(self) -> Optional[str]:
+        return self.headers.get('content-type')
+
+    async def write(self, data: bytes):
+        self.size += len(data)
+        if _in_memory(self.file):
+            self.file.write(data)
+        else:
+            await run_in_threadpool(self.file.write, data)
+
+    def to_param(self, mode: UploadMode) -> Any:
+        self.file.seek(0)
+        if mode == UploadMode.STREAM:
+            return UploadStream(
+                self.file,
+                filename=self.filename,
+                content_type=self.content_type,
+                size=self.size,
+            )
+        elif mode == UploadMode.MMAP:
+            if self.size == 0:
+                return b''
+            self.file.flush()
+            self._mapped = MappedUpload(
+                self.file.fileno(), self.size, access=mmap.ACCESS_READ
+            )
+            self._mapped.filename = self.filename
+            self._mapped.content_type = self.content_type
+            return self._mapped
+
+        return UploadFile(
+            self.file, size=self.size, filename=self.filename, headers=self.headers
+        )
+
+    def close(self):
+        if self._mapped is not None:
+            try:
+                self._mapped.close()
+            except BufferError:
+                # still exported by a memoryview of the function, unmapped once collected
+                pass
+        self.file.close()
+
+
+class Uploads:
+    """Fields & files of a multipart body, files are closed with `close()`"""
+
+    def __init__(self):
+        self.fields: Dict[str, str] = {}
+        self.files: Dict[str, Upload] = {}
+
+    @property
+    def size(self) -> int:
+        return sum(upload.size for upload in self.files.values())
+
+    def params(self, names: Iterable[str], mode: UploadMode) -> Dict[str, Any]:
+        return {n: self.files[n].to_param(mode) for n in names if n in self.files}
+
+    def close(self):
+        for upload in self.files.values():
+            upload.close()
+
+
+def is_ws_file_header(data: Any) -> bool:
+    return isinstance(data, dict) and WS_FILE_KEY in data
+
+
+async def receive_ws_file(
+    header: Dict[str, Any],
+    receive_bytes: Callable[[], Awaitable[bytes]],
+    uploads: Uploads,
+    config: UploadConfig,
+    upload_dir: str,
+) -> Upload:
+    """Receive the file announced by a websocket header frame, e.g.
+    `{"__file__": {"name": "file", "filename": "doc.pdf", "size": 1024, "content_type": "application/pdf"}}`,
+    from the binary frames that follow it, `size` bytes in total.
+    """
+    _file = header[WS_FILE_KEY]
+    try:
+        name, size = _file['name'], int(_file['size'])
+    except (TypeError, KeyError, ValueError):
+        raise MalformedUploadError('A file header needs a `name` and a `size`')
+    if size < 0:
+        raise MalformedUploadError(f'Invalid size {size} of file `{name}`')
+    if config.max_size is not None and uploads.size + size > config.max_size:
+        raise UploadTooLargeError(config.max_size, what='Upload')
+
+    if name in uploads.files:
+        # sent again, the last one wins
+        uploads.files.pop(name).close()
+    upload = Upload(
+        field_name=name,
+        filename=_file.get('filename'),
+        headers=Headers(
+            {'content-type': _file.get('content_type') or 'application/octet-stream'}
+        ),
+        spill_size=config.spill_size,
+        upload_dir=upload_dir,
+    )
+    uploads.files[name] = upload
+    while upload.size < size:
+        chunk = await receive_bytes()
+        if upload.size + len(chunk) > size:
+            raise MalformedUploadError(f'File `{name}` is larger than {size} bytes')
+        await upload.write(chunk)
+    return upload
+
+
+def get_upload_dir(workspace: str) -> str:
+    upload_dir = os.path.join(workspace, UPLOADS_DIR)
+    os.makedirs(upload_dir, exist_ok=True)
+    return upload_dir
+
+
+async def parse_multipart(
+    headers: Mapping[str, str],
+    stream: AsyncIterator[bytes],
+    config: UploadConfig,
+    upload_dir: str,
+) -> Uploads:
+    """Parse a multipart body while it's received, without holding it in memory"""
+    # python-multipart is only needed by upload routes
+    try:
+        from python_multipart.multipart import MultipartParser, parse_options_header
+    except ImportError:
+        from multipart.multipart import MultipartParser, parse_options_header
+
+    content_type, options = parse_options_header(headers.get('content-type', ''))
+    if content_type != b'multipart/form-data' or b'boundary' not in options:
+        raise MalformedUploadError('Expected a multipart/form-data body')
+
+    if config.max_size is not None:
+        try:
+            content_length = int(headers.get('content-length', 0))
+        except ValueError:
+            raise MalformedUploadError('Invalid Content-Length header')
+        if content_length > config.max_size:
+            raise UploadTooLargeError(config.max_size)
+
+    charset = options.get(b'charset', b'utf-8').decode('latin-1')
+    uploads = Uploads()
+    # (field name, raw headers, file or field data) of the current part
+    part: Dict[str, Any] = {}
+    header: List[bytes] = [b'', b'']
+    # parser callbacks can't await, file data is written after each chunk
+    pending: List[Tuple[Upload, bytes]] = []
+
+    def on_part_begin():
+        part.clear()
+        part.update(headers=[], upload=None, data=bytearray())
+
+    def on_header_field(data: bytes, start: int, end: int):
+        header[0] += data[start:end]
+
+    def on_header_value(data: bytes, start: int, end: int):
+        header[1] += data[start:end]
+
+    def on_header_end():
+        part['headers'].append((header[0].lower(), header[1]))
+        header[0], header[1] = b'', b''
+
+    def on_headers_finished():
+        _headers = Headers(raw=part['headers'])
+        _, _options = parse_options_header(_headers.get('content-disposition', ''))
+        if b'name' not in _options:
+            raise MalformedUploadError(
+                'Missing name in the Content-Disposition of a part'
+            )
+        part['name'] = _options[b'name'].decode(charset, errors='replace')
+        if b'filename' in _options:
+            if part['name'] in uploads.files:
+                # sent again, the last one wins
+                _replaced = uploads.files.pop(part['name'])
+                pending[:] = [(u, d) for u, d in pending if u is not _replaced]
+                _replaced.close()
+            part['upload'] = Upload(
+                field_name=part['name'],
+                filename=_options[b'filename'].decode(charset, errors='replace'),
+                headers=_headers,
+                spill_size=config.spill_size,
+                upload_dir=upload_dir,
+            )
+            uploads.files[part['name']] = part['upload']
+
+    def on_part_data(data: bytes, start: int, end: int):
+        if part['upload'] is None:
+            part['data'] += data[start:end]
+        else:
+            pending.append((part['upload'], data[start:end]))
+
+    def on_part_end():
+        if part['upload'] is None:
+            uploads.fields[part['name']] = part['data'].decode(
+                charset, errors='replace'
+            )
+
+    parser = MultipartParser(
+        options[b'boundary'],
+        {
+            'on_part_begin': on_part_begin,
+            'on_part_data': on_part_data,
+            'on_part_end': on_part_end,
+            'on_header_field': on_header_field,
+            'on_header_value': on_header_value,
+            'on_header_end': on_header_end,
+            'on_headers_finished': on_headers_finished,
+        },
+    )
+
+    received = 0
+    try:
+        async for chunk in stream:
+            received += len(chunk)
+            if config.max_size is not None and received > config.max_size:
+                raise UploadTooLargeError(config.max_size)
+
+            try:
+                parser.write(chunk)
+            except MalformedUploadError:
+                raise
+            except Exception as e:
+                raise MalformedUploadError(f'Invalid multipart body: {e}') from e
+
+            for upload, data in pending:
+                await upload.write(data)
+            pending.clear()
+
+        parser.finalize()
+    except BaseException:
+        uploads.close()
+        raise
+
+    return uploads
+
+
+def get_upload_openapi_extra(file_params: List[inspect.Parameter]) -> Dict[str, Any]:
+    """The form of the route in the OpenAPI schema, as FastAPI doesn't parse it"""
+    return {
+        'requestBody': {
+            'required': True,
+            'content': {
+                'multipart/form-data': {
+                    'schema': {
+                        'type': 'object',
+                        'properties': {
+                            'data': {'type': 'string'},
+                            **{
+                                p.name: {'type': 'string', 'format': 'binary'}
+                                for p in file_params
+                            },
+                        },
+                        'required': ['data']
+                        + [p.name for p in file_params if p.default is ...],
+                    }
+                }
+            },
+        }
+    }
@@ -8,8 +8,6 @@ from typing import TYPE_CHECKING
 if TYPE_CHECKING:
     from pandas import DataFrame
 
-import hubble
-
 APPDIR = '/appdir'
 JINAAI_PREFIX = 'jinaai://'
 
@@ -23,6 +21,8 @@ def _import_pandas():
 
 
 def upload_df(df: 'DataFrame', name: str, to_csv_kwargs={}) -> str:
+    import hubble
+
     with NamedTemporaryFile(suffix='.csv') as f:
         df.to_csv(f.name, **to_csv_kwargs)
         r = hubble.Client().upload_artifact(f=f.name, is_public=True, name=name)
@@ -40,6 +40,8 @@ def _download_df_from_jinaai(id: str, read_csv_kwargs={}) -> 'DataFrame':
         raise ValueError(f'Invalid id: {id}')
     id = id[len(JINAAI_PREFIX) :]
 
+    import hubble
+
     with NamedTemporaryFile(suffix='.csv') as f:
         hubble.Client().download_artifact(id=id, f=f.name)
         return pd.read_csv(f.name, **read_csv_kwargs)
@@ -0,0 +1,381 @@
+import asyncio
+import contextvars
+import inspect
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import redirect_stdout
+from enum import Enum
+from importlib import import_module
+from importlib.util import module_from_spec, spec_from_file_location
+from io import StringIO
+from types import ModuleType
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    AsyncGenerator,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Generator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
+
+from .playground.utils.helper import request_cwd, request_env_overlay
+from .timing import Phase, record_phase
+
+if TYPE_CHECKING:
+    from opentelemetry.metrics import Histogram
+
+DEFAULT_POOL = 'default'
+# Items buffered between a sync generator and its consumer
+DEFAULT_BUFFER_SIZE = 64
+
+
+class ExecutorType(str, Enum):
+    """ExecutorType is where sync `@serving` functions run"""
+
+    THREAD = 'thread'
+    PROCESS = 'process'
+
+
+def default_max_workers() -> int:
+    # same default as `concurrent.futures.ThreadPoolExecutor`
+    return min(32, (os.cpu_count() or 1) + 4)
+
+
+class WorkerPoolFullError(Exception):
+    """Raised when a worker pool has reached its queue limit."""
+
+    def __init__(self, name: str, queue_size: int, retry_after: int = 1):
+        super().__init__(
+            f'Worker pool `{name}` is busy: {queue_size} calls are already queued'
+        )
+        self.name = name
+        self.queue_size = queue_size
+        self.retry_after = retry_after
+
+
+class _BaseWorkerPool(ABC):
+    # Whether functions share memory with the gateway, i.e. can receive
+    # non-picklable kwargs like callback handlers or the websocket.
+    shares_memory = True
+
+    def __init__(
+        self,
+        name: str = DEFAULT_POOL,
+        max_workers: Optional[int] = None,
+        queue_size: Optional[int] = None,
+        retry_after: int = 1,
+        queue_wait_histogram: Optional['Histogram'] = None,
+    ):
+        """
+        :param name: name of the pool, used in metrics and error messages
+        :param max_workers: number of workers, defaults to `min(32, cpu + 4)`
+        :param queue_size: max calls waiting for a free worker, unbounded if None
+        :param retry_after: seconds suggested to clients when the queue is full
+        :param queue_wait_histogram: histogram to record queue wait time in seconds
+        """
+        self.name = name
+        self.max_workers = max_workers or default_max_workers()
+        self.queue_size = queue_size
+        self.retry_after = retry_after
+        self.queue_wait_histogram = queue_wait_histogram
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    @property
+    def queued(self) -> int:
+        """Number of calls waiting for a free worker"""
+        return max(0, self._in_flight - self.max_workers)
+
+    def _check_queue(self):
+        # full once a new call would have to wait behind `queue_size` others
+        if (
+            self.queue_size is not None
+            and self._in_flight >= self.max_workers + self.queue_size
+        ):
+            raise WorkerPoolFullError(
+                self.name, self.queue_size, retry_after=self.retry_after
+            )
+
+    def check_capacity(self, func: Callable):
+        """Raise `WorkerPoolFullError` if a call of `func` would be rejected right now.
+
+        Lets routes reject a call before committing to a response, e.g. a stream.
+        """
+        # `@serving` wraps async generator functions in a sync function
+        _func = inspect.unwrap(func)
+        if self.shares_memory and (
+            inspect.iscoroutinefunction(_func) or inspect.isasyncgenfunction(_func)
+        ):
+            # runs on the loop, not in a worker
+            return
+
+        with self._lock:
+            self._check_queue()
+
+    def _acquire(self):
+        with self._lock:
+            self._check_queue()
+            self._in_flight += 1
+
+    def _release(self, *args):
+        with self._lock:
+            self._in_flight -= 1
+
+    def _record_queue_wait(self, duration: float):
+        if self.queue_wait_histogram:
+            self.queue_wait_histogram.record(duration, {'pool': self.name})
+        # also as a phase of the request's latency
+        record_phase(Phase.QUEUE, duration)
+
+    @abstractmethod
+    def _submit(self, func: Callable, kwargs: Dict) -> Future:
+        """Submit a sync call to a worker"""
+
+    async def _result(self, future: Future) -> Any:
+        return await asyncio.wrap_future(future)
+
+    async def run(self, func: Callable, **kwargs):
+        if inspect.iscoroutinefunction(func) and self.shares_memory:
+            return await func(**kwargs)
+
+        self._acquire()
+        try:
+            future = self._submit(func, kwargs)
+        except BaseException:
+            self._release()
+            raise
+
+        # Released on completion, but also if the call gets cancelled before it starts
+        future.add_done_callback(self._release)
+        return await self._result(future)
+
+    async def iterate(
+        self,
+        gen: Union[Generator, AsyncGenerator],
+        buffer_size: int = DEFAULT_BUFFER_SIZE,
+    ) -> AsyncIterator[Any]:
+        """Iterate a generator returned by a `@serving` function without blocking the loop.
+
+        A sync generator is driven by a worker of the pool, which pushes its items into a
+        queue of `buffer_size` items. The worker waits while the queue is full, so a slow
+        consumer slows down the generator instead of growing memory.
+        """
+        if inspect.isasyncgen(gen):
+            async for item in gen:
+                yield item
+            return
+
+        # generators can't be sent back from other processes, registration rejects them
+        assert (
+            self.shares_memory
+        ), f'Pool `{self.name}` can not iterate generators created in the gateway'
+
+        loop = asyncio.get_running_loop()
+        items: asyncio.Queue = asyncio.Queue(maxsize=buffer_size)
+        stopped = threading.Event()
+
+        def _produce():
+            try:
+                for item in gen:
+                    if stopped.is_set():
+                        break
+                    asyncio.run_coroutine_threadsafe(items.put(item), loop).result()
+            finally:
+                gen.close()
+
+        task = asyncio.ensure_future(self.run(_produce))
+        _get = None
+        try:
+            while not task.done():
+                _get = asyncio.ensure_future(items.get())
+                await asyncio.wait({task, _get}, return_when=asyncio.FIRST_COMPLETED)
+                if _get.done():
+                    yield _get.result()
+                else:
+                    _get.cancel()
+
+            # the last put completes before the worker returns, nothing is left behind
+            while not items.empty():
+                yield items.get_nowait()
+
+            # raises the generator's exception, if any
+            task.result()
+        finally:
+            if _get is not None:
+                _get.cancel()
+            # The consumer is gone (e.g. the client disconnected), unblock the worker
+            # and let it close the generator.
+            stopped.set()
+            while not items.empty():
+                items.get_nowait()
+
+    def start(self):
+        pass
+
+    @abstractmethod
+    def shutdown(self, wait: bool = False):
+        """Stop the workers, without waiting for running calls unless `wait`"""
+
+
+class ThreadWorkerPool(_BaseWorkerPool):
+    """A bounded thread pool to run sync `@serving` functions.
+
+    Unlike the loop's default executor, a pool can be dedicated to a single route,
+    rejects new calls once `queue_size` calls are waiting for a free worker and
+    reports the time calls spent waiting in the queue.
+    """
+
+    def __init__(self, name: str = DEFAULT_POOL, **kwargs):
+        super().__init__(name, **kwargs)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix=f'lcserve-{name}'
+        )
+
+    def _submit(self, func: Callable, kwargs: Dict) -> Future:
+        submitted_at = time.perf_counter()
+
+        def _call():
+            self._record_queue_wait(time.perf_counter() - submitted_at)
+            return func(**kwargs)
+
+        # Run in a copy of the caller's context, so that contextvars (e.g. stdout capture)
+        # of the request are visible in the worker thread.
+        return self._executor.submit(contextvars.copy_context().run, _call)
+
+    def shutdown(self, wait: bool = False):
+        self._executor.shutdown(wait=wait)
+
+
+# The user module, imported once per worker process by `_init_process_worker`
+_worker_module: Optional[ModuleType] = None
+
+
+def _imported_by_name(module_name: str, module_file: str) -> bool:
+    """Whether the gateway imported `module_file` as `module_name`.
+
+    Modules loaded from a `.py` path are named after the file only, importing that name
+    may find another module on `sys.path` (e.g. `app` or `main`).
+    """
+    _file = getattr(sys.modules.get(module_name), '__file__', None)
+    return _file is not None and os.path.realpath(_file) == os.path.realpath(
+        module_file
+    )
+
+
+def _init_process_worker(
+    module_name: str, module_file: str, by_name: bool, sys_path: List[str]
+):
+    global _worker_module
+
+    for path in sys_path:
+        if path not in sys.path:
+            sys.path.append(path)
+
+    if by_name:
+        _worker_module = import_module(module_name)
+    else:
+        spec = spec_from_file_location(module_name, module_file)
+        _worker_module = module_from_spec(spec)
+        spec.loader.exec_module(_worker_module)
+
+
+def _noop():
+    pass
+
+
+def _set_envs(envs: Dict[str, Optional[str]]):
+    for k, v in envs.items():
+        if v is None:
+            os.environ.pop(k, None)
+        else:
+            os.environ[k] = v
+
+
+def _call_in_process_worker(
+    func_name: str, kwargs: Dict, envs: Dict[str, Optional[str]], cwd: str
+) -> Tuple[Any, str, float]:
+    started_at = time.time()
+    func = getattr(_worker_module, func_name)
+    _old_envs = {k: os.environ.get(k) for k in envs}
+    _old_cwd = os.getcwd()
+    # A worker runs one call at a time, so it's safe to update the process env & cwd here.
+    # Envs unset by the request are None.
+    _set_envs(envs)
+    os.chdir(cwd)
+    try:
+        with redirect_stdout(StringIO()) as stdout:
+            if inspect.iscoroutinefunction(func):
+                result = asyncio.run(func(**kwargs))
+            else:
+                result = func(**kwargs)
+        return result, stdout.getvalue(), started_at
+    finally:
+        os.chdir(_old_cwd)
+        _set_envs(_old_envs)
+
+
+class ProcessWorkerPool(_BaseWorkerPool):
+    """A pre-started process pool for CPU-bound `@serving` functions.
+
+    Every worker imports the module of the function once. Arguments and results
+    are pickled, the request envs and the working directory are set in the worker
+    for the duration of the call, and its stdout is replayed in the gateway.
+    """
+
+    shares_memory = False
+
+    def __init__(
+        self, name: str, func: Callable, max_workers: Optional[int] = None, **kwargs
+    ):
+        # CPU-bound work doesn't benefit from more processes than cores
+        super().__init__(name, max_workers=max_workers or os.cpu_count(), **kwargs)
+        self.func_name = func.__name__
+        module_file = inspect.getfile(inspect.unwrap(func))
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            # fork is unsafe with the gateway's threads & running event loop
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_process_worker,
+            initargs=(
+                func.__module__,
+                module_file,
+                _imported_by_name(func.__module__, module_file),
+                list(sys.path),
+            ),
+        )
+
+    def _submit(self, func: Callable, kwargs: Dict) -> Future:
+        future = self._executor.submit(
+            _call_in_process_worker,
+            self.func_name,
+            kwargs,
+            request_env_overlay(),
+            request_cwd(),
+        )
+        future.submitted_at = time.time()
+        return future
+
+    async def _result(self, future: Future) -> Any:
+        result, stdout, started_at = await asyncio.wrap_future(future)
+        self._record_queue_wait(max(0.0, started_at - future.submitted_at))
+        if stdout:
+            sys.stdout.write(stdout)
+        return result
+
+    def start(self):
+        # Spawn all workers (and import the module) before the first request
+        for _ in range(self.max_workers):
+            self._executor.submit(_noop)
+
+    def shutdown(self, wait: bool = False):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
@@ -0,0 +1,295 @@
+"""Startup profile of an lc-serve app, see `lc-serve util profile-startup`.
+
+Imports are profiled in a fresh interpreter with `-X importtime`, so that modules
+already imported by the CLI don't hide their cost. Models are then built in-process
+with the gateway's `_create_models`, and each route is approximated by a bare FastAPI
+endpoint taking those models, i.e. without the executor, caches etc. `ServingGateway`
+sets up per route.
+"""
+
+import inspect
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from dataclasses import asdict, dataclass, field
+from importlib import import_module
+from importlib.util import module_from_spec, spec_from_file_location
+from pathlib import Path
+from types import ModuleType
+from typing import Dict, List, Optional, Tuple
+
+from .backend.utils import fix_sys_path
+
+IMPORT_TIME_PREFIX = 'import time:'
+# printed to stderr by the profiled interpreter, around the import of the app
+APP_IMPORT_PREFIX = 'lcserve app import:'
+
+
+@dataclass
+class ImportEntry:
+    name: str
+    self_s: float
+    cumulative_s: float
+    depth: int
+    children: List['ImportEntry'] = field(default_factory=list)
+
+
+@dataclass
+class RouteEntry:
+    name: str
+    type: str
+    models_s: float
+    route_s: float
+
+
+@dataclass
+class StartupReport:
+    module: str
+    python: str
+    # of the app only, without the modules imported by the profiler itself
+    import_time_s: float
+    # of the interpreter that only imported the app
+    import_peak_rss_mb: float
+    # of this process, after building the models & routes
+    peak_rss_mb: float
+    imports: List[ImportEntry]
+    routes: List[RouteEntry]
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+    def save(self, path: str):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+
+def _resolve_module(module_str: str) -> str:
+    if module_str == '.':
+        from .flow import INIT_MODULE
+
+        return INIT_MODULE
+    return module_str
+
+
+def import_app(module_str: str) -> ModuleType:
+    """Import the app the way the gateway does, from a module name or a `.py` file"""
+    fix_sys_path()
+    module_str = _resolve_module(module_str)
+    if Path(module_str).is_file() and module_str.endswith('.py'):
+        spec = spec_from_file_location(Path(module_str).stem, module_str)
+        module = module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+
+    return import_module(module_str)
+
+
+def _peak_rss_mb(who: int) -> float:
+    _maxrss = resource.getrusage(who).ru_maxrss
+    # bytes on macOS, kilobytes on Linux
+    return _maxrss / (1 << 20) if sys.platform == 'darwin' else _maxrss / (1 << 10)
+
+
+def parse_importtime(output: str) -> List[ImportEntry]:
+    """Parse the output of `-X importtime` into a tree, the top-level imports first.
+
+    Imports are printed once they're done, i.e. after the imports they triggered,
+    and are indented by two spaces per level.
+    """
+    pending: Dict[int, List[ImportEntry]] = defaultdict(list)
+    for line in output.splitlines():
+        if not line.startswith(IMPORT_TIME_PREFIX):
+            continue
+
+        _self, _cumulative, _name = line[len(IMPORT_TIME_PREFIX) :].split('|', 2)
+        if not _self.strip().isdigit():
+            # the header
+            continue
+
+        depth = (len(_name) - len(_name.lstrip()) - 1) // 2
+        entry = ImportEntry(
+            name=_name.strip(),
+            self_s=int(_self) / 1e6,
+            cumulative_s=int(_cumulative) / 1e6,
+            depth=depth,
+        )
+        entry.children = pending.pop(depth + 1, [])
+        pending[depth].append(entry)
+
+    return pending[0]
+
+
+def split_app_imports(output: str) -> Tuple[str, float]:
+    """The `-X importtime` output of the app's import, and how long it took.
+
+    Imports of the profiler itself, before the app, are left out.
+    """
+    _, _start, _after = output.partition(f'{APP_IMPORT_PREFIX} start\n')
+    if not _start:
+        raise ValueError('No app import found in the output')
+
+    _app_output, _, _time = _after.rpartition(APP_IMPORT_PREFIX)
+    return _app_output, float(_time.split()[0])
+
+
+def profile_imports(module_str: str) -> Dict:
+    """Import the app in a fresh interpreter with `-X importtime`"""
+    script = '; '.join(
+        [
+            'import sys, time',
+            'from lcserve.profiling import import_app',
+            f'print({APP_IMPORT_PREFIX!r}, "start", file=sys.stderr, flush=True)',
+            'started_at = time.perf_counter()',
+            f'import_app({_resolve_module(module_str)!r})',
+            f'print({APP_IMPORT_PREFIX!r}, time.perf_counter() - started_at, file=sys.stderr)',
+        ]
+    )
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', script],
+        cwd=os.getcwd(),
+        capture_output=True,
+        text=True,
+    )
+    if process.returncode != 0:
+        _errors = [
+            line
+            for line in process.stderr.splitlines()
+            if not line.startswith(IMPORT_TIME_PREFIX)
+        ]
+        raise RuntimeError(
+            f'Could not import {module_str}:\n' + '\n'.join(_errors[-20:])
+        )
+
+    _app_output, _import_time_s = split_app_imports(process.stderr)
+    return {
+        'imports': parse_importtime(_app_output),
+        'import_time_s': _import_time_s,
+        'peak_rss_mb': _peak_rss_mb(resource.RUSAGE_CHILDREN),
+    }
+
+
+def profile_routes(module: ModuleType) -> List[RouteEntry]:
+    """Time building the models & a FastAPI route of each `@serving` function.
+
+    The models are built like the gateway does, the route is a bare endpoint taking
+    them, which is where FastAPI spends its time (dependencies & response field).
+    """
+    from fastapi import FastAPI
+
+    from .backend.gateway import RouteType, _create_models
+
+    app = FastAPI()
+    routes = []
+    for _, func in inspect.getmembers(module, inspect.isfunction):
+        if hasattr(func, '__serving__'):
+            route_type = RouteType.HTTP
+        elif hasattr(func, '__ws_serving__'):
+            route_type = RouteType.WEBSOCKET
+        else:
+            continue
+
+        started_at = time.perf_counter()
+        input_model, output_model, _ = _create_models(func)
+        models_s = time.perf_counter() - started_at
+
+        started_at = time.perf_counter()
+        if route_type == RouteType.HTTP:
+
+            async def _endpoint(input_data: input_model) -> output_model:
+                pass
+
+            app.post(f'/{func.__name__}', response_model=output_model)(_endpoint)
+        else:
+
+            async def _ws_endpoint(websocket):
+                pass
+
+            app.add_api_websocket_route(f'/{func.__name__}', _ws_endpoint)
+        route_s = time.perf_counter() - started_at
+
+        routes.append(
+            RouteEntry(
+                name=func.__name__,
+                type=route_type.value,
+                models_s=models_s,
+                route_s=route_s,
+            )
+        )
+
+    return sorted(routes, key=lambda r: r.models_s + r.route_s, reverse=True)
+
+
+def profile_startup(module_str: str) -> StartupReport:
+    _imports = profile_imports(module_str)
+    routes = profile_routes(import_app(module_str))
+    imports = sorted(_imports['imports'], key=lambda e: e.cumulative_s, reverse=True)
+    return StartupReport(
+        module=module_str,
+        python=platform.python_version(),
+        import_time_s=_imports['import_time_s'],
+        import_peak_rss_mb=_imports['peak_rss_mb'],
+        peak_rss_mb=_peak_rss_mb(resource.RUSAGE_SELF),
+        imports=imports,
+        routes=routes,
+    )
+
+
+def _flatten(
+    entries: List[ImportEntry], min_s: float, max_depth: Optional[int]
+) -> List[ImportEntry]:
+    # the tree, slowest imports first, without the imports under the threshold
+    _flat = []
+    for entry in entries:
+        if entry.cumulative_s < min_s:
+            continue
+        _flat.append(entry)
+        if max_depth is None or entry.depth < max_depth:
+            _children = sorted(
+                entry.children, key=lambda e: e.cumulative_s, reverse=True
+            )
+            _flat.extend(_flatten(_children, min_s, max_depth))
+    return _flat
+
+
+def print_report(report: StartupReport, min_ms: float = 10, max_depth: int = 3):
+    from rich.console import Console
+    from rich.table import Table
+
+    console = Console()
+
+    imports = Table(title=f'Imports of `{report.module}` (>= {min_ms}ms)')
+    imports.add_column('Module')
+    imports.add_column('Cumulative (ms)', justify='right')
+    imports.add_column('Self (ms)', justify='right')
+    for entry in _flatten(report.imports, min_ms / 1e3, max_depth):
+        imports.add_row(
+            '  ' * entry.depth + entry.name,
+            f'{entry.cumulative_s * 1e3:.1f}',
+            f'{entry.self_s * 1e3:.1f}',
+        )
+    console.print(imports)
+
+    routes = Table(title='Routes')
+    routes.add_column('Route')
+    routes.add_column('Type')
+    routes.add_column('Models (ms)', justify='right')
+    routes.add_column('Route (ms)', justify='right')
+    for route in report.routes:
+        routes.add_row(
+            route.name,
+            route.type,
+            f'{route.models_s * 1e3:.1f}',
+            f'{route.route_s * 1e3:.1f}',
+        )
+    console.print(routes)
+
+    console.print(
+        f'Import time: [bold]{report.import_time_s:.2f}s[/bold], '
+        f'peak RSS: [bold]{report.import_peak_rss_mb:.0f}MB[/bold] after imports, '
+        f'[bold]{report.peak_rss_mb:.0f}MB[/bold] after building {len(report.routes)} routes'
+    )
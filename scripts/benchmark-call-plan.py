@@ -0,0 +1,92 @@
+"""Compare the per-request overhead of building the function arguments.
+
+`legacy` re-introspects the function signature on every request (the behaviour
+before `CallPlan`), `call_plan` only fills in values from the precompiled plan.
+
+Usage: python scripts/benchmark-call-plan.py [--number 100000]
+"""
+
+import argparse
+import inspect
+import timeit
+from typing import Any, Dict
+
+from pydantic import BaseModel, Field, create_model
+
+from lcserve.backend.gateway import CallPlan, _get_func_data
+
+
+def _legacy_get_func_data(
+    func,
+    input_data,
+    files_data: Dict,
+    auth_response: Any = None,
+    workspace: str = None,
+    to_support_in_kwargs: Dict = {},
+):
+    _func_data = dict(input_data)
+    _envs = _func_data.pop('envs', {})
+
+    if files_data:
+        _func_data.update(files_data)
+
+    _func_params_names = list(inspect.signature(func).parameters.keys())
+    if 'auth_response' in _func_params_names:
+        _func_data['auth_response'] = auth_response
+    elif 'kwargs' in _func_params_names:
+        _func_data.update({'auth_response': auth_response})
+
+    if 'workspace' in _func_params_names:
+        _func_data['workspace'] = workspace
+    elif 'kwargs' in _func_params_names:
+        _func_data.update({'workspace': workspace})
+
+    if to_support_in_kwargs and 'kwargs' in _func_params_names:
+        _func_data.update(to_support_in_kwargs)
+
+    return _func_data, _envs
+
+
+def ask(question: str, urls: list, temperature: float = 0.0, **kwargs) -> str:
+    return question
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--number', type=int, default=100000)
+    args = parser.parse_args()
+
+    input_model = create_model(
+        'InputAsk',
+        question=(str, ...),
+        urls=(list, ...),
+        temperature=(float, 0.0),
+        envs=(Dict[str, str], Field(default={}, alias='envs')),
+    )
+    output_model = create_model('OutputAsk', result=(str, ...), error=(str, ...))
+    call_plan = CallPlan.from_func(
+        ask, input_model=input_model, output_model=output_model
+    )
+    input_data: BaseModel = input_model(question='hello', urls=['a', 'b'])
+    extras = {'tracing_handler': object()}
+
+    legacy = timeit.timeit(
+        lambda: _legacy_get_func_data(
+            ask, input_data, {}, 'user', '/tmp', to_support_in_kwargs=extras
+        ),
+        number=args.number,
+    )
+    planned = timeit.timeit(
+        lambda: _get_func_data(
+            call_plan, input_data, {}, 'user', '/tmp', to_support_in_kwargs=extras
+        ),
+        number=args.number,
+    )
+
+    print(f'legacy:    {legacy / args.number * 1e6:.2f} us/request')
+    print(f'call_plan: {planned / args.number * 1e6:.2f} us/request')
+    print(f'speedup:   {legacy / planned:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
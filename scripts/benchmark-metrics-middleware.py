@@ -0,0 +1,98 @@
+"""Compare the event loop overhead of `MetricsMiddleware`, before and after the shared duration sampler.
+
+`timer` is the previous implementation, which creates (and cancels) a timer task per
+request, `sampler` is the current `MetricsMiddleware`. Both wrap a no-op ASGI app, so
+that the numbers show the overhead of the middleware itself.
+
+Usage: python scripts/benchmark-metrics-middleware.py [--requests 100000] [--concurrency 1000]
+"""
+
+import argparse
+import asyncio
+import time
+
+from lcserve.backend.gateway import MetricsMiddleware
+
+
+class _Counter:
+    def add(self, value, attributes):
+        pass
+
+
+async def _app(scope, receive, send):
+    await asyncio.sleep(0)
+
+
+class TimerMetricsMiddleware:
+    """MetricsMiddleware with a timer task per request, as it was before the sampler"""
+
+    def __init__(self, app, duration_counter=None, request_counter=None):
+        self.app = app
+        self.duration_counter = duration_counter
+        self.request_counter = request_counter
+
+    async def _send_duration_periodically(self, shared_data, route, protocol):
+        while True:
+            await asyncio.sleep(5)
+            current_time = time.perf_counter()
+            self.duration_counter.add(
+                current_time - shared_data['last_reported_time'],
+                {'route': route, 'protocol': protocol},
+            )
+            shared_data['last_reported_time'] = current_time
+
+    async def __call__(self, scope, receive, send):
+        path = scope['path']
+        shared_data = {'last_reported_time': time.perf_counter()}
+        task = asyncio.create_task(
+            self._send_duration_periodically(shared_data, path, scope['type'])
+        )
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            task.cancel()
+            self.duration_counter.add(
+                time.perf_counter() - shared_data['last_reported_time'],
+                {'route': path, 'protocol': scope['type']},
+            )
+            self.request_counter.add(1, {'route': path, 'protocol': scope['type']})
+
+
+async def _run(middleware, requests: int, concurrency: int) -> float:
+    scope = {'type': 'http', 'path': '/ask'}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _request():
+        async with semaphore:
+            await middleware(scope, None, None)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[_request() for _ in range(requests)])
+    # let cancelled timer tasks be cleaned up, they are part of the cost
+    await asyncio.sleep(0)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=100_000)
+    parser.add_argument('--concurrency', type=int, default=1000)
+    args = parser.parse_args()
+
+    middlewares = {
+        'none': lambda: _app,
+        'timer': lambda: TimerMetricsMiddleware(_app, _Counter(), _Counter()),
+        'sampler': lambda: MetricsMiddleware(_app, _Counter(), _Counter()),
+    }
+    print(f'{args.requests} requests, concurrency {args.concurrency}')
+    print(f'{"middleware":<12}{"req/s":>12}{"us/req":>10}')
+    for name, middleware in middlewares.items():
+        duration = asyncio.run(_run(middleware(), args.requests, args.concurrency))
+        print(
+            f'{name:<12}{args.requests / duration:>12.0f}'
+            f'{duration / args.requests * 1e6:>10.1f}'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""Compare the cost of building a response, with and without `fast_response`.
+
+`model` validates the result against the output model and encodes it the way
+FastAPI does (`jsonable_encoder` + stdlib json), `fast` builds the dict directly
+and encodes it with orjson (or the stdlib json, if orjson isn't installed).
+
+Usage: python scripts/benchmark-response-encoding.py [--number 20]
+"""
+
+import argparse
+import json
+import timeit
+from typing import Dict, List
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import create_model
+
+from lcserve.backend.encoders import dumps, fast_output, orjson
+
+SIZES = {'1KB': 1 << 10, '100KB': 100 << 10, '10MB': 10 << 20}
+
+
+def _payloads(size: int) -> Dict[str, object]:
+    # ~100 bytes per record
+    records = [
+        {'id': i, 'text': 'x' * 64, 'score': 0.5} for i in range(max(1, size // 100))
+    ]
+    return {'str': 'x' * size, 'records': records}
+
+
+def _model_response(output_model, result) -> bytes:
+    content = jsonable_encoder(output_model(result=result, error='', stdout=''))
+    return json.dumps(content, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--number', type=int, default=20)
+    args = parser.parse_args()
+
+    output_models = {
+        'str': create_model(
+            'OutputStr', result=(str, ...), error=(str, ...), stdout=(str, '')
+        ),
+        'records': create_model(
+            'OutputRecords',
+            result=(List[Dict], ...),
+            error=(str, ...),
+            stdout=(str, ''),
+        ),
+    }
+
+    print(f'encoder: {"orjson" if orjson is not None else "json"}')
+    print(f'{"payload":<16}{"model (ms)":>12}{"fast (ms)":>12}{"speedup":>10}')
+    for size_name, size in SIZES.items():
+        for kind, result in _payloads(size).items():
+            output_model = output_models[kind]
+            model = timeit.timeit(
+                lambda: _model_response(output_model, result), number=args.number
+            )
+            fast = timeit.timeit(lambda: dumps(fast_output(result)), number=args.number)
+            print(
+                f'{size_name + " " + kind:<16}'
+                f'{model / args.number * 1e3:>12.3f}'
+                f'{fast / args.number * 1e3:>12.3f}'
+                f'{model / fast:>9.1f}x'
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -53,6 +53,21 @@ def authorizer(token: str) -> str:
     return "username"
 
 
+@serving
+def sync_http_stream(count: int) -> str:
+    for i in range(count):
+        yield str(i)
+    print("done")
+
+
+@serving
+async def async_http_stream(count: int) -> str:
+    for i in range(count):
+        await asyncio.sleep(0.1)
+        yield str(i)
+    print("done")
+
+
 @serving(auth=authorizer)
 def sync_auth_http(interval: int) -> str:
     time.sleep(interval)
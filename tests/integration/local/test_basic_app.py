@@ -37,6 +37,34 @@ def test_basic_app_http(run_test_app_locally, route):
     assert response_data["result"] == "Hello, world!"
 
 
+@pytest.mark.parametrize(
+    "run_test_app_locally, route",
+    [("basic_app", "sync_http_stream"), ("basic_app", "async_http_stream")],
+    indirect=["run_test_app_locally"],
+)
+def test_basic_app_http_stream(run_test_app_locally, route):
+    url = os.path.join(HTTP_HOST, route)
+    data = {"count": 3, "envs": {}}
+
+    # newline-delimited JSON by default
+    response = requests.post(url, json=data, stream=True)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    frames = [json.loads(line) for line in response.iter_lines() if line]
+    assert frames[:-1] == [{"result": "0"}, {"result": "1"}, {"result": "2"}]
+    assert frames[-1] == {"error": "", "stdout": "done"}
+
+    # Server-Sent Events if asked for
+    response = requests.post(
+        url, headers={"Accept": "text/event-stream"}, json=data, stream=True
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = response.text.strip().split("\n\n")
+    assert events[0] == 'data: {"result": "0"}'
+    assert events[-1] == 'event: end\ndata: {"error": "", "stdout": "done"}'
+
+
 @pytest.mark.asyncio
 @pytest.mark.parametrize(
     "run_test_app_locally, route",
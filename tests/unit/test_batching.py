@@ -0,0 +1,57 @@
+import asyncio
+from typing import Dict, List
+
+import pytest
+
+from lcserve.backend.batching import (
+    BatchConfig,
+    Batcher,
+    BatchError,
+    get_batched_fields,
+    get_item_type,
+)
+
+
+def test_batched_fields_are_the_list_parameters():
+    def embed(texts: List[str], ids: List[int], model: str = 'small') -> List[float]:
+        pass
+
+    assert get_batched_fields(embed) == ('texts', 'ids')
+    assert get_item_type(List[str]) is str
+    assert get_item_type(Dict[str, str]) is None
+    assert get_item_type(str) is None
+
+
+@pytest.mark.asyncio
+async def test_batcher_collects_concurrent_items():
+    batches = []
+
+    async def run_batch(items):
+        batches.append(items)
+        return [ValueError('empty') if not item else item * 2 for item in items]
+
+    batcher = Batcher('route', BatchConfig(max_batch_size=3, max_wait_ms=10))
+    results = await asyncio.gather(
+        *[batcher.submit('key', item, run_batch) for item in ['a', '', 'c', 'd']],
+        batcher.submit('other', 'e', run_batch),
+        return_exceptions=True,
+    )
+
+    # full batches are sent right away, the others after max_wait_ms
+    assert batches == [['a', '', 'c'], ['d'], ['e']]
+    assert results[0] == 'aa'
+    assert isinstance(results[1], ValueError)
+    assert results[2:] == ['cc', 'dd', 'ee']
+
+
+@pytest.mark.asyncio
+async def test_batcher_fails_all_items_of_a_failed_batch():
+    async def run_batch(items):
+        return items[:1]
+
+    batcher = Batcher('route', BatchConfig(max_batch_size=2, max_wait_ms=10))
+    results = await asyncio.gather(
+        *[batcher.submit('key', item, run_batch) for item in ['a', 'b']],
+        return_exceptions=True,
+    )
+    assert all(isinstance(r, BatchError) for r in results)
@@ -0,0 +1,168 @@
+import asyncio
+import os
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from lcserve.backend.cache import (
+    AuthCache,
+    CacheBackend,
+    CacheConfig,
+    DiskCache,
+    InvalidTokenError,
+    MemoryCache,
+    RouteCache,
+)
+
+
+def test_cache_config_parse():
+    assert CacheConfig.parse(True) == CacheConfig()
+    assert CacheConfig.parse('disk').backend == CacheBackend.DISK
+    assert CacheConfig.parse({'backend': 'disk', 'ttl': 10}) == CacheConfig(
+        backend=CacheBackend.DISK, ttl=10
+    )
+    with pytest.raises(ValueError):
+        CacheConfig.parse(1)
+
+
+def test_memory_cache_evicts_least_recently_used():
+    cache = MemoryCache(max_bytes=10)
+    cache.put('a', b'aaaa')
+    cache.put('b', b'bbbb')
+    assert cache.get('a') == b'aaaa'
+
+    cache.put('c', b'cccc')
+    assert cache.get('b') is None
+    assert cache.get('a') == b'aaaa'
+    assert cache.get('c') == b'cccc'
+
+    # larger than the budget, never cached
+    cache.put('d', b'd' * 11)
+    assert cache.get('d') is None
+
+
+def test_memory_cache_expires_entries():
+    cache = MemoryCache(max_bytes=10)
+    cache.put('a', b'a', ttl=0.05)
+    assert cache.get('a') == b'a'
+    time.sleep(0.1)
+    assert cache.get('a') is None
+
+
+def test_disk_cache_survives_restarts(tmpdir):
+    cache = DiskCache(str(tmpdir), max_bytes=10)
+    cache.put('a', b'aaaa')
+    cache.put('b', b'bbbb', ttl=0.05)
+
+    cache = DiskCache(str(tmpdir), max_bytes=10)
+    assert cache.get('a') == b'aaaa'
+    time.sleep(0.1)
+    assert cache.get('b') is None
+
+    cache.put('c', b'cccc')
+    cache.put('d', b'dddd')
+    assert cache.get('a') is None
+    assert cache.get('d') == b'dddd'
+
+
+def test_disk_cache_keeps_expiry_in_the_entry(tmpdir):
+    cache = DiskCache(str(tmpdir), max_bytes=10)
+    cache.put('a', b'aaaa')
+    cache.put('b', b'bbbb', ttl=60)
+    # e.g. touched by a backup tool
+    for key in ['a', 'b']:
+        os.utime(tmpdir.join(f'{key}.json'), (1, 1))
+    # left behind by an interrupted put
+    tmpdir.join('c.json.1.tmp').write('cccccccc')
+
+    cache = DiskCache(str(tmpdir), max_bytes=10)
+    assert cache.get('a') == b'aaaa'
+    assert cache.get('b') == b'bbbb'
+    assert cache._size == 8
+
+
+@pytest.mark.asyncio
+async def test_route_cache_key_ignores_envs_and_auth(tmpdir):
+    cache = RouteCache('ask', CacheConfig(), workspace=str(tmpdir))
+    key = cache.key({'question': 'hi'}, {'OPENAI_API_KEY': 'a'}, 'user-a')
+    assert key == cache.key({'question': 'hi'}, {'OPENAI_API_KEY': 'b'}, 'user-b')
+    assert key != cache.key({'question': 'hello'}, {}, None)
+
+    cache = RouteCache('ask', CacheConfig(include_auth=True), workspace=str(tmpdir))
+    assert cache.key({'question': 'hi'}, {}, 'user-a') != cache.key(
+        {'question': 'hi'}, {}, 'user-b'
+    )
+
+    assert await cache.get(key) is None
+    await cache.put(key, {'answer': 42}, 'stdout')
+    assert await cache.get(key) == ({'answer': 42}, 'stdout')
+
+
+@pytest.mark.asyncio
+async def test_auth_cache_reuses_responses_per_token():
+    calls = []
+
+    async def auth(token: str):
+        calls.append(token)
+        await asyncio.sleep(0.02)
+        if token == 'unreachable':
+            raise ConnectionError('identity provider is down')
+        if token == 'forbidden':
+            raise HTTPException(status_code=403, detail='not allowed')
+        if token != 'valid':
+            raise InvalidTokenError('invalid token')
+        return {'user': 'someone'}
+
+    auth_cache = AuthCache(auth, ttl=60, negative_ttl=0.05)
+    # concurrent lookups of the same token share a single call
+    results = await asyncio.gather(*[auth_cache.verify('valid') for _ in range(5)])
+    assert results == [{'user': 'someone'}] * 5
+    assert calls == ['valid']
+
+    # rejected tokens are cached for the negative ttl, with a new error per request
+    errors = []
+    for _ in range(2):
+        with pytest.raises(InvalidTokenError) as e:
+            await auth_cache.verify('invalid')
+        errors.append(e.value)
+    assert calls == ['valid', 'invalid']
+    assert errors[0] is not errors[1]
+    assert str(errors[1]) == 'invalid token'
+
+    await asyncio.sleep(0.06)
+    with pytest.raises(InvalidTokenError):
+        await auth_cache.verify('invalid')
+    assert calls == ['valid', 'invalid', 'invalid']
+
+    # other errors may be transient, they aren't cached
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            await auth_cache.verify('unreachable')
+    assert calls[3:] == ['unreachable', 'unreachable']
+
+    # so are 401 & 403 HTTP errors
+    for _ in range(2):
+        with pytest.raises(HTTPException) as e:
+            await auth_cache.verify('forbidden')
+        assert (e.value.status_code, e.value.detail) == (403, 'not allowed')
+    assert calls[5:] == ['forbidden']
+
+
+@pytest.mark.asyncio
+async def test_auth_cache_expires_and_evicts_tokens():
+    calls = []
+
+    def auth(token: str):
+        calls.append(token)
+        return token
+
+    auth_cache = AuthCache(auth, ttl=0.05, max_entries=1)
+    await auth_cache.verify('a')
+    await auth_cache.verify('b')
+    await auth_cache.verify('a')
+    assert calls == ['a', 'b', 'a']
+
+    await asyncio.sleep(0.06)
+    await auth_cache.verify('a')
+    assert calls == ['a', 'b', 'a', 'a']
@@ -0,0 +1,183 @@
+import asyncio
+import threading
+
+import pytest
+
+from lcserve.backend.concurrency import (
+    AdmissionController,
+    AdmissionRejectedError,
+    CallTimeout,
+    CallTimeoutError,
+    ClientDisconnectedError,
+    ErrorPolicy,
+    SingleFlight,
+    SingleFlightConfig,
+    cancel_on_disconnect,
+)
+
+
+@pytest.mark.asyncio
+async def test_single_flight_shares_concurrent_calls():
+    single_flight = SingleFlight()
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return 'result'
+
+    results = await asyncio.gather(*[single_flight.do('key', fn) for _ in range(5)])
+    assert len(calls) == 1
+    assert [r for r, _ in results] == ['result'] * 5
+    assert [shared for _, shared in results] == [False] + [True] * 4
+
+    # the key is forgotten once the call is done
+    assert await single_flight.do('key', fn) == ('result', False)
+    assert len(calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_single_flight_max_waiters():
+    single_flight = SingleFlight(SingleFlightConfig(max_waiters=2))
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return 'result'
+
+    await asyncio.gather(*[single_flight.do('key', fn) for _ in range(5)])
+    assert len(calls) == 3
+
+
+@pytest.mark.parametrize(
+    'error_policy, expected_calls', [(ErrorPolicy.SHARE, 1), (ErrorPolicy.RETRY, 3)]
+)
+@pytest.mark.asyncio
+async def test_single_flight_error_policy(error_policy, expected_calls):
+    single_flight = SingleFlight(SingleFlightConfig(error_policy=error_policy))
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        if len(calls) == 1:
+            raise ValueError('failed')
+        return 'result'
+
+    results = await asyncio.gather(
+        *[single_flight.do('key', fn) for _ in range(3)], return_exceptions=True
+    )
+    assert len(calls) == expected_calls
+    assert isinstance(results[0], ValueError)
+    if error_policy == ErrorPolicy.SHARE:
+        assert all(isinstance(r, ValueError) for r in results)
+    else:
+        assert results[1:] == [('result', False), ('result', False)]
+
+
+@pytest.mark.asyncio
+async def test_admission_controller_limits_concurrency():
+    admission = AdmissionController('route', max_concurrency=2)
+    running, max_running = 0, 0
+
+    async def request():
+        nonlocal running, max_running
+        async with admission.admit():
+            running += 1
+            max_running = max(max_running, running)
+            await asyncio.sleep(0.02)
+            running -= 1
+
+    await asyncio.gather(*[request() for _ in range(6)])
+    assert max_running == 2
+    assert admission.queued == 0
+
+
+@pytest.mark.asyncio
+async def test_admission_controller_rejects_beyond_max_queue():
+    admission = AdmissionController('route', max_concurrency=1, max_queue=1)
+
+    async def request():
+        async with admission.admit():
+            await asyncio.sleep(0.05)
+            return 'ok'
+
+    results = await asyncio.gather(
+        *[request() for _ in range(3)], return_exceptions=True
+    )
+    assert results[:2] == ['ok', 'ok']
+    assert isinstance(results[2], AdmissionRejectedError)
+
+    # slots are released, new requests are admitted again
+    assert await request() == 'ok'
+
+
+@pytest.mark.asyncio
+async def test_cancel_on_disconnect():
+    cancel_event = threading.Event()
+    assert (
+        await cancel_on_disconnect(
+            asyncio.sleep(0, result='result'), asyncio.sleep(1), cancel_event
+        )
+        == 'result'
+    )
+    assert not cancel_event.is_set()
+
+    cancelled = []
+
+    async def fn():
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            cancelled.append(1)
+            raise
+
+    with pytest.raises(ClientDisconnectedError):
+        await cancel_on_disconnect(fn(), asyncio.sleep(0.01), cancel_event)
+    assert cancelled == [1]
+    assert cancel_event.is_set()
+
+
+class _Counter:
+    def __init__(self):
+        self.value = 0
+
+    def add(self, value, attributes):
+        self.value += value
+
+
+@pytest.mark.asyncio
+async def test_call_timeout_run():
+    counter = _Counter()
+    call_timeout = CallTimeout('route', timeout=0.05, timeout_counter=counter)
+    assert await call_timeout.run(asyncio.sleep(0, result='result')) == 'result'
+
+    cancel_event = threading.Event()
+    with pytest.raises(CallTimeoutError):
+        await call_timeout.run(asyncio.sleep(1), cancel_event)
+    assert cancel_event.is_set()
+    assert counter.value == 1
+
+
+@pytest.mark.asyncio
+async def test_call_timeout_iterate_keeps_items_before_the_timeout():
+    counter = _Counter()
+    call_timeout = CallTimeout('route', timeout=0.05, timeout_counter=counter)
+    closed = []
+
+    async def gen():
+        try:
+            for i in range(10):
+                yield i
+                await asyncio.sleep(0.02)
+        finally:
+            closed.append(1)
+
+    items = []
+    with pytest.raises(CallTimeoutError):
+        async for item in call_timeout.iterate(gen()):
+            items.append(item)
+    assert 0 < len(items) < 10
+    assert closed == [1]
+    assert counter.value == 1
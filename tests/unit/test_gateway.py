@@ -0,0 +1,683 @@
+import asyncio
+import json
+import os
+from types import SimpleNamespace
+from typing import Dict, List
+
+import pytest
+from pydantic import Field, create_model
+
+from lcserve.backend.batching import BatchConfig, get_batched_fields
+from lcserve.backend.concurrency import AdmissionController
+from lcserve.backend.gateway import (
+    WS_DISCONNECT_POLL_INTERVAL,
+    CallPlan,
+    ClosingStreamingResponse,
+    DurationSampler,
+    LazyRoute,
+    RouteType,
+    ServingGateway,
+    StartupMode,
+    _close_after,
+    _create_models,
+    _get_func_data,
+    create_http_route,
+    create_websocket_route,
+)
+from lcserve.backend.workers import ThreadWorkerPool
+
+
+def _models():
+    input_model = create_model(
+        'InputDummy',
+        question=(str, ...),
+        envs=(Dict[str, str], Field(default={}, alias='envs')),
+    )
+    output_model = create_model('OutputDummy', result=(str, ...), error=(str, ...))
+    return input_model, output_model
+
+
+def test_call_plan_with_kwargs():
+    def dummy(question: str, **kwargs) -> str:
+        return question
+
+    input_model, output_model = _models()
+    call_plan = CallPlan.from_func(dummy, input_model, output_model)
+    assert call_plan.inject_auth_response
+    assert call_plan.inject_workspace
+    assert call_plan.inject_extras
+
+    func_data, envs = _get_func_data(
+        call_plan,
+        input_model(question='hi', envs={'A': 'B'}),
+        files_data={},
+        auth_response='user',
+        workspace='/tmp',
+        to_support_in_kwargs={'tracing_handler': None},
+    )
+    assert envs == {'A': 'B'}
+    assert func_data == {
+        'question': 'hi',
+        'auth_response': 'user',
+        'workspace': '/tmp',
+        'tracing_handler': None,
+    }
+
+
+def test_call_plan_without_kwargs():
+    def dummy(question: str, workspace: str) -> str:
+        return question
+
+    input_model, output_model = _models()
+    call_plan = CallPlan.from_func(dummy, input_model, output_model)
+    assert not call_plan.inject_auth_response
+    assert call_plan.inject_workspace
+    assert not call_plan.inject_extras
+
+    func_data, _ = _get_func_data(
+        call_plan,
+        {'question': 'hi'},
+        files_data={},
+        auth_response='user',
+        workspace='/tmp',
+        to_support_in_kwargs={'tracing_handler': None},
+    )
+    assert func_data == {'question': 'hi', 'workspace': '/tmp'}
+
+
+def test_batch_models_take_and_return_single_items():
+    def embed(texts: List[str], model: str = 'small') -> List[List[float]]:
+        pass
+
+    input_model, output_model, _ = _create_models(embed, batch=True)
+    assert input_model(texts='hi').texts == 'hi'
+    assert output_model(result=[0.1], error='').result == [0.1]
+
+    # without batching, the lists are kept
+    input_model, _, _ = _create_models(embed)
+    assert input_model(texts=['hi']).texts == ['hi']
+
+
+def test_batch_functions_can_not_be_streamed():
+    def embed(texts: List[str]) -> List[str]:
+        return texts
+
+    input_model, output_model, _ = _create_models(embed, batch=True)
+    call_plan = CallPlan.from_func(
+        embed,
+        input_model=input_model,
+        output_model=output_model,
+        batched_fields=get_batched_fields(embed),
+    )
+    gateway = SimpleNamespace(
+        logger=SimpleNamespace(info=lambda *args: None), batch_size_histogram=None
+    )
+    assert ServingGateway._create_batcher(gateway, call_plan, BatchConfig()) is not None
+    with pytest.raises(ValueError, match='streamed'):
+        ServingGateway._create_batcher(
+            gateway, call_plan, BatchConfig(), streaming=True
+        )
+
+
+class _Counter:
+    def __init__(self):
+        self.values = {}
+
+    def add(self, value, attributes):
+        _key = (attributes['route'], attributes['protocol'])
+        self.values[_key] = self.values.get(_key, 0) + value
+
+
+@pytest.mark.asyncio
+async def test_duration_sampler_reports_in_progress_requests():
+    counter = _Counter()
+    sampler = DurationSampler(interval=0.05, counter=counter)
+
+    ids = [sampler.start('/ask', 'http') for _ in range(3)]
+    await asyncio.sleep(0.12)
+    # in-progress durations were reported, without waiting for the requests
+    assert counter.values[('/ask', 'http')] == pytest.approx(3 * 0.1, abs=0.05)
+
+    for request_id in ids:
+        sampler.stop(request_id)
+    assert counter.values[('/ask', 'http')] == pytest.approx(3 * 0.12, abs=0.05)
+    assert sampler.active == 0
+
+    # the sampling task stops once there are no requests left
+    await asyncio.sleep(0.1)
+    assert sampler._task.done()
+
+
+@pytest.mark.asyncio
+async def test_lazy_route_registers_once_and_dispatches_again():
+    registered, dispatched = [], []
+
+    async def router(scope, receive, send):
+        dispatched.append(scope['path'])
+
+    lazy_route = LazyRoute('ask', lambda: registered.append('ask'), router=router)
+    await lazy_route({'type': 'http', 'path': '/ask'}, None, None)
+    # warmup after the first request doesn't register the route again
+    lazy_route.register()
+    assert registered == ['ask']
+    assert dispatched == ['/ask']
+
+
+@pytest.mark.asyncio
+async def test_lazy_route_registers_again_after_a_failure():
+    attempts, dispatched = [], []
+
+    def register():
+        attempts.append('ask')
+        if len(attempts) == 1:
+            raise ValueError('could not create the models')
+
+    async def router(scope, receive, send):
+        dispatched.append(scope['path'])
+
+    lazy_route = LazyRoute('ask', register, router=router)
+    with pytest.raises(ValueError):
+        await lazy_route({'type': 'http', 'path': '/ask'}, None, None)
+    assert dispatched == []
+
+    await lazy_route({'type': 'http', 'path': '/ask'}, None, None)
+    lazy_route.register()
+    assert attempts == ['ask', 'ask']
+    assert dispatched == ['/ask']
+
+
+def test_lazy_route_keeps_the_placeholder_until_the_route_is_created():
+    from fastapi import FastAPI
+
+    failures = [ValueError('could not create the models')]
+
+    def register_func(func, dirname=None, lazy=None):
+        if failures:
+            raise failures.pop()
+
+    def ask(question: str) -> str:
+        return question
+
+    gateway = SimpleNamespace(
+        app=FastAPI(),
+        logger=SimpleNamespace(debug=lambda *args: None),
+        _lazy_routes=[],
+        _register_func=register_func,
+    )
+    ServingGateway._register_lazy_route(gateway, ask, '.', RouteType.HTTP)
+    placeholder = gateway.app.router.routes[-1]
+
+    lazy_route = gateway._lazy_routes[0]
+    with pytest.raises(ValueError):
+        lazy_route.register()
+    assert gateway.app.router.routes[-1] is placeholder
+
+    lazy_route.register()
+    assert placeholder not in gateway.app.router.routes
+
+
+@pytest.mark.asyncio
+async def test_closing_streaming_response_closes_the_stream_on_send_errors():
+    closed = []
+
+    async def stream():
+        try:
+            for i in range(3):
+                yield str(i)
+        finally:
+            closed.append(True)
+
+    async def send(message):
+        if message['type'] == 'http.response.body' and message['body']:
+            raise OSError('client is gone')
+
+    with pytest.raises(OSError):
+        await ClosingStreamingResponse(stream()).stream_response(send)
+    assert closed == [True]
+
+
+def test_process_executors_reject_functions_taking_files():
+    from fastapi import FastAPI, UploadFile
+
+    def summarize(file: UploadFile) -> str:
+        return file.filename
+
+    gateway = SimpleNamespace(app=FastAPI(), logger=None)
+    with pytest.raises(ValueError, match='uploaded files'):
+        ServingGateway._register_route(gateway, summarize, executor='process')
+
+
+@pytest.mark.asyncio
+async def test_close_after_closes_when_the_stream_is_closed():
+    closed = []
+
+    async def stream():
+        for i in range(3):
+            yield str(i)
+
+    async def send(message):
+        if message['type'] == 'http.response.body' and message['body']:
+            raise OSError('client is gone')
+
+    response = ClosingStreamingResponse(
+        _close_after(stream(), lambda: closed.append(True))
+    )
+    with pytest.raises(OSError):
+        await response.stream_response(send)
+    assert closed == [True]
+
+
+@pytest.mark.asyncio
+async def test_websocket_functions_read_their_own_frames_during_a_call():
+    import logging
+
+    from fastapi import FastAPI
+
+    async def converse(question: str, **kwargs) -> str:
+        websocket = kwargs['websocket']
+        await websocket.send_json({'prompt': question})
+        # not taken by the disconnect watcher of the route
+        reply = await websocket.receive_json()
+        return reply['answer']
+
+    input_model, output_model, _ = _create_models(converse)
+    app = FastAPI()
+    create_websocket_route(
+        app=app,
+        call_plan=CallPlan.from_func(
+            converse, input_model=input_model, output_model=output_model
+        ),
+        dirname='.',
+        auth=None,
+        worker_pool=ThreadWorkerPool(),
+        include_ws_callback_handlers=True,
+        openai_tracing=False,
+        send_buffer_size=8,
+        streaming_handler_kwargs={},
+        fast_response=False,
+        upload_config=None,
+        multiplex_max_calls=None,
+        admission=AdmissionController('converse'),
+        call_timeout=None,
+        first_frame_histogram=None,
+        frame_rate_histogram=None,
+        ws_kwargs={'path': '/converse', 'name': 'Converse'},
+        workspace='.',
+        logger=logging.getLogger(__name__),
+        tracer=None,
+    )
+
+    received, sent = asyncio.Queue(), asyncio.Queue()
+    scope = {
+        'type': 'websocket',
+        'path': '/converse',
+        'headers': [],
+        'query_string': b'',
+        'root_path': '',
+        'subprotocols': [],
+    }
+    readers = []
+
+    async def _receive():
+        # like the `websockets` transport of uvicorn, one reader at a time
+        if readers:
+            raise RuntimeError('Another coroutine is already waiting for a message')
+        readers.append(None)
+        try:
+            return await received.get()
+        finally:
+            readers.pop()
+
+    connection = asyncio.ensure_future(app(scope, _receive, sent.put))
+
+    async def _receive_json():
+        while True:
+            message = await asyncio.wait_for(sent.get(), 5)
+            if message['type'] == 'websocket.send':
+                return json.loads(message['text'])
+
+    await received.put({'type': 'websocket.connect'})
+    await received.put(
+        {'type': 'websocket.receive', 'text': json.dumps({'question': 'name?'})}
+    )
+    assert await _receive_json() == {'prompt': 'name?'}
+    # sent after a few disconnect checks
+    await asyncio.sleep(3 * WS_DISCONNECT_POLL_INTERVAL)
+    await received.put(
+        {'type': 'websocket.receive', 'text': json.dumps({'answer': 'lcserve'})}
+    )
+    assert (await _receive_json())['result'] == 'lcserve'
+    await asyncio.wait_for(connection, 5)
+
+
+@pytest.mark.asyncio
+async def test_async_generators_are_streamed_when_the_worker_pool_is_full():
+    import logging
+    import threading
+
+    from fastapi import FastAPI
+
+    from lcserve.backend.decorators import serving
+
+    @serving
+    async def tokens(question: str, **kwargs):
+        for token in question.split():
+            yield token
+
+    input_model, output_model, _ = _create_models(tokens)
+    worker_pool = ThreadWorkerPool(max_workers=1, queue_size=0)
+    app = FastAPI()
+    create_http_route(
+        app=app,
+        call_plan=CallPlan.from_func(
+            tokens, input_model=input_model, output_model=output_model
+        ),
+        dirname='.',
+        auth_func=None,
+        file_params=[],
+        upload_config=None,
+        worker_pool=worker_pool,
+        openai_tracing=False,
+        streaming=False,
+        streaming_handler_kwargs={},
+        fast_response=False,
+        route_cache=None,
+        single_flight=None,
+        admission=AdmissionController('tokens'),
+        call_timeout=None,
+        batcher=None,
+        post_kwargs={'path': '/tokens'},
+        workspace='.',
+        logger=logging.getLogger(__name__),
+        tracer=None,
+    )
+
+    # the only worker is busy, and nothing can be queued
+    release = threading.Event()
+    busy = asyncio.ensure_future(worker_pool.run(release.wait))
+    await asyncio.sleep(0.05)
+
+    scope = {
+        'type': 'http',
+        'method': 'POST',
+        'path': '/tokens',
+        'headers': [(b'content-type', b'application/json')],
+        'query_string': b'',
+        'root_path': '',
+        'scheme': 'http',
+        'server': ('testserver', 80),
+        'client': ('testclient', 50000),
+        'http_version': '1.1',
+    }
+    body = json.dumps({'question': 'one two'}).encode()
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    sent = []
+
+    async def _receive():
+        if messages:
+            return messages.pop()
+        await asyncio.Event().wait()
+
+    async def _send(message):
+        sent.append(message)
+
+    try:
+        await asyncio.wait_for(app(scope, _receive, _send), 5)
+    finally:
+        release.set()
+        await busy
+
+    assert sent[0]['status'] == 200
+    assert b'one' in b''.join(m.get('body', b'') for m in sent[1:])
+
+
+def test_workspace_is_resolved_once_per_gateway():
+    gateway = SimpleNamespace()
+    workspace = ServingGateway.workspace.__get__(gateway)
+    assert ServingGateway.workspace.__get__(gateway) == workspace
+    assert os.path.isdir(workspace)
+
+
+@pytest.mark.parametrize('parallel_imports', [False, True])
+def test_modules_are_imported_in_parallel_only_if_asked(parallel_imports):
+    import logging
+    import threading
+
+    threads = []
+
+    def _load_module(mod):
+        threads.append(threading.current_thread().name)
+
+    gateway = SimpleNamespace(
+        _modules=['first', 'second'],
+        _parallel_imports=parallel_imports,
+        _startup_mode=StartupMode.LAZY,
+        _load_module=_load_module,
+        logger=logging.getLogger(__name__),
+    )
+    ServingGateway._register_modules(gateway)
+    assert len(threads) == 2
+    assert all(name.startswith('lcserve-import') for name in threads) is (
+        parallel_imports
+    )
+
+
+@pytest.mark.asyncio
+async def test_multiplexed_calls_are_admitted_one_by_one():
+    import logging
+
+    from fastapi import FastAPI
+
+    release = asyncio.Event()
+
+    async def answer(question: str, **kwargs) -> str:
+        await release.wait()
+        return question
+
+    input_model, output_model, _ = _create_models(answer)
+    app = FastAPI()
+    create_websocket_route(
+        app=app,
+        call_plan=CallPlan.from_func(
+            answer, input_model=input_model, output_model=output_model
+        ),
+        dirname='.',
+        auth=None,
+        worker_pool=ThreadWorkerPool(),
+        include_ws_callback_handlers=False,
+        openai_tracing=False,
+        send_buffer_size=8,
+        streaming_handler_kwargs={},
+        fast_response=False,
+        upload_config=None,
+        multiplex_max_calls=16,
+        admission=AdmissionController('answer', max_concurrency=1, max_queue=1),
+        call_timeout=None,
+        first_frame_histogram=None,
+        frame_rate_histogram=None,
+        ws_kwargs={'path': '/answer', 'name': 'Answer'},
+        workspace='.',
+        logger=logging.getLogger(__name__),
+        tracer=None,
+    )
+
+    received, sent = asyncio.Queue(), asyncio.Queue()
+    scope = {
+        'type': 'websocket',
+        'path': '/answer',
+        'headers': [],
+        'query_string': b'',
+        'root_path': '',
+        'subprotocols': [],
+    }
+    connection = asyncio.ensure_future(app(scope, received.get, sent.put))
+
+    async def _receive_json():
+        while True:
+            message = await asyncio.wait_for(sent.get(), 5)
+            assert message['type'] != 'websocket.close'
+            if message['type'] == 'websocket.send':
+                return json.loads(message['text'])
+
+    await received.put({'type': 'websocket.connect'})
+    # one call running, one waiting, and one beyond the queue
+    for request_id in ('1', '2', '3'):
+        await received.put(
+            {
+                'type': 'websocket.receive',
+                'text': json.dumps({'__id__': request_id, 'question': request_id}),
+            }
+        )
+    assert (await _receive_json())['__id__'] == '3'
+    assert await _receive_json() == {'__id__': '3', '__event__': 'rejected'}
+
+    release.set()
+    frames = [await _receive_json() for _ in range(4)]
+    assert [f['result'] for f in frames if 'result' in f] == ['1', '2']
+    assert [f['__id__'] for f in frames if '__event__' in f] == ['1', '2']
+
+    await received.put({'type': 'websocket.disconnect', 'code': 1000})
+    await asyncio.wait_for(connection, 5)
+
+
+@pytest.mark.asyncio
+async def test_input_reads_frames_received_while_watching_for_a_disconnect():
+    import logging
+    import time
+
+    from fastapi import FastAPI
+
+    def ask(question: str) -> str:
+        # the answer arrives while the route watches for a disconnect
+        time.sleep(3 * WS_DISCONNECT_POLL_INTERVAL)
+        return input(question)
+
+    input_model, output_model, _ = _create_models(ask)
+    app = FastAPI()
+    create_websocket_route(
+        app=app,
+        call_plan=CallPlan.from_func(
+            ask, input_model=input_model, output_model=output_model
+        ),
+        dirname='.',
+        auth=None,
+        worker_pool=ThreadWorkerPool(),
+        include_ws_callback_handlers=False,
+        openai_tracing=False,
+        send_buffer_size=8,
+        streaming_handler_kwargs={},
+        fast_response=False,
+        upload_config=None,
+        multiplex_max_calls=None,
+        admission=AdmissionController('ask'),
+        call_timeout=None,
+        first_frame_histogram=None,
+        frame_rate_histogram=None,
+        ws_kwargs={'path': '/ask', 'name': 'Ask'},
+        workspace='.',
+        logger=logging.getLogger(__name__),
+        tracer=None,
+    )
+
+    received, sent = asyncio.Queue(), asyncio.Queue()
+    scope = {
+        'type': 'websocket',
+        'path': '/ask',
+        'headers': [],
+        'query_string': b'',
+        'root_path': '',
+        'subprotocols': [],
+    }
+    connection = asyncio.ensure_future(app(scope, received.get, sent.put))
+
+    async def _receive_json():
+        while True:
+            message = await asyncio.wait_for(sent.get(), 5)
+            if message['type'] == 'websocket.send':
+                return json.loads(message['text'])
+
+    await received.put({'type': 'websocket.connect'})
+    await received.put(
+        {'type': 'websocket.receive', 'text': json.dumps({'question': 'name?'})}
+    )
+    # sent right after the call, before the prompt
+    await received.put({'type': 'websocket.receive', 'text': 'lcserve'})
+    assert await _receive_json() == {'prompt': 'name?'}
+    assert (await _receive_json())['result'] == 'lcserve'
+    await asyncio.wait_for(connection, 5)
+
+
+@pytest.mark.asyncio
+async def test_batches_are_told_to_stop_once_they_time_out():
+    import logging
+    import threading
+
+    from fastapi import FastAPI
+
+    from lcserve.backend.batching import Batcher
+    from lcserve.backend.concurrency import CallTimeout
+
+    cancelled = threading.Event()
+
+    def embed(texts: List[str], **kwargs) -> List[int]:
+        if kwargs['cancel_event'].wait(5):
+            cancelled.set()
+        return [len(text) for text in texts]
+
+    input_model, output_model, _ = _create_models(embed, batch=True)
+    app = FastAPI()
+    create_http_route(
+        app=app,
+        call_plan=CallPlan.from_func(
+            embed,
+            input_model=input_model,
+            output_model=output_model,
+            batched_fields=get_batched_fields(embed),
+        ),
+        dirname='.',
+        auth_func=None,
+        file_params=[],
+        upload_config=None,
+        worker_pool=ThreadWorkerPool(),
+        openai_tracing=False,
+        streaming=False,
+        streaming_handler_kwargs={},
+        fast_response=False,
+        route_cache=None,
+        single_flight=None,
+        admission=AdmissionController('embed'),
+        call_timeout=CallTimeout('embed', timeout=0.1),
+        batcher=Batcher('embed', BatchConfig(max_batch_size=4, max_wait_ms=10)),
+        post_kwargs={'path': '/embed'},
+        workspace='.',
+        logger=logging.getLogger(__name__),
+        tracer=None,
+    )
+
+    scope = {
+        'type': 'http',
+        'method': 'POST',
+        'path': '/embed',
+        'headers': [(b'content-type', b'application/json')],
+        'query_string': b'',
+        'root_path': '',
+        'scheme': 'http',
+        'server': ('testserver', 80),
+        'client': ('testclient', 50000),
+        'http_version': '1.1',
+    }
+    body = json.dumps({'texts': 'text'}).encode()
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    sent = []
+
+    async def _receive():
+        if messages:
+            return messages.pop()
+        await asyncio.Event().wait()
+
+    async def _send(message):
+        sent.append(message)
+
+    await asyncio.wait_for(app(scope, _receive, _send), 5)
+    assert sent[0]['status'] == 504
+    assert await asyncio.get_running_loop().run_in_executor(None, cancelled.wait, 5)
@@ -0,0 +1,98 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+from lcserve.backend.playground.utils.helper import (
+    Capturing,
+    EnvironmentVarCtxtManager,
+    RequestEnvCtxtManager,
+    install_environ_proxy,
+    request_env,
+    request_env_overlay,
+    run_function,
+    uninstall_environ_proxy,
+)
+
+
+@pytest.mark.asyncio
+async def test_capturing_is_isolated_per_request():
+    def work(i: int):
+        for k in range(3):
+            print(f'{i}-{k}')
+            time.sleep(0.01)
+
+    async def request(i: int):
+        with Capturing() as stdout:
+            await run_function(work, i=i)
+            print(f'{i}-done')
+        return list(stdout)
+
+    results = await asyncio.gather(*[request(i) for i in range(5)])
+    for i, stdout in enumerate(results):
+        assert stdout == [f'{i}-0', f'{i}-1', f'{i}-2', f'{i}-done']
+
+
+@pytest.mark.asyncio
+async def test_request_envs_are_isolated_per_request():
+    os.environ['LCSERVE_TEST_BASE'] = 'base'
+
+    def work(i: int):
+        time.sleep(0.01)
+        os.environ['LCSERVE_TEST_WRITTEN'] = str(i)
+        return os.environ['LCSERVE_TEST_KEY'], os.getenv('LCSERVE_TEST_BASE')
+
+    async def request(i: int):
+        with RequestEnvCtxtManager({'LCSERVE_TEST_KEY': i}):
+            result = await run_function(work, i=i)
+            assert request_env()['LCSERVE_TEST_WRITTEN'] == str(i)
+            return result
+
+    results = await asyncio.gather(*[request(i) for i in range(5)])
+    assert results == [(str(i), 'base') for i in range(5)]
+    assert 'LCSERVE_TEST_KEY' not in os.environ
+    assert 'LCSERVE_TEST_WRITTEN' not in os.environ
+
+
+def test_environment_var_ctxt_manager_restores_envs():
+    os.environ['LCSERVE_TEST_BASE'] = 'base'
+    with EnvironmentVarCtxtManager(
+        {'LCSERVE_TEST_BASE': 'updated', 'LCSERVE_TEST_NEW': 'new'}
+    ):
+        assert os.environ['LCSERVE_TEST_BASE'] == 'updated'
+        assert os.environ['LCSERVE_TEST_NEW'] == 'new'
+
+    assert os.environ['LCSERVE_TEST_BASE'] == 'base'
+    assert 'LCSERVE_TEST_NEW' not in os.environ
+
+
+def test_request_env_overlay_includes_unset_envs():
+    os.environ['LCSERVE_TEST_BASE'] = 'base'
+    with RequestEnvCtxtManager({'LCSERVE_TEST_KEY': 'value'}):
+        del os.environ['LCSERVE_TEST_BASE']
+        assert request_env_overlay() == {
+            'LCSERVE_TEST_KEY': 'value',
+            'LCSERVE_TEST_BASE': None,
+        }
+
+    assert os.environ['LCSERVE_TEST_BASE'] == 'base'
+
+
+def test_environ_proxy_is_only_installed_while_needed():
+    environ = os.environ
+    with RequestEnvCtxtManager({'LCSERVE_TEST_KEY': 'value'}):
+        assert os.environ is not environ
+        assert os.environ['LCSERVE_TEST_KEY'] == 'value'
+    assert os.environ is environ
+
+    install_environ_proxy()
+    try:
+        with RequestEnvCtxtManager({'LCSERVE_TEST_KEY': 'value'}):
+            pass
+        # still installed for the gateway
+        assert os.environ is not environ
+    finally:
+        uninstall_environ_proxy()
+    assert os.environ is environ
+    assert 'LCSERVE_TEST_KEY' not in os.environ
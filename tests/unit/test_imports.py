@@ -0,0 +1,37 @@
+import subprocess
+import sys
+
+from lcserve.profiling import parse_importtime
+
+# generous, to not be flaky on slow CI machines; it's ~10ms on a laptop
+IMPORT_TIME_BUDGET_S = 0.5
+HEAVY_MODULES = ['hubble', 'jina', 'langchain', 'slack_bolt', 'slack_sdk']
+
+
+def _import_in_subprocess(statement: str):
+    script = (
+        f'import sys; {statement}; '
+        f'print(",".join(m for m in {HEAVY_MODULES!r} if m in sys.modules))'
+    )
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', script],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    imported = [m for m in process.stdout.strip().split(',') if m]
+    lcserve = next(e for e in parse_importtime(process.stderr) if e.name == 'lcserve')
+    return imported, lcserve.cumulative_s
+
+
+def test_serving_does_not_import_heavy_modules():
+    imported, import_time_s = _import_in_subprocess('from lcserve import serving')
+    assert imported == []
+    assert import_time_s < IMPORT_TIME_BUDGET_S
+
+
+def test_public_names_are_imported_on_access():
+    import lcserve
+
+    assert lcserve.serving is lcserve.backend.decorators.serving
+    assert 'SlackBot' in dir(lcserve)
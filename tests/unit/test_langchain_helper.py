@@ -0,0 +1,102 @@
+import asyncio
+import threading
+
+import pytest
+from pydantic import create_model
+
+from lcserve.backend.langchain_helper import (
+    AsyncStreamingWebsocketCallbackHandler,
+    StreamingWebsocketCallbackHandler,
+    WebsocketSender,
+)
+
+
+class _FakeWebsocket:
+    def __init__(self):
+        self.frames = []
+
+    async def send_json(self, data):
+        await asyncio.sleep(0)
+        self.frames.append(data)
+
+
+def _output_model():
+    return create_model('OutputDummy', result=(str, ...), error=(str, ...))
+
+
+@pytest.mark.asyncio
+async def test_streaming_handler_sends_a_frame_per_token():
+    websocket = _FakeWebsocket()
+    handler = AsyncStreamingWebsocketCallbackHandler(websocket, _output_model())
+    for token in ['a', 'b', 'c']:
+        await handler.on_llm_new_token(token)
+
+    assert websocket.frames == [
+        {'result': 'a', 'error': ''},
+        {'result': 'b', 'error': ''},
+        {'result': 'c', 'error': ''},
+    ]
+
+
+@pytest.mark.asyncio
+async def test_streaming_handler_coalesces_tokens():
+    websocket = _FakeWebsocket()
+    handler = AsyncStreamingWebsocketCallbackHandler(
+        websocket, _output_model(), flush_interval=0.05, flush_max_bytes=4
+    )
+    for token in ['a', 'b', 'c', 'd', 'e']:
+        await handler.on_llm_new_token(token)
+
+    # flushed as soon as the frame reaches flush_max_bytes
+    assert websocket.frames == [{'result': 'abcd', 'error': ''}]
+
+    # the rest is flushed after flush_interval
+    await asyncio.sleep(0.1)
+    assert websocket.frames[1:] == [{'result': 'e', 'error': ''}]
+
+    await handler.on_llm_new_token('f')
+    await handler.on_llm_end(None)
+    assert websocket.frames[2:] == [{'result': 'f', 'error': ''}]
+
+
+@pytest.mark.asyncio
+async def test_sync_streaming_handler_sends_in_order_through_the_sender():
+    websocket = _FakeWebsocket()
+    sender = WebsocketSender(websocket, buffer_size=2)
+    sender.start()
+    handler = StreamingWebsocketCallbackHandler(sender, _output_model())
+
+    def work():
+        for i in range(20):
+            handler.on_llm_new_token(str(i))
+
+    # the thread waits for room in the buffer instead of running a loop per token
+    thread = threading.Thread(target=work)
+    thread.start()
+    while thread.is_alive():
+        await asyncio.sleep(0.01)
+
+    await sender.flush()
+    assert [f['result'] for f in websocket.frames] == [str(i) for i in range(20)]
+    sender.close()
+
+
+@pytest.mark.asyncio
+async def test_sync_streaming_handler_flushes_after_flush_interval():
+    websocket = _FakeWebsocket()
+    sender = WebsocketSender(websocket)
+    sender.start()
+    handler = StreamingWebsocketCallbackHandler(
+        sender, _output_model(), flush_interval=0.05
+    )
+
+    # a single token, no next token or end of the llm run to send it
+    thread = threading.Thread(target=handler.on_llm_new_token, args=('a',))
+    thread.start()
+    while thread.is_alive():
+        await asyncio.sleep(0.01)
+
+    await asyncio.sleep(0.1)
+    await sender.flush()
+    assert websocket.frames == [{'result': 'a', 'error': ''}]
+    sender.close()
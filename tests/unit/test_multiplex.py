@@ -0,0 +1,55 @@
+import asyncio
+import json
+import threading
+
+import pytest
+
+from lcserve.backend.multiplex import MultiplexedCalls, MultiplexError, TaggedSender
+
+
+class _Sender:
+    def __init__(self):
+        self.loop = None
+        self.frames = []
+
+    async def send_text(self, data):
+        self.frames.append(json.loads(data))
+
+    async def send_json(self, data):
+        self.frames.append(data)
+
+
+@pytest.mark.asyncio
+async def test_frames_are_tagged_with_the_call_id():
+    sender = _Sender()
+    tagged = TaggedSender(sender, 'a')
+    await tagged.send_text('{"result": "hi", "error": ""}')
+    await tagged.send_text('{}')
+    await tagged.send_text('plain text')
+    await tagged.send_json({'result': 'hey'})
+    assert sender.frames == [
+        {'__id__': 'a', 'result': 'hi', 'error': ''},
+        {'__id__': 'a'},
+        {'__id__': 'a', 'text': 'plain text'},
+        {'__id__': 'a', 'result': 'hey'},
+    ]
+
+
+@pytest.mark.asyncio
+async def test_calls_are_limited_and_cancelled_by_id():
+    calls = MultiplexedCalls(max_calls=2)
+    cancel_event = threading.Event()
+    first = calls.start('a', asyncio.sleep(10), cancel_event=cancel_event)
+    calls.start('b', asyncio.sleep(0))
+    with pytest.raises(MultiplexError):
+        calls.start('a', asyncio.sleep(0))
+    with pytest.raises(MultiplexError):
+        calls.start('c', asyncio.sleep(0))
+
+    assert calls.cancel('a')
+    assert not calls.cancel('unknown')
+    await asyncio.sleep(0.01)
+    assert first.cancelled()
+    # for sync functions, which can't be cancelled in their thread
+    assert cancel_event.is_set()
+    assert len(calls) == 0
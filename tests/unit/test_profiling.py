@@ -0,0 +1,54 @@
+import os
+
+import lcserve
+from lcserve.profiling import parse_importtime, profile_imports, split_app_imports
+
+IMPORTTIME_OUTPUT = '''import time: self [us] | cumulative | imported package
+import time:       127 |        127 |   _io
+import time:       279 |        406 | _frozen_importlib_external
+import time:       500 |        500 |     langchain.schema
+import time:      1000 |       1500 |   langchain.chains
+import time:       200 |       1700 | langchain
+some other output on stderr
+import time:        50 |         50 | app
+'''
+
+
+def test_parse_importtime_builds_a_tree():
+    roots = parse_importtime(IMPORTTIME_OUTPUT)
+    assert [r.name for r in roots] == ['_frozen_importlib_external', 'langchain', 'app']
+
+    langchain = roots[1]
+    assert langchain.depth == 0
+    assert langchain.cumulative_s == 0.0017
+    assert langchain.self_s == 0.0002
+    assert [c.name for c in langchain.children] == ['langchain.chains']
+    assert [c.name for c in langchain.children[0].children] == ['langchain.schema']
+    assert langchain.children[0].children[0].depth == 2
+
+
+def test_split_app_imports_leaves_out_the_profiler():
+    output = (
+        'import time:       300 |        300 | lcserve.profiling\n'
+        'lcserve app import: start\n' + IMPORTTIME_OUTPUT + 'lcserve app import: 0.25\n'
+    )
+    app_output, import_time_s = split_app_imports(output)
+    assert import_time_s == 0.25
+    assert [r.name for r in parse_importtime(app_output)] == [
+        '_frozen_importlib_external',
+        'langchain',
+        'app',
+    ]
+
+
+def test_profile_imports_times_the_app_module(tmpdir, monkeypatch):
+    tmpdir.join('slow_dep.py').write('import time\ntime.sleep(0.2)\n')
+    tmpdir.join('slow_app.py').write('import slow_dep\n')
+    monkeypatch.chdir(tmpdir)
+    # the profiled interpreter imports lcserve too
+    monkeypatch.setenv('PYTHONPATH', os.path.dirname(os.path.dirname(lcserve.__file__)))
+
+    profile = profile_imports('slow_app')
+    # without the imports of the profiler
+    assert [e.name for e in profile['imports']] == ['slow_dep']
+    assert profile['import_time_s'] >= 0.2
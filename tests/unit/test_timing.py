@@ -0,0 +1,80 @@
+import asyncio
+import logging
+import time
+
+import pytest
+
+from lcserve.backend.timing import (
+    Phase,
+    create_histogram,
+    record_phase,
+    request_timer,
+    timed,
+)
+
+
+class _Histogram:
+    def __init__(self):
+        self.values = {}
+
+    def record(self, value, attributes):
+        self.values[attributes['phase']] = (
+            self.values.get(attributes['phase'], 0) + value
+        )
+
+
+def test_nested_phases_are_recorded_without_each_other():
+    histogram = _Histogram()
+    with request_timer(histogram, {'route': '/ask', 'protocol': 'http'}) as timer:
+        time.sleep(0.02)
+        timer.record_since_start(Phase.PARSE)
+        with timed(Phase.EXECUTE):
+            # e.g. waiting for a free worker, measured by the pool
+            record_phase(Phase.QUEUE, 0.01)
+            time.sleep(0.03)
+            with timed(Phase.SERIALIZE):
+                time.sleep(0.02)
+
+    assert histogram.values[Phase.PARSE] == pytest.approx(0.02, abs=0.01)
+    assert histogram.values[Phase.QUEUE] == 0.01
+    assert histogram.values[Phase.EXECUTE] == pytest.approx(0.02, abs=0.01)
+    assert histogram.values[Phase.SERIALIZE] == pytest.approx(0.02, abs=0.01)
+
+
+@pytest.mark.asyncio
+async def test_concurrent_phases_are_recorded_without_each_other():
+    histogram = _Histogram()
+
+    async def call():
+        with timed(Phase.EXECUTE):
+            await asyncio.sleep(0.02)
+            with timed(Phase.SERIALIZE):
+                await asyncio.sleep(0.02)
+
+    # e.g. the calls of a multiplexed websocket
+    with request_timer(histogram, {'route': '/ask', 'protocol': 'ws'}):
+        await asyncio.gather(call(), call())
+
+    assert histogram.values[Phase.EXECUTE] == pytest.approx(0.04, abs=0.015)
+    assert histogram.values[Phase.SERIALIZE] == pytest.approx(0.04, abs=0.015)
+
+
+def test_phases_outside_of_a_request_are_ignored():
+    with timed(Phase.EXECUTE):
+        record_phase(Phase.QUEUE, 0.01)
+
+
+def test_create_histogram_without_advisory_buckets(caplog):
+    class _Meter:
+        def create_histogram(self, name, description='', unit=''):
+            return name
+
+    with caplog.at_level(logging.WARNING):
+        for _ in range(2):
+            histogram = create_histogram(_Meter(), 'fallback', '', buckets=[0.1, 1])
+            assert histogram == 'fallback'
+
+    # once per histogram
+    _warnings = [r for r in caplog.records if '`fallback`' in r.getMessage()]
+    assert len(_warnings) == 1
+    assert 'ignored' in _warnings[0].getMessage()
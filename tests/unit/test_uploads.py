@@ -0,0 +1,142 @@
+import pytest
+
+from lcserve.backend.uploads import (
+    MalformedUploadError,
+    Upload,
+    UploadConfig,
+    UploadMode,
+    Uploads,
+    UploadTooLargeError,
+    parse_multipart,
+    receive_ws_file,
+)
+
+BOUNDARY = 'lcserve'
+HEADERS = {'content-type': f'multipart/form-data; boundary={BOUNDARY}'}
+
+
+def _body(data: str, content: bytes) -> bytes:
+    return (
+        (
+            f'--{BOUNDARY}\r\n'
+            'Content-Disposition: form-data; name="data"\r\n\r\n'
+            f'{data}\r\n'
+            f'--{BOUNDARY}\r\n'
+            'Content-Disposition: form-data; name="file"; filename="doc.pdf"\r\n'
+            'Content-Type: application/pdf\r\n\r\n'
+        ).encode()
+        + content
+        + f'\r\n--{BOUNDARY}--\r\n'.encode()
+    )
+
+
+async def _stream(body: bytes, chunk_size: int = 1000):
+    for i in range(0, len(body), chunk_size):
+        yield body[i : i + chunk_size]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('mode', list(UploadMode))
+async def test_files_are_spilled_to_the_workspace(mode, tmpdir):
+    content = bytes(range(256)) * 100
+    config = UploadConfig(mode=mode, spill_size=1024)
+    uploads = await parse_multipart(
+        HEADERS, _stream(_body('{"question": "?"}', content)), config, str(tmpdir)
+    )
+    assert uploads.fields == {'data': '{"question": "?"}'}
+    assert uploads.files['file'].size == len(content)
+    # written to disk, under the workspace
+    assert uploads.files['file'].file._rolled
+
+    param = uploads.params(['file'], mode)['file']
+    assert param.filename == 'doc.pdf'
+    if mode == UploadMode.STREAM:
+        assert b''.join([chunk async for chunk in param]) == content
+        assert b''.join(param) == content
+    elif mode == UploadMode.MMAP:
+        assert param[:] == content
+    else:
+        assert await param.read() == content
+    uploads.close()
+
+
+@pytest.mark.asyncio
+async def test_repeated_file_fields_close_the_replaced_file(tmpdir, monkeypatch):
+    closed = []
+    _close = Upload.close
+    monkeypatch.setattr(
+        Upload, 'close', lambda self: closed.append(self.filename) or _close(self)
+    )
+
+    body = _body('{}', b'first')
+    # the same field again, before the closing boundary
+    body = body[: -len(f'--{BOUNDARY}--\r\n')] + (
+        (
+            f'--{BOUNDARY}\r\n'
+            'Content-Disposition: form-data; name="file"; filename="doc2.pdf"\r\n\r\n'
+            'second\r\n'
+            f'--{BOUNDARY}--\r\n'
+        ).encode()
+    )
+    # in one chunk, the data of the first file is still pending when it's replaced
+    for chunk_size in [len(body), 7]:
+        uploads = await parse_multipart(
+            HEADERS, _stream(body, chunk_size), UploadConfig(), str(tmpdir)
+        )
+        assert uploads.files['file'].filename == 'doc2.pdf'
+        assert uploads.files['file'].size == len(b'second')
+        uploads.close()
+
+    assert closed == ['doc.pdf', 'doc2.pdf'] * 2
+
+
+@pytest.mark.asyncio
+async def test_larger_bodies_are_rejected_while_received(tmpdir):
+    body = _body('{}', b'x' * 10000)
+    config = UploadConfig(max_size=5000)
+    with pytest.raises(UploadTooLargeError):
+        await parse_multipart(
+            {**HEADERS, 'content-length': str(len(body))},
+            _stream(body),
+            config,
+            str(tmpdir),
+        )
+
+    # without a Content-Length, only the received bytes are counted
+    received = []
+
+    async def _counted(body):
+        async for chunk in _stream(body):
+            received.append(chunk)
+            yield chunk
+
+    with pytest.raises(UploadTooLargeError):
+        await parse_multipart(HEADERS, _counted(body), config, str(tmpdir))
+    assert sum(map(len, received)) <= 6000
+
+
+@pytest.mark.asyncio
+async def test_websocket_files_are_received_from_binary_frames(tmpdir):
+    content = b'x' * 5000
+    frames = iter([content[:2000], content[2000:]])
+
+    async def _receive_bytes():
+        return next(frames)
+
+    uploads = Uploads()
+    header = {'__file__': {'name': 'file', 'filename': 'doc.pdf', 'size': 5000}}
+    config = UploadConfig(max_size=8000, spill_size=1024)
+    await receive_ws_file(header, _receive_bytes, uploads, config, str(tmpdir))
+
+    param = uploads.params(['file'], UploadMode.FILE)['file']
+    assert param.filename == 'doc.pdf'
+    assert await param.read() == content
+
+    # 5000 bytes already received
+    with pytest.raises(UploadTooLargeError):
+        header = {'__file__': {'name': 'other', 'size': 5000}}
+        await receive_ws_file(header, _receive_bytes, uploads, config, str(tmpdir))
+
+    with pytest.raises(MalformedUploadError):
+        await receive_ws_file({'__file__': {}}, _receive_bytes, uploads, config, '')
+    uploads.close()
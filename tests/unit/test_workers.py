@@ -0,0 +1,195 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+from lcserve.backend import workers
+from lcserve.backend.playground.utils.helper import (
+    RequestDirCtxtManager,
+    RequestEnvCtxtManager,
+)
+from lcserve.backend.workers import (
+    ProcessWorkerPool,
+    ThreadWorkerPool,
+    WorkerPoolFullError,
+    _call_in_process_worker,
+)
+
+
+def process_func(a: int):
+    # run in a worker process
+    print(f'pid {os.getpid()}')
+    return {
+        'a': a,
+        'pid': os.getpid(),
+        'key': os.environ.get('LCSERVE_TEST_KEY'),
+        'base': os.environ.get('LCSERVE_TEST_BASE'),
+        'cwd': os.getcwd(),
+    }
+
+
+def process_sleep(seconds: float):
+    time.sleep(seconds)
+    return seconds
+
+
+@pytest.mark.asyncio
+async def test_thread_worker_pool_runs_sync_and_async_functions():
+    pool = ThreadWorkerPool(name='test', max_workers=2)
+
+    def sync_func(a: int) -> str:
+        return threading.current_thread().name
+
+    async def async_func(a: int) -> int:
+        return a
+
+    assert (await pool.run(sync_func, a=1)).startswith('lcserve-test')
+    assert await pool.run(async_func, a=1) == 1
+    pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_thread_worker_pool_rejects_when_queue_is_full():
+    pool = ThreadWorkerPool(name='test', max_workers=1, queue_size=1)
+    release = threading.Event()
+
+    def blocking():
+        release.wait(5)
+        return 'done'
+
+    running = asyncio.ensure_future(pool.run(blocking))
+    queued = asyncio.ensure_future(pool.run(blocking))
+    await asyncio.sleep(0.1)
+    assert pool.queued == 1
+
+    with pytest.raises(WorkerPoolFullError):
+        await pool.run(blocking)
+
+    # checked before a stream is started
+    with pytest.raises(WorkerPoolFullError):
+        pool.check_capacity(blocking)
+
+    async def async_func():
+        return 'done'
+
+    # async functions run on the loop, not in the pool
+    pool.check_capacity(async_func)
+
+    release.set()
+    assert await asyncio.gather(running, queued) == ['done', 'done']
+    pool.check_capacity(blocking)
+    assert pool.queued == 0
+    pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_thread_worker_pool_iterates_generators():
+    pool = ThreadWorkerPool(name='test', max_workers=1)
+
+    def sync_gen(n: int):
+        for i in range(n):
+            yield threading.current_thread().name, i
+
+    async def async_gen(n: int):
+        for i in range(n):
+            yield i
+
+    items = [item async for item in pool.iterate(sync_gen(3))]
+    assert [i for _, i in items] == [0, 1, 2]
+    assert all(name.startswith('lcserve-test') for name, _ in items)
+    assert [i async for i in pool.iterate(async_gen(3))] == [0, 1, 2]
+    pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_thread_worker_pool_applies_backpressure_to_generators():
+    pool = ThreadWorkerPool(name='test', max_workers=1)
+    produced = []
+    closed = threading.Event()
+
+    def sync_gen():
+        try:
+            for i in range(1000):
+                produced.append(i)
+                yield i
+        finally:
+            closed.set()
+
+    items = pool.iterate(sync_gen(), buffer_size=4)
+    async for item in items:
+        await asyncio.sleep(0.01)
+        if item == 4:
+            break
+
+    # the generator is only ahead of the consumer by the buffer size
+    assert len(produced) < 16
+    await items.aclose()
+    await asyncio.sleep(0.1)
+    assert closed.is_set()
+    pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_process_worker_pool_round_trip(tmpdir, capsys, monkeypatch):
+    # inherited by the spawned workers
+    monkeypatch.setenv('LCSERVE_TEST_BASE', 'base')
+    pool = ProcessWorkerPool('test', process_func, max_workers=1)
+    pool.start()
+    try:
+        with RequestEnvCtxtManager({'LCSERVE_TEST_KEY': 'value'}):
+            del os.environ['LCSERVE_TEST_BASE']
+            with RequestDirCtxtManager(str(tmpdir)):
+                result = await pool.run(process_func, a=1)
+
+        assert result['a'] == 1
+        assert result['pid'] != os.getpid()
+        # the request's overlay, unset keys included
+        assert (result['key'], result['base']) == ('value', None)
+        assert result['cwd'] == str(tmpdir)
+        # the stdout of the worker is replayed in the gateway
+        assert f'pid {result["pid"]}' in capsys.readouterr().out
+
+        # envs & cwd of the worker are restored after the call
+        result = await pool.run(process_func, a=2)
+        assert (result['key'], result['base']) == (None, 'base')
+        assert result['cwd'] == os.getcwd()
+    finally:
+        pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_process_worker_pool_rejects_when_queue_is_full():
+    pool = ProcessWorkerPool('test', process_sleep, max_workers=1, queue_size=0)
+    try:
+        running = asyncio.ensure_future(pool.run(process_sleep, seconds=0.5))
+        await asyncio.sleep(0)
+        with pytest.raises(WorkerPoolFullError):
+            await pool.run(process_sleep, seconds=0.5)
+        assert await running == 0.5
+    finally:
+        pool.shutdown()
+
+
+def test_process_worker_restores_envs_and_cwd(tmpdir, monkeypatch):
+    monkeypatch.setattr(workers, '_worker_module', sys.modules[__name__])
+    monkeypatch.setenv('LCSERVE_TEST_BASE', 'base')
+    cwd = os.getcwd()
+
+    result, stdout, _ = _call_in_process_worker(
+        'process_func',
+        {'a': 1},
+        {'LCSERVE_TEST_KEY': 'value', 'LCSERVE_TEST_BASE': None},
+        str(tmpdir),
+    )
+    assert (result['key'], result['base'], result['cwd']) == (
+        'value',
+        None,
+        str(tmpdir),
+    )
+    assert stdout == f'pid {os.getpid()}\n'
+    assert os.getcwd() == cwd
+    assert os.environ['LCSERVE_TEST_BASE'] == 'base'
+    assert 'LCSERVE_TEST_KEY' not in os.environ